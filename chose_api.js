@@ -3,6 +3,10 @@ let currentPair = null;
 let currentGeneration = 0;
 let currentEvalCount = 0;
 let evalsPerGen = 100;
+// /events（Server-Sent Events）につながっている間は、サーバーから進み具合と次のペアが届く
+let eventSource = null;
+let streamId = null;
+let pairQueue = [];
 
 // Update the status display
 function updateStatusDisplay() {
@@ -36,6 +40,74 @@ async function fetchStatus() {
     }
 }
 
+function showPair(data) {
+    currentPair = data;
+
+    document.getElementById("text-a").textContent = data.indiv_a.text;
+    document.getElementById("text-b").textContent = data.indiv_b.text;
+    document.getElementById("status").textContent =
+        "ペアID: " + data.pair_id + "（世代 " + data.generation + "）";
+}
+
+function applyProgress(data) {
+    currentGeneration = data.generation;
+    currentEvalCount = data.eval_count;
+    evalsPerGen = data.evals_per_gen;
+    updateStatusDisplay();
+}
+
+// 次のペアを表示する（届いているペアがなければ /pair で取る）
+function nextPair() {
+    const data = pairQueue.shift();
+    if (data) {
+        showPair(data);
+    } else if (streamId === null) {
+        fetchPair();
+    } else {
+        currentPair = null;
+        document.getElementById("status").textContent = "ペアを読み込み中...";
+    }
+}
+
+// サーバープッシュにつなぐ。使えないブラウザや切れている間は、これまでどおり /status と /pair を使う
+function connectEvents() {
+    if (!window.EventSource) {
+        fetchStatus();
+        return;
+    }
+    eventSource = new EventSource(API_BASE + "/events?pairs=1");
+    eventSource.addEventListener("hello", (e) => {
+        const data = JSON.parse(e.data);
+        streamId = data.stream_id;
+        pairQueue = [];
+        applyProgress(data);
+    });
+    eventSource.addEventListener("progress", (e) => applyProgress(JSON.parse(e.data)));
+    eventSource.addEventListener("generation", (e) => {
+        const data = JSON.parse(e.data);
+        applyProgress(data);
+        // 古い世代のペアは捨てて、この後に届く新しい世代のペアを待つ
+        pairQueue = pairQueue.filter((p) => p.generation >= data.generation);
+        if (currentPair && currentPair.generation < data.generation) {
+            currentPair = null;
+            nextPair();
+        }
+    });
+    eventSource.addEventListener("pair", (e) => {
+        const data = JSON.parse(e.data);
+        if (data.generation < currentGeneration) return;
+        if (currentPair) {
+            pairQueue.push(data);
+        } else {
+            showPair(data);
+        }
+    });
+    eventSource.onerror = () => {
+        // EventSource は自動でつなぎ直す。つながるまでは stream_id を付けない
+        streamId = null;
+    };
+}
+
 async function fetchPair() {
     document.getElementById("status").textContent = "ペアを読み込み中...";
     try {
@@ -44,12 +116,7 @@ async function fetchPair() {
             throw new Error("サーバーエラー");
         }
         const data = await res.json();
-        currentPair = data;
-
-        document.getElementById("text-a").textContent = data.indiv_a.text;
-        document.getElementById("text-b").textContent = data.indiv_b.text;
-        document.getElementById("status").textContent =
-            "ペアID: " + data.pair_id + "（世代 " + data.generation + "）";
+        showPair(data);
     } catch (e) {
         console.error(e);
         document.getElementById("status").textContent = "ペアの取得に失敗しました";
@@ -65,6 +132,9 @@ async function sendChoice(chosen) {
         indiv_b_id: currentPair.indiv_b.id,
         chosen: chosen   // "A" か "B"
     };
+    if (streamId !== null) {
+        payload.stream_id = streamId;  // 次のペアはストリームで届く
+    }
 
     try {
         const res = await fetch(API_BASE + "/choice", {
@@ -72,19 +142,34 @@ async function sendChoice(chosen) {
             headers: { "Content-Type": "application/json" },
             body: JSON.stringify(payload)
         });
+        if (res.status === 429 || res.status === 503) {
+            // 送りすぎ（429）かサーバーが混んでいる（503）。同じペアのまま、少し待ってから押してもらう
+            const wait = res.headers.get("Retry-After") || "数";
+            document.getElementById("status").textContent =
+                `混み合っています。${wait} 秒ほど待ってからもう一度選んでください`;
+            return;
+        }
+        if (res.status === 409) {
+            // 世代が変わった・期限が切れた・もう答えたペア。新しいペアを取り直す
+            currentPair = null;
+            fetchPair();
+            return;
+        }
         if (!res.ok) {
             throw new Error("送信エラー");
         }
         const data = await res.json();
         
         // Update local state from response
-        currentGeneration = data.generation;
-        currentEvalCount = data.eval_count;
-        evalsPerGen = data.evals_per_gen;
-        updateStatusDisplay();
+        applyProgress(data);
         
-        // 次のペアを取得
-        fetchPair();
+        // 次のペアを表示（ストリームが別のワーカーにつながっていると、次のペアは応答に入っている。
+        // ストリームにつながっていなければ取得）
+        if (data.pair) {
+            pairQueue.push(data.pair);
+        }
+        currentPair = null;
+        nextPair();
     } catch (e) {
         console.error(e);
         document.getElementById("status").textContent = "選択の送信に失敗しました";
@@ -111,8 +196,10 @@ async function evolveGeneration() {
         document.getElementById("status").textContent = 
             `世代 ${data.old_generation} → ${data.new_generation} に進化しました！`;
         
-        // Fetch a new pair from the new generation
-        fetchPair();
+        // Fetch a new pair from the new generation（ストリームにつながっていれば新しい世代のペアが届く）
+        if (streamId === null) {
+            fetchPair();
+        }
     } catch (e) {
         console.error(e);
         document.getElementById("status").textContent = "進化に失敗しました";
@@ -125,6 +212,6 @@ document.addEventListener("DOMContentLoaded", () => {
     document.getElementById("button-fetch").addEventListener("click", fetchPair);
     document.getElementById("button-evolve").addEventListener("click", evolveGeneration);
     
-    // Initialize status on page load
-    fetchStatus();
+    // Initialize status on page load（最初のペアもストリームで届く）
+    connectEvents();
 });
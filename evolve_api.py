@@ -1,25 +1,66 @@
+import asyncio
+import hmac
+import os
 import random
 import json
-from dataclasses import asdict
-from typing import List
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from dataclasses import replace
+from itertools import islice
+from typing import Iterator, List, Literal, Tuple
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
 
 # 進化エンジンから import
 from evolve_engine import (
     Individual,
+    IndividualIndex,
     Choice,
+    JsonlSink,
     PairLog,
+    PhaseTimer,
     initialize_population,
-    aggregate_results_from_logs,
     evolve_one_generation,
+    next_individual_id,
+    select_population,
 )
+from evolve_replay import (
+    EVENT_LOG_PATH,
+    SNAPSHOT_DIR,
+    EventLog,
+    find_run,
+    iter_events,
+    new_seed,
+    replay_state,
+    save_snapshot,
+)
+from evolve_archive import ARCHIVE_DIR, ColumnarArchive, append_missing_generations
+from evolve_diversity import DiversityMonitor
+from evolve_ingest import (
+    BatchWriter,
+    PairRegistry,
+    QueueFull,
+    RateLimitMiddleware,
+    TokenBucketLimiter,
+    retry_after_header,
+)
+from evolve_json import dumps, dumps_line, loads
+from evolve_kernels import CharClasses
+from evolve_lm import CharNgramLM, load_or_train
+from evolve_lm import prescreen as lm_prescreen
+from evolve_profiler import RequestProfiler
+from evolve_push import Broadcaster, format_sse
+from evolve_shared import SharedCounters, SharedPairRegistry, SharedState, SharedTokenBucketLimiter
+from evolve_surrogate import PreferenceSurrogate
 
 
 # ============
@@ -28,8 +69,40 @@ from evolve_engine import (
 
 
 
-
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # import 時ではなく起動時に集団を用意する（前回の run があれば復元する）
+    init_state()
+    announce()  # 起動時の世代と投票数を、知らせ済みとして覚えておく
+    broadcaster.bind(asyncio.get_running_loop())
+    watcher = asyncio.create_task(watch_shared_state()) if shared is not None else None
+    choice_writer.start()
+    yield
+    await choice_writer.stop()
+    if watcher is not None:
+        watcher.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# /choice は上限つきの行列に積み、1本のライターがまとめて書き込む（evolve_ingest.py）。
+# クライアントの IP（リバースプロキシの後ろなら uvicorn --proxy-headers で本当の IP にする）ごとに
+# CHOICE_RATE 票/秒・連続 CHOICE_BURST 票までに制限し（本文を読む前に 429）、
+# 書き込み待ちが CHOICE_QUEUE_MAX 件埋まっていたら 503 で断る。
+# バケットは既定ではワーカーごとなので、共有モード（EVOLVE_SHARED_STATE）では init_state で
+# 共有 SQLite のバケットに差し替える（そうしないと --workers N でクライアントごとの上限が N 倍になる）
+CHOICE_RATE = 2.0
+CHOICE_BURST = 10
+CHOICE_QUEUE_MAX = 1000
+choice_limiter = TokenBucketLimiter(CHOICE_RATE, CHOICE_BURST)
+choice_writer = BatchWriter(lambda batch: run_in_threadpool(write_choices, batch), maxsize=CHOICE_QUEUE_MAX)
+app.add_middleware(RateLimitMiddleware, limiter=lambda: choice_limiter, paths=["/choice"])
+
+# 払い出したペアの台帳。/choice は台帳にあるペアの票だけを受け付け、受け付けたら台帳から消す
+# （でっち上げの pair_id・期限切れ・二重投票・古い世代のペアは 409 で断る）。再起動すると台帳は空になる
+PAIR_TTL_SECONDS = 600.0
+PAIR_REGISTRY_MAX = 100000
+pair_registry = PairRegistry(PAIR_TTL_SECONDS, PAIR_REGISTRY_MAX)
 
 # CORS制限でfetchがブロックされている可能性があるのでこれで制限をゆるくする
 app.add_middleware(
@@ -38,13 +111,74 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],  # 429 / 503 のときに chose_api.js が待つ秒数を読む
 )
-# シンプルにメモリに現世代を持つ（起動時だけ初期化）
-current_population: List[Individual] = initialize_population(size=200, generation=0)
+# 投票と進化はすべてイベントログに残す（evolve_replay.py で任意の世代を復元できる）
+SNAPSHOT_EVERY = 50  # 何世代ごとにスナップショットを保存するか
+event_log = EventLog(EVENT_LOG_PATH)
+# pair_logs.jsonl とイベントログの順序をそろえるためのロック
+log_lock = threading.Lock()
+
+# uvicorn --workers N で動かすときは、環境変数 EVOLVE_SHARED_STATE に SQLite ファイルのパスを入れる。
+# 世代・投票数・pair_id・集団・代理モデルをそこで共有し、投票の追記と /evolve はプロセスをまたいで1つずつ行う。
+# 最初に起動したワーカーが run を復元（または開始）し、あとのワーカーはそれに合わせる（新しい run にするならファイルを消す）
+SHARED_STATE_PATH = os.environ.get("EVOLVE_SHARED_STATE")
+shared: Optional[SharedState] = None
+
+# シンプルにメモリに現世代を持つ（lifespan の init_state で初期化 or 復元）
+POPULATION_SIZE = 200
+RESTORE_ON_STARTUP = True  # False なら起動のたびに新しい run を始める
+run_id = ""
+current_population: List[Individual] = []
 next_pair_id = 0
+# 次の /evolve で子どもに振る最初の個体 id。払い出した id（選別で捨てた子どもの分も）より先へ進めるだけで、戻さない
+next_indiv_id = 0
 
 LOG_PATH = Path("pair_logs.jsonl")
 
+# 閉じた世代の投票は archive/<run_id>/ に列ごとの固定長整数で追記する（evolve_archive.py で読む）
+ARCHIVE_COMPRESS = False  # True なら世代ごとに圧縮した npz（メモリマップはできない）
+archive: Optional[ColumnarArchive] = None
+
+# /evolve のフェーズごとの時間とメモリブロック数を JSON Lines に残す（None なら計測しない）
+PHASE_LOG_PATH: Optional[Path] = None  # 例: Path("phases.jsonl")
+phase_timer = PhaseTimer(JsonlSink(str(PHASE_LOG_PATH)), auto_emit=False) if PHASE_LOG_PATH else None
+
+# /admin/profile で、次の N リクエストか S 秒だけエンドポイントをプロファイルする（profiles/ に保存）。
+# 環境変数 EVOLVE_ADMIN_TOKEN を設定したときだけ有効（X-Admin-Token ヘッダで渡す）
+ADMIN_TOKEN = os.environ.get("EVOLVE_ADMIN_TOKEN")
+profiler = RequestProfiler()
+
+# /status で現世代の文字種の割合を返すための表（ひらがな・カタカナ・記号など）
+char_classes = CharClasses.default()
+
+# 投票から学習する代理モデル。子どもを多めに作り、負けそうなものを人間に見せる前に落とす。
+# 学習した投票が PRESCREEN_MIN_VOTES 件に届くまでは選別しない（再起動すると学習し直し）
+PRESCREEN_OVERSAMPLE = 3  # 子どもを何倍作ってから選ぶか（1 なら選別しない）
+PRESCREEN_MIN_VOTES = 300
+PRESCREEN_EXPLORE = 0.1  # 残す子どものうち、代理モデルを無視してランダムに残す割合
+surrogate = PreferenceSurrogate()
+# 代理モデルが選別を始めるまで（投票が PRESCREEN_MIN_VOTES 件に届くまで）は、コーパスから学習した
+# 文字 n-gram 言語モデル（evolve_lm.py）で日本語らしい子どもを残す。
+# 環境変数 EVOLVE_LM_CORPUS にコーパスのパス（例: 文章プール.txt）を入れたときだけ有効
+LM_CORPUS_PATH = os.environ.get("EVOLVE_LM_CORPUS")
+LM_ORDER = 3
+lm: Optional[CharNgramLM] = None
+
+# 世代ごとの多様性（MinHash の平均類似度・クラスタ数）。集団が潰れたら collapsed になる
+diversity = DiversityMonitor()
+
+# 個体の id は世代をまたいで一意（エリートは id を持ち越す）。生き残っている個体の
+# wins / losses は、これまでのすべての世代の投票の累積を IndividualIndex で数える
+individuals = IndividualIndex()
+
+# /events（Server-Sent Events）で投票数の進み具合・世代の切り替え・次のペアをクライアントへ送る
+EVENTS_PAIRS_MAX = 8  # 1接続に先回りして送るペアの上限
+SHARED_POLL_SECONDS = 1.0  # 共有モードで、ほかのワーカーの進み具合を見に行く間隔
+broadcaster = Broadcaster()
+announce_lock = threading.Lock()
+announced: Tuple[int, int] = (-1, -1)  # 最後に知らせた (世代, 投票数)
+
 class LogEntry(BaseModel):
     pair_id: int
     indiv_a_id: int
@@ -52,22 +186,36 @@ class LogEntry(BaseModel):
     chosen: str
     timestamp: Optional[str] = None  # ← これを追加（ISO 8601 の文字列）
 
+
+class JSONBytesResponse(Response):
+    """
+    evolve_json でエンコードして返すレスポンス。
+    エンドポイントがこれを返すと、FastAPI の response_model の検証と jsonable_encoder を通らない。
+    response_model を宣言したエンドポイントでは、中身を必ずそのモデルから作る（model_dump）ので、
+    /docs のスキーマと実際のレスポンスは食い違わない。
+    """
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
 @app.get("/debug/logs", response_model=List[LogEntry])
 def get_logs(limit: int = 100):
-    logs = []
-    if LOG_PATH.exists():
-        with LOG_PATH.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    d = json.loads(line)
-                    logs.append(d)
-                except Exception:
-                    continue
-    # 最後の limit 件だけ返す
-    return logs[-limit:]
+    # 最後の limit 件だけ返す。0 以下なら全部（後ろから読めた行を limit 件集めたらやめる。読めない行は飛ばす）
+    lines = LOG_PATH.read_bytes().splitlines() if LOG_PATH.exists() else []
+    logs = deque()
+    for line in reversed(lines):
+        if 0 < limit <= len(logs):
+            break
+        if not line.strip():
+            continue
+        try:
+            logs.appendleft(LogEntry.model_validate(loads(line)).model_dump())
+        except Exception:
+            continue
+    return JSONBytesResponse(list(logs))
 
 # Generation state management
 # Note: This implementation is designed for single-user evaluation sessions.
@@ -76,6 +224,155 @@ EVALS_PER_GEN = 100  # Configurable: number of evaluations per generation
 current_generation = 0
 current_eval_count = 0
 
+# current_population / current_generation の組を差し替えるときのロック。
+# 公開した世代の Individual は書き換えないので、読む側はロック中に参照を取るだけでよい。
+state_lock = threading.Lock()
+
+
+def init_state() -> None:
+    """
+    イベントログに前回の run があればその最新世代を復元し、なければ新しい run を始める。
+    """
+    global run_id, current_population, current_generation, current_eval_count, next_pair_id, next_indiv_id
+    global surrogate, diversity, archive, shared, pair_registry, individuals, choice_limiter, lm
+
+    # 言語モデルはワーカーごとに持つ（学習結果は .lm_cache/ に保存され、2回目からはメモリマップで読むだけ）
+    lm = load_or_train(LM_CORPUS_PATH, order=LM_ORDER) if LM_CORPUS_PATH else None
+    shared = SharedState(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+    if shared is not None:
+        pair_registry = SharedPairRegistry(shared, PAIR_TTL_SECONDS, PAIR_REGISTRY_MAX)
+        choice_limiter = SharedTokenBucketLimiter(shared, CHOICE_RATE, CHOICE_BURST)
+    with state_lock:
+        run_id = ""  # 共有モードなら exclusive() で共有の run を読み込ませる
+    with exclusive():
+        if run_id:
+            return  # 別のワーカーが始めた run に合わせた
+        surrogate = PreferenceSurrogate()
+        diversity = DiversityMonitor()
+        individuals = IndividualIndex()  # 次の /evolve で、持ち越した wins / losses から作る
+        restored = None
+        if RESTORE_ON_STARTUP:
+            try:
+                find_run(EVENT_LOG_PATH)
+            except ValueError:
+                pass  # まだ run がない
+            else:
+                restored = replay_state(event_log_path=EVENT_LOG_PATH, snapshot_dir=SNAPSHOT_DIR)
+
+        if restored is not None:
+            new_run_id = restored.run_id
+            population = restored.population
+            generation = restored.generation
+            eval_count = len(restored.pending_logs)
+            pair_id = restored.next_pair_id
+            indiv_id = restored.next_indiv_id
+            # pair_logs.jsonl はイベントログに合わせる（/evolve が途中で止まると、閉じた世代の投票が残っている）
+            clear_logs_file()
+            append_pairlogs_to_file(restored.pending_logs)
+        else:
+            seed = new_seed()
+            new_run_id = f"{seed:016x}"
+            population = initialize_population(
+                size=POPULATION_SIZE, generation=0, rng=random.Random(seed)
+            )
+            generation = 0
+            eval_count = 0
+            pair_id = 0
+            indiv_id = next_individual_id(population)
+            clear_logs_file()  # 前の run の投票を新しい集団に混ぜない
+            event_log.append(
+                {
+                    "type": "init",
+                    "run_id": new_run_id,
+                    "generation": 0,
+                    "seed": seed,
+                    "population_size": len(population),
+                }
+            )
+        diversity.observe(generation, population)
+
+        archive = ColumnarArchive(ARCHIVE_DIR / new_run_id, compress=ARCHIVE_COMPRESS)
+
+        with state_lock:
+            run_id = new_run_id
+            current_population = population
+            current_generation = generation
+            current_eval_count = eval_count
+            next_pair_id = pair_id
+            next_indiv_id = indiv_id
+
+
+def snapshot_population() -> Tuple[int, List[Individual]]:
+    """(世代番号, その世代の集団) を食い違いなく取り出す（コピーはしない）"""
+    with state_lock:
+        return current_generation, current_population
+
+
+# ============
+# ワーカープロセス間の共有（EVOLVE_SHARED_STATE）
+# ============
+
+
+@contextmanager
+def exclusive() -> Iterator[None]:
+    """
+    投票の追記と /evolve を1つずつ行うためのロック。
+    共有モードではプロセスをまたいで1つずつにし、入るときに共有の状態を読み込み、出るときに書き戻す。
+    """
+    with log_lock:
+        if shared is None:
+            yield
+            return
+        with shared.lock():
+            pull_shared_state()
+            before = shared.read()
+            yield
+            push_shared_state(before)
+
+
+def pull_shared_state() -> None:
+    """共有の状態をこのワーカーのグローバル変数に読み込む（世代が変わっていれば集団と代理モデルも）"""
+    global run_id, current_population, current_generation, current_eval_count, next_pair_id, next_indiv_id
+    global surrogate, diversity, archive, individuals
+
+    counters = shared.read()
+    if counters is None:
+        return  # まだどのワーカーも run を始めていない
+    if (counters.run_id, counters.generation) != (run_id, current_generation):
+        counters, population = shared.read_population()
+        loaded = shared.load_surrogate()
+        if counters.run_id != run_id:
+            diversity = DiversityMonitor()
+            archive = None  # 次の /evolve で開く（ほかのワーカーが書いている途中には開かない）
+        surrogate = loaded if loaded is not None else PreferenceSurrogate()
+        # ほかのワーカーが進めた世代の投票はこの索引に入っていないので、持ち越した値から作り直させる
+        individuals = IndividualIndex()
+        diversity.observe(counters.generation, population)
+        with state_lock:
+            run_id = counters.run_id
+            current_population = population
+            current_generation = counters.generation
+    current_eval_count = counters.eval_count
+    next_pair_id = counters.next_pair_id
+    next_indiv_id = counters.next_indiv_id
+
+
+def push_shared_state(before: Optional[SharedCounters]) -> None:
+    """このワーカーで変えた状態を共有に書き戻す（世代が進んでいれば集団と代理モデルも）"""
+    counters = SharedCounters(run_id, current_generation, current_eval_count, next_pair_id, next_indiv_id)
+    if before is None or (before.run_id, before.generation) != (run_id, current_generation):
+        shared.publish(counters, current_population, surrogate)
+    else:
+        shared.publish(counters)
+
+
+def refresh_from_shared() -> None:
+    """共有モードなら、ほかのワーカーが進めた世代や数を読み込む（単独モードでは何もしない）"""
+    if shared is None:
+        return
+    with log_lock:
+        pull_shared_state()
+
 
 class IndivInfo(BaseModel):
     id: int
@@ -94,22 +391,27 @@ class ChoiceRequest(BaseModel):
     indiv_a_id: int
     indiv_b_id: int
     chosen: Choice  # "A" or "B"
+    stream_id: Optional[str] = None  # /events の stream_id を付けると、次のペアをそのストリームに送る
 
 
 def append_pairlog_to_file(log: PairLog, path: str = LOG_PATH) -> None:
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(asdict(log), ensure_ascii=False) + "\n")
+    append_pairlogs_to_file([log], path)
+
+
+def append_pairlogs_to_file(logs: List[PairLog], path: str = LOG_PATH) -> None:
+    with open(path, "ab") as f:
+        f.write(b"".join(dumps_line(log) for log in logs))
 
 
 def load_logs_from_file(path: str = LOG_PATH) -> List[PairLog]:
     """Load all PairLog entries from the JSONL file."""
     logs = []
     try:
-        with open(path, "r", encoding="utf-8") as f:
+        with open(path, "rb") as f:
             for line in f:
                 line = line.strip()
                 if line:
-                    data = json.loads(line)
+                    data = loads(line)
                     logs.append(PairLog(**data))
     except FileNotFoundError:
         pass  # No logs yet, return empty list
@@ -123,21 +425,39 @@ def clear_logs_file(path: str = LOG_PATH) -> None:
 
 
 @app.get("/pair", response_model=PairResponse)
+@profiler.wrap
 def get_pair():
     """
     比較用のペアを1組返す。
     """
+    refresh_from_shared()
+    return JSONBytesResponse(issue_pairs(1)[0].model_dump())
+
+
+def issue_pairs(count: int) -> List[PairResponse]:
+    """現世代から比較用のペアを count 組作る（pair_id はまとめて払い出す）"""
     global next_pair_id
-    a, b = random.sample(current_population, 2)
-    pair_id = next_pair_id
-    next_pair_id += 1
-
-    return PairResponse(
-        pair_id=pair_id,
-        generation=a.generation,
-        indiv_a=IndivInfo(id=a.id, text=a.text),
-        indiv_b=IndivInfo(id=b.id, text=b.text),
-    )
+    generation, population = snapshot_population()
+    if shared is not None:
+        first = shared.take_pair_id(count)  # ワーカー間で重ならないように共有の番号を使う
+    else:
+        with state_lock:
+            first = next_pair_id
+            next_pair_id += count
+
+    pairs = []
+    for pair_id in range(first, first + count):
+        a, b = random.sample(population, 2)
+        pairs.append(
+            PairResponse(
+                pair_id=pair_id,
+                generation=generation,
+                indiv_a=IndivInfo(id=a.id, text=a.text),
+                indiv_b=IndivInfo(id=b.id, text=b.text),
+            )
+        )
+    pair_registry.issue_many((p.pair_id, generation, p.indiv_a.id, p.indiv_b.id) for p in pairs)
+    return pairs
     
 def now_iso_jst() -> str:
     """
@@ -148,12 +468,25 @@ def now_iso_jst() -> str:
     return datetime.now(jst).isoformat()
 
 @app.post("/choice")
-def post_choice(req: ChoiceRequest):
+async def post_choice(req: ChoiceRequest):
     """
     ユーザーが A/B のどちらを選んだかを受け取り、ログファイルに追記する。
+    クライアントごとの上限を超えたら 429（RateLimitMiddleware）、書き込み待ちの行列が埋まっていたら 503
+    （どちらも Retry-After つき）。書き込みは choice_writer が1か所でまとめて行い、書き終わってから返す。
+    払い出していない・期限切れ・もう答えたペアと、世代が変わったあとのペアは 409、個体 id が違えば 400。
+    ここではペアを台帳から消さず、行列に積めた票の分だけ write_choices で消す
+    （400 や 503 ではペアが残るので、503 のあと同じペアで送り直せる）。
+    stream_id のストリームがこのワーカーにつながっていなければ、次のペアは応答の pair で返す。
     """
-    global current_eval_count
-    
+    if shared is not None:
+        issued = await run_in_threadpool(pair_registry.peek, req.pair_id)
+    else:
+        issued = pair_registry.peek(req.pair_id)
+    if issued is None:
+        raise HTTPException(status_code=409, detail="unknown, expired or already answered pair")
+    if (issued.indiv_a_id, issued.indiv_b_id) != (req.indiv_a_id, req.indiv_b_id):
+        raise HTTPException(status_code=400, detail="individual ids do not match the issued pair")
+
     log = PairLog(
         pair_id=req.pair_id,
         indiv_a_id=req.indiv_a_id,
@@ -162,32 +495,257 @@ def post_choice(req: ChoiceRequest):
         timestamp=now_iso_jst(),  # ← ここを追加
       
     )
-    append_pairlog_to_file(log)
-    
-    # Increment evaluation count for this generation
-    current_eval_count += 1
-    
-    return {
+    try:
+        result = await choice_writer.submit((log, req.stream_id))
+    except QueueFull as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": retry_after_header(e.retry_after)}
+        )
+    if result is None:
+        # 行列で待っている間に同じペアの票が先に入ったか、世代が変わった
+        raise HTTPException(status_code=409, detail="pair was answered meanwhile or its generation has ended")
+    generation, eval_count, next_pair = result
+
+    body = {
         "status": "ok",
-        "generation": current_generation,
-        "eval_count": current_eval_count,
+        "generation": generation,
+        "eval_count": eval_count,
         "evals_per_gen": EVALS_PER_GEN,
     }
+    if next_pair is not None:
+        body["pair"] = next_pair.model_dump()
+    return JSONBytesResponse(body)
+
+
+@profiler.wrap
+def write_choices(
+    batch: List[Tuple[PairLog, Optional[str]]]
+) -> List[Optional[Tuple[int, int, Optional[PairResponse]]]]:
+    """
+    choice_writer の書き込み本体（スレッドプールで動く）。(票, stream_id) のペアを台帳から消し、
+    まとめてログに追記して、票ごとに (世代, その票を入れた後の投票数, 応答で返す次のペア) を返す。
+    次のペアは stream_id のストリームに送り、このワーカーにつながっていなければ応答で返す。
+    行列で待っている間に台帳から消えていた（同じペアの票が先に入った・期限切れ）票と、
+    世代が変わっていた票は書かずに None を返す。
+    """
+    global current_eval_count
+
+    # 共有の台帳は自分でトランザクションを張るので、exclusive() に入る前に消す
+    issued = pair_registry.consume_many([log.pair_id for log, _ in batch])
+    generations = [pair.generation if pair is not None else None for pair in issued]
+    results: List[Optional[Tuple[int, int, Optional[PairResponse]]]] = []
+    with exclusive():
+        accepted = [
+            (log, stream_id)
+            for (log, stream_id), generation in zip(batch, generations)
+            if generation == current_generation
+        ]
+        append_pairlogs_to_file([log for log, _ in accepted])
+        event_log.extend(
+            {"type": "choice", "run_id": run_id, "generation": current_generation, **vars(log)}
+            for log, _ in accepted
+        )
+        for generation in generations:
+            if generation != current_generation:
+                results.append(None)
+                continue
+            # Increment evaluation count for this generation
+            current_eval_count += 1
+            results.append((current_generation, current_eval_count, None))
+
+    announce()
+    waiting = [i for i, ((_, stream_id), result) in enumerate(zip(batch, results)) if result and stream_id]
+    if waiting:
+        for i, pair in zip(waiting, issue_pairs(len(waiting))):
+            if not broadcaster.push_pair(batch[i][1], pair.generation, pair.model_dump_json()):
+                # 別のワーカーのストリームか、もう切れている。ストリームには届かないので応答で返す
+                results[i] = results[i][:2] + (pair,)
+    return results
+
+
+# ============
+# サーバープッシュ（/events）
+# ============
+
+
+def progress_payload() -> str:
+    generation, _ = snapshot_population()
+    return json.dumps(
+        {"generation": generation, "eval_count": current_eval_count, "evals_per_gen": EVALS_PER_GEN}
+    )
+
+
+def announce() -> None:
+    """
+    世代か投票数が前に知らせたときから変わっていれば、/events のクライアントに送る。
+    世代が変わったときは、その世代のペアも接続ごとに送り直す。
+    """
+    global announced
+    generation, _ = snapshot_population()
+    with announce_lock:
+        previous, announced = announced, (generation, current_eval_count)
+    if previous == announced or not len(broadcaster):
+        return
+    payload = progress_payload()
+    if previous[0] == generation:
+        broadcaster.publish("progress", generation, payload)
+        return
+
+    broadcaster.push_generation(generation, payload)
+    subscribers = [sub for sub in broadcaster.subscribers() if sub.want_pairs > 0]
+    pairs = iter(issue_pairs(sum(sub.want_pairs for sub in subscribers)))
+    for sub in subscribers:
+        for pair in islice(pairs, sub.want_pairs):
+            broadcaster.push_pair(sub.stream_id, pair.generation, pair.model_dump_json())
+
+
+async def watch_shared_state() -> None:
+    """共有モードで、ほかのワーカーが進めた投票数や世代をこのワーカーのクライアントに知らせる"""
+    while True:
+        await asyncio.sleep(SHARED_POLL_SECONDS)
+        if len(broadcaster):
+            await run_in_threadpool(refresh_from_shared)
+            await run_in_threadpool(announce)
+
+
+@app.get("/events")
+async def get_events(pairs: int = 1):
+    """
+    Server-Sent Events で進み具合（progress）・世代の切り替え（generation）・次のペア（pair）を送り続ける。
+    最初に hello で stream_id を送る。/choice に stream_id を付けると、次のペアがこのストリームに届く。
+    pairs は接続直後と世代が変わったときに送るペアの数（0 ならペアは送らない）。
+    """
+    if pairs < 0 or pairs > EVENTS_PAIRS_MAX:
+        raise HTTPException(status_code=400, detail=f"pairs must be 0..{EVENTS_PAIRS_MAX}")
+    try:
+        sub = broadcaster.subscribe(pairs)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+
+    def first_frames() -> List[str]:
+        refresh_from_shared()
+        generation, _ = snapshot_population()
+        sub.generation = generation
+        hello = json.dumps({"stream_id": sub.stream_id, **json.loads(progress_payload())})
+        return [format_sse("hello", hello)] + [
+            format_sse("pair", pair.model_dump_json()) for pair in issue_pairs(pairs)
+        ]
+
+    try:
+        first = await run_in_threadpool(first_frames)
+    except BaseException:
+        broadcaster.unsubscribe(sub)
+        raise
+    return StreamingResponse(
+        broadcaster.stream(sub, first),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+POPULATION_PAGE_MAX = 10000
+POPULATION_CHUNK = 256  # 何行ずつまとめて送るか
+
+
+def encode_cursor(generation: int, offset: int) -> str:
+    return f"{generation}:{offset}"
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        generation, offset = (int(x) for x in cursor.split(":"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"invalid cursor: {cursor!r}")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail=f"invalid cursor: {cursor!r}")
+    return generation, offset
+
+
+def iter_population_ndjson(population: List[Individual], start: int, stop: int) -> Iterator[str]:
+    """population[start:stop] を1行1個体の JSON で少しずつ返す（リストはコピーしない）"""
+    lines: List[str] = []
+    for ind in islice(population, start, stop):
+        lines.append(
+            json.dumps(
+                {
+                    "id": ind.id,
+                    "text": ind.text,
+                    "wins": ind.wins,
+                    "losses": ind.losses,
+                    "fitness": ind.fitness,
+                    "generation": ind.generation,
+                },
+                ensure_ascii=False,
+            )
+        )
+        if len(lines) >= POPULATION_CHUNK:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+@app.get("/population")
+@profiler.wrap
+def get_population(limit: int = 1000, cursor: Optional[str] = None):
+    """
+    現世代の個体を NDJSON でストリーミングして返す。
+    リクエスト開始時点の世代を使うので、途中で /evolve されても混ざらない。
+    続きがあればレスポンスヘッダ X-Next-Cursor を cursor に渡して次のページを取る。
+    cursor の世代がもう古い場合は 409 を返す。
+    """
+    if limit < 1 or limit > POPULATION_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be 1..{POPULATION_PAGE_MAX}")
+
+    refresh_from_shared()
+    generation, population = snapshot_population()
+    offset = 0
+    if cursor is not None:
+        cursor_generation, offset = decode_cursor(cursor)
+        if cursor_generation != generation:
+            raise HTTPException(
+                status_code=409,
+                detail=f"cursor is for generation {cursor_generation}, current is {generation}",
+            )
+
+    stop = min(offset + limit, len(population))
+    headers = {"X-Generation": str(generation), "X-Total-Count": str(len(population))}
+    if stop < len(population):
+        headers["X-Next-Cursor"] = encode_cursor(generation, stop)
+
+    return StreamingResponse(
+        iter_population_ndjson(population, offset, stop),
+        media_type="application/x-ndjson",
+        headers=headers,
+    )
 
 
 @app.get("/status")
+@profiler.wrap
 def get_status():
     """
     Return current generation and evaluation counts.
     """
+    refresh_from_shared()
+    generation, population = snapshot_population()
+    counts = char_classes.count_population(population)
+    total_chars = sum(len(ind.text) for ind in population)
+    report = diversity.latest()
     return {
-        "generation": current_generation,
+        "generation": generation,
         "eval_count": current_eval_count,
         "evals_per_gen": EVALS_PER_GEN,
+        # 現世代の全文字のうち、各文字種が占める割合
+        "char_class_ratio": {
+            name: (int(c.sum()) / total_chars if total_chars else 0.0) for name, c in counts.items()
+        },
+        "surrogate": surrogate.stats(),
+        "diversity": report._asdict() if report is not None else None,
     }
 
 
 @app.post("/evolve")
+@profiler.wrap
 def post_evolve():
     """
     Evolve to the next generation based on accumulated evaluation logs.
@@ -198,38 +756,142 @@ def post_evolve():
     3. Evolve the population using evolve_one_generation
     4. Update server state (generation, eval_count, population)
     5. Clear the log file for the new generation
+    seed と進化パラメータはイベントログに記録し、SNAPSHOT_EVERY 世代ごとにスナップショットを取る。
     """
-    global current_population, current_generation, current_eval_count
-    
+    with exclusive():
+        result = evolve_locked()
+    announce()
+    return result
+
+
+def evolve_locked() -> dict:
+    """post_evolve の本体。exclusive() の中で呼ぶ"""
+    global current_population, current_generation, current_eval_count, archive, next_indiv_id
+
+    phase = phase_timer.phase if phase_timer is not None else nullcontext
+    if archive is None:
+        archive = ColumnarArchive(ARCHIVE_DIR / run_id, compress=ARCHIVE_COMPRESS)
+    if archive.last_generation < current_generation - 1:
+        # イベントログに evolve を書いたあと、アーカイブに書く前に止まった世代がある。イベントログから書き足す
+        with phase("archive"):
+            append_missing_generations(archive, (e for _, e in iter_events(EVENT_LOG_PATH)), run_id)
+
     # Load logs
-    logs = load_logs_from_file()
+    with phase("load_logs"):
+        logs = load_logs_from_file()
     
     # Aggregate results to update wins/losses
-    aggregate_results_from_logs(current_population, logs)
+    # 公開中の世代は /population が読んでいるかもしれないので、コピーに集計する
+    # 生き残っている個体は前の世代までの wins / losses を持ち越しているので、索引に足して累積にする
+    with phase("aggregate"):
+        scored_population = [replace(ind) for ind in current_population]
+        individuals.observe(scored_population, current_generation)
+        individuals.add_votes(logs)
+        individuals.apply(scored_population)
+    # この世代の投票で代理モデルを評価（held-out）してから学習する
+    with phase("surrogate"):
+        surrogate_stats = surrogate.update_from_logs(current_population, logs)
     
     # Calculate evolution parameters
     population_size = len(current_population)
     elite_size = max(1, int(population_size * 0.1))  # 10% elite
     mutation_rate = 0.3
     next_generation_index = current_generation + 1
+    seed = new_seed()
+    rng = random.Random(seed)
+    # 以前のログから復元して next_indiv_id がまだ集団に追いついていなければ、集団の最大の id + 1 から
+    next_id = max(next_indiv_id, next_individual_id(current_population))
+
+    # 代理モデル（まだ学習が足りなければ言語モデル）が使えるなら子どもを多めに作る（エリートはそのまま）
+    num_elites = min(elite_size, len(scored_population))
+    num_children = max(0, population_size - num_elites)
+    prescreen_by = None
+    if PRESCREEN_OVERSAMPLE > 1:
+        if surrogate.trained_votes >= PRESCREEN_MIN_VOTES:
+            prescreen_by = "surrogate"
+        elif lm is not None:
+            prescreen_by = "lm"
+    prescreen = prescreen_by is not None
+    generated_size = num_elites + num_children * (PRESCREEN_OVERSAMPLE if prescreen else 1)
     
     # Evolve to next generation
     new_population = evolve_one_generation(
-        population=current_population,
-        population_size=population_size,
+        population=scored_population,
+        population_size=generated_size,
         elite_size=elite_size,
         mutation_rate=mutation_rate,
         next_generation_index=next_generation_index,
+        rng=rng,
+        timer=phase_timer,
+        next_id=next_id,
     )
+    # 子どもは選別で捨てるものも含めて next_id から連番なので、作った数だけ進める
+    issued_until = next_id + len(new_population) - num_elites
+    event = {
+        "type": "evolve",
+        "run_id": run_id,
+        "generation": current_generation,
+        "new_generation": next_generation_index,
+        "seed": seed,
+        "population_size": population_size,
+        "elite_size": elite_size,
+        "mutation_rate": mutation_rate,
+        "selection": "roulette",
+        "num_logs": len(logs),
+        "next_pair_id": next_pair_id,
+        "next_id": next_id,
+        "next_indiv_id": issued_until,
+    }
+    if prescreen:
+        with phase("prescreen"):
+            if prescreen_by == "surrogate":
+                children = surrogate.prescreen(
+                    new_population[num_elites:], keep=num_children, rng=rng, explore=PRESCREEN_EXPLORE
+                )
+            else:
+                children = lm_prescreen(
+                    new_population[num_elites:], lm, keep=num_children, rng=rng, explore=PRESCREEN_EXPLORE
+                )
+        kept = list(range(num_elites)) + [num_elites + i for i in children]
+        new_population = select_population(new_population, kept)
+        # リプレイでは generated_size 個作ってから kept の位置だけ残す（モデルの状態はいらない）
+        event["generated_size"] = generated_size
+        event["kept"] = kept
+        event["prescreen"] = prescreen_by
+    with phase("event_log"):
+        event_log.append(event)
+    # この世代はここで閉じたので、投票をアーカイブに残す（イベントログに書いてから。
+    # 書く前に止まっても、再起動後の /evolve でイベントログから書き足すので二重にはならない）
+    with phase("archive"):
+        archive.append_generation(current_generation, logs)
+    individuals.observe(new_population, next_generation_index)
+    individuals.prune(next_generation_index)
+    with phase("diversity"):
+        diversity_report = diversity.observe(next_generation_index, new_population)
+    if next_generation_index % SNAPSHOT_EVERY == 0:
+        with phase("snapshot"):
+            save_snapshot(
+                SNAPSHOT_DIR,
+                run_id,
+                next_generation_index,
+                new_population,
+                event_log.size(),
+                next_pair_id=next_pair_id,
+                next_indiv_id=issued_until,
+            )
     
     # Update server state
     old_generation = current_generation
-    current_population = new_population
-    current_generation = next_generation_index
-    current_eval_count = 0
+    with state_lock:
+        current_population = new_population
+        current_generation = next_generation_index
+        current_eval_count = 0
+        next_indiv_id = issued_until
     
     # Clear the log file for the new generation
     clear_logs_file()
+    if phase_timer is not None:
+        phase_timer.emit(next_generation_index, run_id=run_id, population_size=len(new_population))
     
     return {
         "status": "ok",
@@ -238,4 +900,71 @@ def post_evolve():
         "population_size": population_size,
         "elite_size": elite_size,
         "mutation_rate": mutation_rate,
+        "prescreened": prescreen,
+        "prescreened_by": prescreen_by,
+        "surrogate": surrogate_stats,
+        "diversity": diversity_report._asdict(),
     }
+
+
+# ============
+# プロファイル（管理用）
+# ============
+
+
+class ProfileRequest(BaseModel):
+    mode: Literal["deterministic", "sampling"] = "sampling"
+    requests: Optional[int] = None  # 次の何リクエストを測るか
+    seconds: Optional[float] = None  # 何秒間測るか（requests と両方なら先に来たほう）
+    interval_ms: float = 5.0  # sampling の間隔
+    top: int = 20  # 結果に載せる関数の数
+
+
+PROFILE_MAX_REQUESTS = 10000
+PROFILE_MAX_SECONDS = 3600.0
+
+
+def require_admin(token: Optional[str]) -> None:
+    """EVOLVE_ADMIN_TOKEN が未設定なら管理用エンドポイントはないことにする"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="invalid admin token")
+
+
+@app.post("/admin/profile")
+def start_profile(req: ProfileRequest, x_admin_token: Optional[str] = Header(None)):
+    """
+    次の req.requests リクエストか req.seconds 秒のあいだ、エンドポイントをプロファイルする。
+    """
+    require_admin(x_admin_token)
+    if req.requests is None and req.seconds is None:
+        raise HTTPException(status_code=400, detail="requests or seconds is required")
+    if req.requests is not None and not 1 <= req.requests <= PROFILE_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"requests must be between 1 and {PROFILE_MAX_REQUESTS}")
+    if req.seconds is not None and not 0 < req.seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILE_MAX_SECONDS}]")
+    if not 0.1 <= req.interval_ms <= 1000 or not 1 <= req.top <= 200:
+        raise HTTPException(status_code=400, detail="interval_ms must be in [0.1, 1000] and top in [1, 200]")
+    try:
+        profiler.start(req.mode, req.requests, req.seconds, req.interval_ms / 1000, req.top)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.status()
+
+
+@app.get("/admin/profile")
+def get_profile(x_admin_token: Optional[str] = Header(None)):
+    """計測中かどうかと、最後に終わった計測の結果（上位の関数）"""
+    require_admin(x_admin_token)
+    return profiler.status()
+
+
+@app.post("/admin/profile/stop")
+def stop_profile(x_admin_token: Optional[str] = Header(None)):
+    """計測を止めて結果を返す（計測していなければ最後の結果）"""
+    require_admin(x_admin_token)
+    result = profiler.stop()
+    if result is None:
+        raise HTTPException(status_code=404, detail="no profile yet")
+    return result
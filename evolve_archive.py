@@ -0,0 +1,332 @@
+"""
+過去の投票ログ（PairLog）を列ごとの固定長整数で保存するアーカイブ。
+
+JSON Lines だと1件 70 バイト前後あり、読むたびに json.loads が必要になる。
+ここでは列ごとに1ファイル（リトルエンディアンの生の配列）に追記していき、
+読み込みは np.memmap でファイルをそのまま NumPy 配列として見るだけにする。
+
+    archive/<run_id>/
+        meta.json        形式（raw / npz）・列の dtype・書き終えた最後の世代（last_generation）
+        pair_id.bin      int64
+        generation.bin   int64（追記順なので昇順）
+        a_id.bin         int64
+        b_id.bin         int64
+        choice.bin       uint8（A を選んだら 1、B なら 0）
+        timestamp.bin    int64（UNIX 時間のミリ秒。不明なら 0）
+
+compress=True の場合は世代ごとに gen_<世代>.npz（np.savez_compressed）を書く。
+こちらはメモリマップできないので、読み込み時に展開してつなげる。
+
+    columns = load_archive("archive/<run_id>")
+    wins, losses = aggregate_generation(columns, generation=120)
+
+    python evolve_archive.py archive/<run_id>              # 件数と世代の範囲を表示
+    python evolve_archive.py archive/<run_id> --from-events events.jsonl   # イベントログから作る（既存のアーカイブには足りない世代を書き足す）
+"""
+import argparse
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from evolve_engine import PairLog
+
+ARCHIVE_DIR = Path("archive")
+
+COLUMNS: Dict[str, str] = {
+    "pair_id": "<i8",
+    "generation": "<i8",
+    "a_id": "<i8",
+    "b_id": "<i8",
+    "choice": "u1",
+    "timestamp": "<i8",
+}
+
+
+class ArchiveColumns(NamedTuple):
+    pair_id: np.ndarray
+    generation: np.ndarray
+    a_id: np.ndarray
+    b_id: np.ndarray
+    choice: np.ndarray  # 1 = A を選んだ
+    timestamp: np.ndarray  # UNIX 時間のミリ秒（不明なら 0）
+
+    def __len__(self) -> int:
+        return int(self.pair_id.shape[0])
+
+
+def timestamp_to_millis(timestamp: Optional[str]) -> int:
+    """ISO 8601 の文字列を UNIX 時間のミリ秒に。None や読めないものは 0"""
+    if not timestamp:
+        return 0
+    try:
+        return int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+    except ValueError:
+        return 0
+
+
+def logs_to_columns(generation: int, logs: Sequence[PairLog]) -> Dict[str, np.ndarray]:
+    """PairLog のリストを列の辞書にする（A/B 以外の chosen の投票は捨てる）"""
+    logs = [log for log in logs if log.chosen in ("A", "B")]
+    n = len(logs)
+    return {
+        "pair_id": np.fromiter((log.pair_id for log in logs), dtype=COLUMNS["pair_id"], count=n),
+        "generation": np.full(n, generation, dtype=COLUMNS["generation"]),
+        "a_id": np.fromiter((log.indiv_a_id for log in logs), dtype=COLUMNS["a_id"], count=n),
+        "b_id": np.fromiter((log.indiv_b_id for log in logs), dtype=COLUMNS["b_id"], count=n),
+        "choice": np.fromiter((log.chosen == "A" for log in logs), dtype=COLUMNS["choice"], count=n),
+        "timestamp": np.fromiter(
+            (timestamp_to_millis(log.timestamp) for log in logs), dtype=COLUMNS["timestamp"], count=n
+        ),
+    }
+
+
+class ColumnarArchive:
+    """
+    1つの run の投票アーカイブ。世代が閉じるたびに append_generation を呼ぶ。
+    meta.json の last_generation（書き終えた最後の世代）までの世代をもう一度渡しても何もしないので、
+    イベントログから足りない世代を書き足すとき（archive_from_events）にそのまま使える。
+    """
+
+    def __init__(self, directory: Union[str, Path], compress: bool = False):
+        self.directory = Path(directory)
+        meta_path = self.directory / "meta.json"
+        if meta_path.exists():
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            # 既存のアーカイブは作ったときの形式に合わせる
+            self.compress = meta["format"] == "npz"
+            if not self.compress:
+                self._truncate_to_complete_rows()
+            self.last_generation = meta.get("last_generation")
+            if self.last_generation is None:
+                self.last_generation = self._last_written_generation()  # last_generation を持たない古い meta
+        else:
+            self.compress = compress
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.last_generation = -1
+            self._write_meta()
+
+    def _write_meta(self) -> None:
+        meta_path = self.directory / "meta.json"
+        tmp = meta_path.with_name(meta_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "format": "npz" if self.compress else "raw",
+                    "columns": COLUMNS,
+                    "last_generation": self.last_generation,
+                },
+                f,
+            )
+        tmp.replace(meta_path)
+
+    def _last_written_generation(self) -> int:
+        """書かれている投票の最後の世代（なければ -1）"""
+        if self.compress:
+            names = sorted(self.directory.glob("gen_*.npz"))
+            return int(names[-1].stem[len("gen_"):]) if names else -1
+        path = self.directory / "generation.bin"
+        itemsize = np.dtype(COLUMNS["generation"]).itemsize
+        rows = path.stat().st_size // itemsize if path.exists() else 0
+        if rows == 0:
+            return -1
+        return int(np.fromfile(path, dtype=COLUMNS["generation"], offset=(rows - 1) * itemsize, count=1)[0])
+
+    def _truncate_to_complete_rows(self) -> None:
+        """追記の途中で止まった列があれば、全列そろっている行数に切り詰める（列のずれを防ぐ）"""
+        paths = {name: self.directory / f"{name}.bin" for name in COLUMNS}
+        rows = min(
+            (paths[name].stat().st_size if paths[name].exists() else 0) // np.dtype(dtype).itemsize
+            for name, dtype in COLUMNS.items()
+        )
+        self._truncate_rows(rows)
+
+    def _truncate_rows(self, rows: int) -> None:
+        for name, dtype in COLUMNS.items():
+            path = self.directory / f"{name}.bin"
+            size = rows * np.dtype(dtype).itemsize
+            if path.exists() and path.stat().st_size != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def _drop_rows_from(self, generation: int) -> None:
+        """generation 以降の行を消す（meta を書く前に止まった世代の書きかけを捨てる）"""
+        path = self.directory / "generation.bin"
+        if not path.exists() or path.stat().st_size == 0:
+            return
+        generations = np.memmap(path, dtype=COLUMNS["generation"], mode="r")
+        rows = int(np.searchsorted(generations, generation, side="left"))
+        del generations
+        self._truncate_rows(rows)
+
+    def append_generation(self, generation: int, logs: Sequence[PairLog]) -> int:
+        """
+        generation の投票を追記して、書いた件数を返す。
+        last_generation 以前の世代は書き終えているので何もしない（0 を返す）。
+        """
+        if generation <= self.last_generation:
+            return 0
+        columns = logs_to_columns(generation, logs)
+        n = len(columns["pair_id"])
+        if self.compress:
+            if n:
+                path = self.directory / f"gen_{generation:06d}.npz"
+                tmp = path.with_name(path.name + ".tmp")
+                with open(tmp, "wb") as f:
+                    np.savez_compressed(f, **columns)
+                tmp.replace(path)
+        else:
+            self._drop_rows_from(generation)
+            if n:
+                for name, values in columns.items():
+                    with open(self.directory / f"{name}.bin", "ab") as f:
+                        f.write(values.tobytes())
+        # 投票のない世代も「書き終えた」と記録する（足りない世代かどうかを meta だけで判断できる）
+        self.last_generation = generation
+        self._write_meta()
+        return n
+
+
+def load_archive(directory: Union[str, Path], mmap: bool = True) -> ArchiveColumns:
+    """
+    アーカイブを列ごとの配列として読む。raw 形式なら mmap=True でメモリマップ（読み取り専用）。
+    途中で書き込みが止まった列があっても、全列そろっている行までを返す。
+    """
+    directory = Path(directory)
+    with open(directory / "meta.json", "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    if meta["format"] == "npz":
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in COLUMNS}
+        for path in sorted(directory.glob("gen_*.npz")):
+            with np.load(path) as data:
+                for name in COLUMNS:
+                    parts[name].append(data[name])
+        return ArchiveColumns(**{
+            name: np.concatenate(parts[name]) if parts[name] else np.zeros(0, dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        })
+
+    paths = {name: directory / f"{name}.bin" for name in COLUMNS}
+    rows = min(
+        (paths[name].stat().st_size if paths[name].exists() else 0) // np.dtype(dtype).itemsize
+        for name, dtype in COLUMNS.items()
+    )
+    arrays = {}
+    for name, dtype in COLUMNS.items():
+        if rows == 0:
+            arrays[name] = np.zeros(0, dtype=dtype)
+        elif mmap:
+            arrays[name] = np.memmap(paths[name], dtype=dtype, mode="r", shape=(rows,))
+        else:
+            arrays[name] = np.fromfile(paths[name], dtype=dtype, count=rows)
+    return ArchiveColumns(**arrays)
+
+
+# ============
+# 集計
+# ============
+
+
+def generation_rows(columns: ArchiveColumns, generation: int) -> slice:
+    """generation の行の範囲（generation 列は昇順なので二分探索で求める）"""
+    gen = columns.generation
+    return slice(
+        int(np.searchsorted(gen, generation, side="left")),
+        int(np.searchsorted(gen, generation, side="right")),
+    )
+
+
+def aggregate_votes(
+    a_id: np.ndarray, b_id: np.ndarray, choice: np.ndarray, minlength: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """id ごとの (wins, losses) int64 [max(id) + 1 か minlength]。aggregate_results_from_logs と同じ数え方"""
+    a_won = choice.astype(bool)
+    size = max(minlength, int(a_id.max()) + 1 if a_id.size else 0, int(b_id.max()) + 1 if b_id.size else 0)
+    wins = np.bincount(a_id[a_won], minlength=size) + np.bincount(b_id[~a_won], minlength=size)
+    losses = np.bincount(a_id[~a_won], minlength=size) + np.bincount(b_id[a_won], minlength=size)
+    return wins, losses
+
+
+def aggregate_generation(
+    columns: ArchiveColumns, generation: int, minlength: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """1世代分の投票から id ごとの (wins, losses) を求める"""
+    rows = generation_rows(columns, generation)
+    return aggregate_votes(columns.a_id[rows], columns.b_id[rows], columns.choice[rows], minlength)
+
+
+def to_pairlogs(columns: ArchiveColumns, rows: slice = slice(None)) -> List[PairLog]:
+    """列から PairLog に戻す（timestamp は復元しない）"""
+    return [
+        PairLog(pair_id=p, indiv_a_id=a, indiv_b_id=b, chosen="A" if c else "B")
+        for p, a, b, c in zip(
+            columns.pair_id[rows].tolist(),
+            columns.a_id[rows].tolist(),
+            columns.b_id[rows].tolist(),
+            columns.choice[rows].tolist(),
+        )
+    ]
+
+
+def archive_from_events(
+    events: Iterable[dict], directory: Union[str, Path], run_id: str, compress: bool = False
+) -> int:
+    """
+    イベントログの choice を、evolve で閉じた世代ごとにアーカイブへ書く。
+    アーカイブがすでにあれば、last_generation より後の世代だけを書き足す（イベントログに合わせる）。
+    まだ閉じていない世代の投票は書かない。書いた件数を返す。
+    """
+    archive = ColumnarArchive(directory, compress=compress)
+    return append_missing_generations(archive, events, run_id)
+
+
+def append_missing_generations(archive: ColumnarArchive, events: Iterable[dict], run_id: str) -> int:
+    """イベントログで閉じているのにアーカイブにない世代の投票を書き足す。書いた件数を返す"""
+    pending: Dict[int, List[PairLog]] = {}
+    total = 0
+    for event in events:
+        if event.get("run_id") != run_id or event.get("generation", -1) <= archive.last_generation:
+            continue
+        if event.get("type") == "choice":
+            pending.setdefault(event["generation"], []).append(
+                PairLog(
+                    pair_id=event["pair_id"],
+                    indiv_a_id=event["indiv_a_id"],
+                    indiv_b_id=event["indiv_b_id"],
+                    chosen=event["chosen"],
+                    timestamp=event.get("timestamp"),
+                )
+            )
+        elif event.get("type") == "evolve":
+            total += archive.append_generation(event["generation"], pending.pop(event["generation"], []))
+    return total
+
+
+if __name__ == "__main__":
+    from evolve_replay import find_run, iter_events
+
+    parser = argparse.ArgumentParser(description="投票アーカイブの確認・作り直し")
+    parser.add_argument("directory", type=Path, nargs="?", default=None, help="archive/<run_id>（省略時は最後の run）")
+    parser.add_argument("--from-events", type=Path, default=None, help="このイベントログからアーカイブを作る（あれば足りない世代を書き足す）")
+    parser.add_argument("--compress", action="store_true", help="世代ごとに圧縮した npz で書く")
+    parser.add_argument("--run", default=None, help="run_id（省略時はイベントログの最後の run）")
+    args = parser.parse_args()
+
+    events_path = args.from_events or Path("events.jsonl")
+    directory = args.directory
+    if directory is None or args.from_events is not None:
+        run_id = find_run(events_path, args.run)[0]
+        directory = directory or ARCHIVE_DIR / run_id
+    if args.from_events is not None:
+        n = archive_from_events((e for _, e in iter_events(events_path)), directory, run_id, args.compress)
+        print(f"wrote {n} votes to {directory}")
+
+    columns = load_archive(directory)
+    if len(columns) == 0:
+        print(f"{directory}: empty")
+    else:
+        print(f"{directory}: {len(columns)} votes, generations {columns.generation[0]}..{columns.generation[-1]}")
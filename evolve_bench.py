@@ -0,0 +1,532 @@
+"""
+evolve_engine まわりの簡易ベンチマーク。
+
+使い方:
+    python evolve_bench.py              # 全部
+    python evolve_bench.py selection    # 名前を指定して一部だけ
+"""
+import argparse
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from evolve_archive import ColumnarArchive, aggregate_generation, aggregate_votes, load_archive
+from evolve_compact import CompactPopulation, evolve_compact_generation, measure_memory
+from evolve_dictmatch import DictionaryMatcher
+from evolve_diversity import DiversityMonitor
+from evolve_kernels import DEFAULT_CHAR_CLASSES, BatchNgramScorer, CharClasses
+from evolve_ngram_index import IncrementalNgramScorer, NgramIndex
+from evolve_engine import (
+    SELECTION_STRATEGIES,
+    Individual,
+    LineageRecorder,
+    PhaseTimer,
+    evolve_one_generation,
+    initialize_population,
+    random_string,
+    PairLog,
+    aggregate_results_from_logs,
+    select_parents,
+)
+
+
+def _timeit(fn: Callable[[], object], repeat: int = 5) -> float:
+    """fn を repeat 回実行して最速の秒数を返す"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _overhead(base: Callable[[], object], other: Callable[[], object], rounds: int = 100) -> float:
+    """
+    base に対する other の余分な時間の割合（中央値）。数 % の差を測るので、
+    base, other, other, base の順に交互に走らせて、先に走る側が有利になる偏りを打ち消す
+    """
+    ratios = []
+    for _ in range(rounds):
+        times = []
+        for fn in (base, other, other, base):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        ratios.append((times[1] + times[2]) / (times[0] + times[3]))
+    ratios.sort()
+    return ratios[len(ratios) // 2] - 1
+
+
+def _scored_population(size: int) -> List[Individual]:
+    """evolve_hiragana.py と同じく losses=20、wins 小さめのダミー評価を入れた集団"""
+    pop = initialize_population(size=size, generation=0)
+    for ind in pop:
+        ind.wins = random.randint(0, 5)
+        ind.losses = 20
+    return pop
+
+
+def bench_selection(sizes=(200, 2000, 20000)) -> None:
+    """1世代分（N 回）の親選択にかかる時間を戦略ごとに比較する"""
+    print("== selection (1世代分の親選択) ==")
+    for size in sizes:
+        pop = _scored_population(size)
+        evolve_one_generation(pop, size, 0, 0.0, 1)  # fitness を埋める
+        pop.sort(key=lambda ind: ind.fitness, reverse=True)
+
+        results: Dict[str, float] = {}
+        if size <= 2000:
+            results["select_parents (loop)"] = _timeit(
+                lambda: [select_parents(pop) for _ in range(size)]
+            )
+        for name, strategy in SELECTION_STRATEGIES.items():
+            results[name] = _timeit(lambda: strategy(pop, size))
+
+        for name, sec in results.items():
+            print(f"  N={size:>6}  {name:<24} {sec * 1e3:9.3f} ms")
+
+
+def bench_generation(size: int = 2000) -> None:
+    """evolve_one_generation 全体の時間を戦略ごとに比較する"""
+    print("== evolve_one_generation ==")
+    pop = _scored_population(size)
+    for name in SELECTION_STRATEGIES:
+        sec = _timeit(
+            lambda: evolve_one_generation(
+                pop,
+                population_size=size,
+                elite_size=size // 10,
+                mutation_rate=0.3,
+                next_generation_index=1,
+                selection=name,
+            )
+        )
+        print(f"  N={size:>6}  {name:<24} {sec * 1e3:9.3f} ms")
+
+
+def bench_lineage(size: int = 2000, generations: int = 1000) -> None:
+    """系譜記録あり/なしの世代時間と、長時間実行での保持バイト数"""
+    print("== lineage ==")
+    pop = _scored_population(size)
+    kwargs = dict(population_size=size, elite_size=size // 10, mutation_rate=0.3, next_generation_index=1)
+    recorder = LineageRecorder()
+
+    def off():
+        return evolve_one_generation(pop, **kwargs)
+
+    def on():
+        return evolve_one_generation(pop, lineage=recorder, **kwargs)
+
+    base = _timeit(off, repeat=10)
+    with_lineage = _timeit(on, repeat=10)
+    # 最速値どうしの比は揺れが大きい（±5% ほど）ので、割合は交互に走らせた中央値で出す。
+    # off 同士の比（対照）が 0 から離れていたら、その回の数字は信用しない
+    print(f"  N={size:>6}  off {base * 1e3:8.3f} ms / on {with_lineage * 1e3:8.3f} ms"
+          f"  ({_overhead(off, on) * 100:+.1f}%, 対照 {_overhead(off, off) * 100:+.1f}%)")
+
+    small = 200
+    recorder = LineageRecorder(max_generations=1000)
+    pop = _scored_population(small)
+    for gen in range(generations + 500):
+        pop = evolve_one_generation(pop, small, 20, 0.3, gen + 1, lineage=recorder)
+        for ind in pop:
+            ind.wins = random.randint(0, 5)
+            ind.losses = 20
+    print(f"  N={small:>6}  {generations + 500} 世代後の保持量 {recorder.nbytes() / 1e6:.2f} MB")
+
+
+def bench_phases(size: int = 2000) -> None:
+    """フェーズ計測なし/ありの世代時間（なしのときに遅くならないこと）と、フェーズごとの内訳"""
+    print("== phases ==")
+    pop = _scored_population(size)
+    kwargs = dict(population_size=size, elite_size=size // 10, mutation_rate=0.3, next_generation_index=1)
+    base = _timeit(lambda: evolve_one_generation(pop, **kwargs), repeat=10)
+    timer = PhaseTimer()
+    timed = _timeit(lambda: evolve_one_generation(pop, timer=timer, **kwargs), repeat=10)
+    print(f"  N={size:>6}  off {base * 1e3:8.3f} ms / on {timed * 1e3:8.3f} ms"
+          f"  ({(timed / base - 1) * 100:+.1f}%)")
+    for name, phase in timer.last["phases"].items():
+        print(f"    {name:<10} {phase['seconds'] * 1e3:8.3f} ms  {phase['blocks']:+7d} blocks")
+
+
+def bench_dictmatch(num_texts: int = 2000, sizes=(70, 2000, 20000)) -> None:
+    """単語ボーナスの計算: `w in text` を辞書の全単語で回す方式と Aho-Corasick の比較"""
+    print("== dictmatch (単語ボーナス) ==")
+    texts = [random_string() for _ in range(num_texts)]
+    for size in sizes:
+        words = {random_string(2, 6): 75 for _ in range(size)}
+        t0 = time.perf_counter()
+        matcher = DictionaryMatcher(words)
+        build = time.perf_counter() - t0
+        naive = _timeit(lambda: [sum(b for w, b in words.items() if w in t) for t in texts], repeat=3)
+        ac = _timeit(lambda: [matcher.score(t) for t in texts], repeat=3)
+        print(f"  words={len(words):>6}  in-loop {naive * 1e3:9.2f} ms  aho-corasick {ac * 1e3:7.2f} ms"
+              f"  (build {build * 1e3:.1f} ms, {num_texts} texts)")
+
+
+def bench_charclass(sizes=(200, 10000, 100000)) -> None:
+    """文字種カウント: 1個体ずつの `ch in set` の合計と、集団まとめての NumPy カーネルの比較"""
+    print("== charclass (文字種カウント) ==")
+    classes = CharClasses.default()
+    sets = [set(chars) for chars in DEFAULT_CHAR_CLASSES.values()]
+    for size in sizes:
+        texts = [random_string() for _ in range(size)]
+        one = _timeit(lambda: [sum(1 for ch in t if ch in sets[0]) for t in texts], repeat=3)
+        kernel = _timeit(lambda: classes.count_texts(texts), repeat=3)
+        print(f"  N={size:>6}  python 1 クラス {one * 1e3:8.2f} ms"
+              f"  numpy {len(sets)} クラス {kernel * 1e3:7.2f} ms")
+
+
+CORPUS_PATH = Path(__file__).with_name("文章プール.txt")
+
+
+def _traced_bytes(fn: Callable[[], object]) -> int:
+    """fn の戻り値が持っているメモリ（tracemalloc で確保量の差を見る）"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = fn()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del keep
+    return after - before
+
+
+def _all_substrings(text: str, min_len: int = 3) -> set:
+    """旧 extract_ngrams と同じ（比較用）"""
+    return {text[i : i + n] for n in range(min_len, len(text) + 1) for i in range(len(text) - n + 1)}
+
+
+def bench_ngram_index(prefix_sizes=(200, 400, 800)) -> None:
+    """ターゲットの全部分文字列の集合と接尾辞オートマトン索引のメモリ・スコア計算時間"""
+    print("== ngram index ==")
+    corpus = CORPUS_PATH.read_text(encoding="utf-8")
+    texts = [random_string() for _ in range(500)]
+    for size in prefix_sizes:
+        target = corpus[:size]
+        set_bytes = _traced_bytes(lambda: _all_substrings(target))
+        index_bytes = _traced_bytes(lambda: NgramIndex([target]))
+        print(f"  target={size:>6} chars  set {set_bytes / 1e6:8.2f} MB   index {index_bytes / 1e6:6.2f} MB")
+
+    index_bytes = _traced_bytes(lambda: NgramIndex(corpus.splitlines()))
+    print(f"  target={len(corpus):>6} chars  (全コーパス)            index {index_bytes / 1e6:6.2f} MB")
+
+    target = corpus[:400]
+    ngrams = _all_substrings(target)
+    index = NgramIndex([target])
+
+    def old_score(text: str) -> int:
+        n = len(text)
+        return sum(l for l in range(3, n + 1) for i in range(n - l + 1) if text[i : i + l] in ngrams)
+
+    t_old = _timeit(lambda: [old_score(t) for t in texts], repeat=3)
+    t_new = _timeit(lambda: [index.score(t) for t in texts], repeat=3)
+    print(f"  score 500 texts: substring loop {t_old * 1e3:.2f} ms / index {t_new * 1e3:.2f} ms")
+
+
+def bench_delta_rescoring(size: int = 200, generations: int = 50) -> None:
+    """
+    複数ターゲットの n-gram スコア: 子を全文再計算する場合と、
+    lineage の交叉位置・変異位置から差分で計算する場合の比較（結果が一致することも確認）
+    """
+    print("== delta rescoring ==")
+    lines = CORPUS_PATH.read_text(encoding="utf-8").splitlines()
+    targets = [line for line in lines if 8 <= len(line) <= 30][:30]
+    scorer = IncrementalNgramScorer([NgramIndex([t]) for t in targets])
+    alphabet = "".join(sorted(set("".join(targets))))
+
+    pop = initialize_population(size)
+    for ind in pop:
+        ind.text = "".join(random.choice(alphabet) for _ in ind.text)
+    states = {ind.id: scorer.full_state(ind.text) for ind in pop}
+    recorder = LineageRecorder()
+    t_full = t_delta = 0.0
+    for gen in range(generations):
+        for ind in pop:
+            scores = scorer.scores(states[ind.id])
+            ind.wins = sum(scores) / len(scores)
+            ind.losses = 20
+        pop = evolve_one_generation(pop, size, size // 20, 0.5, gen + 1, lineage=recorder)
+
+        t0 = time.perf_counter()
+        full = {ind.id: scorer.full_state(ind.text) for ind in pop}
+        t1 = time.perf_counter()
+        states = scorer.rescore_generation(pop, states, recorder.generation(gen + 1))
+        t2 = time.perf_counter()
+        assert states == full
+        t_full += t1 - t0
+        t_delta += t2 - t1
+    print(f"  N={size}, {len(targets)} targets, {generations} 世代:"
+          f" full {t_full / generations * 1e3:.2f} ms/世代  delta {t_delta / generations * 1e3:.2f} ms/世代")
+
+
+def bench_batch_ngram(size: int = 100000, sample: int = 500) -> None:
+    """
+    複数ターゲットの n-gram スコア: 1個体ずつ NgramIndex で計算する場合（sample 個体から推定）と、
+    ローリングハッシュで集団全体をまとめて計算する場合の比較
+    """
+    print("== batch ngram (ローリングハッシュ) ==")
+    lines = CORPUS_PATH.read_text(encoding="utf-8").splitlines()
+    targets = [line for line in lines if 8 <= len(line) <= 30][:30]
+    indexes = [NgramIndex([t]) for t in targets]
+    scorer = BatchNgramScorer(targets)
+    alphabet = "".join(sorted(set("".join(targets))))
+    random_texts = ["".join(random.choice(alphabet) for _ in range(random.randint(10, 40))) for _ in range(size)]
+    # 収束した集団のつもり: ターゲット同士を交叉しただけの文字列（一致がとても多い）
+    spliced = []
+    for _ in range(size):
+        t1, t2 = random.choice(targets), random.choice(targets)
+        k = random.randint(0, len(t1))
+        spliced.append(t1[:k] + t2[k:])
+    for name, texts in (("random", random_texts), ("spliced", spliced)):
+        per_text = _timeit(lambda: [[idx.score(t) for idx in indexes] for t in texts[:sample]], repeat=1)
+        batch = _timeit(lambda: scorer.score_texts(texts), repeat=3)
+        print(f"  {name:>7} N={size}, {len(targets)} targets:"
+              f"  per-text {per_text / sample * size * 1e3:9.1f} ms (推定)  batch {batch * 1e3:7.1f} ms")
+
+
+def _edit_distance(a: str, b: str) -> int:
+    """比較用の素朴な編集距離"""
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def bench_diversity(sizes=(200, 2000, 20000), sample_pairs: int = 2000) -> None:
+    """多様性の計測: 全ペアの編集距離（sample_pairs ペアから推定）と MinHash モニタの比較"""
+    print("== diversity (MinHash) ==")
+    monitor = DiversityMonitor()
+    for size in sizes:
+        pop = initialize_population(size)
+        all_pairs = size * (size - 1) // 2
+        pairs = [random.sample(pop, 2) for _ in range(sample_pairs)]
+        per_pair = _timeit(lambda: [_edit_distance(a.text, b.text) for a, b in pairs], repeat=1) / sample_pairs
+        minhash = _timeit(lambda: monitor.measure(0, pop), repeat=3)
+        print(f"  N={size:>6}  edit distance {per_pair * all_pairs * 1e3:12.1f} ms (推定)"
+              f"  minhash {minhash * 1e3:8.2f} ms")
+
+
+def bench_archive(num_votes: int = 1_000_000, per_generation: int = 1000, population_size: int = 200) -> None:
+    """投票 num_votes 件の読み込み＋集計: JSON Lines と列アーカイブ（メモリマップ）の比較"""
+    print("== archive (投票ログ) ==")
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        jsonl = Path(tmp) / "pair_logs.jsonl"
+        archive = ColumnarArchive(Path(tmp) / "archive")
+        pair_id = 0
+        with open(jsonl, "w", encoding="utf-8") as f:
+            for gen in range(num_votes // per_generation):
+                logs = []
+                for _ in range(per_generation):
+                    a, b = rng.sample(range(population_size), 2)
+                    log = PairLog(pair_id, a, b, rng.choice("AB"), "2026-02-15T21:54:30.759757+09:00")
+                    pair_id += 1
+                    logs.append(log)
+                    f.write(json.dumps(asdict(log), ensure_ascii=False) + "\n")
+                archive.append_generation(gen, logs)
+
+        def load_jsonl():
+            with open(jsonl, "r", encoding="utf-8") as f:
+                logs = [PairLog(**json.loads(line)) for line in f if line.strip()]
+            aggregate_results_from_logs(_scored_population(population_size), logs)
+
+        def load_columns():
+            columns = load_archive(Path(tmp) / "archive")
+            return aggregate_votes(columns.a_id, columns.b_id, columns.choice, population_size)
+
+        def one_generation():
+            return aggregate_generation(load_archive(Path(tmp) / "archive"), num_votes // per_generation // 2)
+
+        json_time = _timeit(load_jsonl, repeat=1)
+        column_time = _timeit(load_columns)
+        gen_time = _timeit(one_generation)
+        size_json = jsonl.stat().st_size
+        size_cols = sum(p.stat().st_size for p in (Path(tmp) / "archive").glob("*.bin"))
+    print(f"  {num_votes} votes: jsonl {json_time * 1e3:8.1f} ms ({size_json / 1e6:.1f} MB)"
+          f"  columns {column_time * 1e3:6.1f} ms ({size_cols / 1e6:.1f} MB)"
+          f"  1 世代だけ {gen_time * 1e3:.2f} ms")
+
+
+def bench_json(num_votes: int = 20000, log_entries: int = 100) -> None:
+    """
+    1票あたりの JSON の CPU 時間: 標準の json（asdict + json.dumps）と evolve_json（BACKEND）の比較。
+    投票ログとイベントログへの書き込み・ログの読み込み・/pair と /debug/logs のレスポンスのエンコード
+    """
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    import evolve_json
+    from evolve_api import IndivInfo, LogEntry, PairResponse
+
+    print(f"== json (backend: {evolve_json.BACKEND}) ==")
+    rng = random.Random(0)
+    logs = [
+        PairLog(i, rng.randrange(200), rng.randrange(200), rng.choice("AB"), "2026-02-15T21:54:30.759757+09:00")
+        for i in range(num_votes)
+    ]
+    event = {"type": "choice", "run_id": "0123456789abcdef", "generation": 12}
+    texts = [random_string() for _ in range(2)]
+
+    def write_std():
+        for log in logs:
+            json.dumps(asdict(log), ensure_ascii=False) + "\n"
+            (json.dumps({**event, **asdict(log)}, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def write_fast():
+        for log in logs:
+            evolve_json.dumps_line(log)
+            evolve_json.dumps_line({**event, **vars(log)})
+
+    lines = [json.dumps(asdict(log), ensure_ascii=False).encode("utf-8") for log in logs]
+
+    def read_std():
+        return [PairLog(**json.loads(line.decode("utf-8"))) for line in lines]
+
+    def read_fast():
+        return [PairLog(**evolve_json.loads(line)) for line in lines]
+
+    pairs = [
+        PairResponse(pair_id=i, generation=12, indiv_a=IndivInfo(id=1, text=texts[0]), indiv_b=IndivInfo(id=2, text=texts[1]))
+        for i in range(num_votes)
+    ]
+
+    def pair_std():
+        for pair in pairs:
+            JSONResponse(jsonable_encoder(pair)).body
+
+    def pair_fast():
+        for pair in pairs:
+            evolve_json.dumps(pair.model_dump())
+
+    entries = [asdict(log) for log in logs[:log_entries]]
+    rounds = num_votes // log_entries
+
+    def logs_std():
+        for _ in range(rounds):
+            JSONResponse(jsonable_encoder([LogEntry(**d) for d in entries])).body
+
+    def logs_fast():
+        for _ in range(rounds):
+            evolve_json.dumps(entries)
+
+    for name, std, fast, count in (
+        ("write (pair log + event)", write_std, write_fast, num_votes),
+        ("read pair log", read_std, read_fast, num_votes),
+        ("/pair response", pair_std, pair_fast, num_votes),
+        (f"/debug/logs ({log_entries})", logs_std, logs_fast, rounds),
+    ):
+        t_std = _timeit(std, repeat=3) / count
+        t_fast = _timeit(fast, repeat=3) / count
+        print(f"  {name:<26} json {t_std * 1e6:8.2f} us  {evolve_json.BACKEND} {t_fast * 1e6:8.2f} us"
+              f"  ({t_std / t_fast:.1f}x)")
+
+
+# module を import したときに新しく読み込まれた、標準ライブラリ以外のトップレベルパッケージ
+_NEW_MODULES_CODE = (
+    "import sys; before = set(sys.modules); import {module}; "
+    "new = {{m.split('.')[0] for m in set(sys.modules) - before}}; "
+    "print(' '.join(sorted(m for m in new - set(sys.stdlib_module_names) "
+    "if not m.startswith(('evolve_', '_')))))"
+)
+
+
+def bench_compact(size: int = 200000) -> None:
+    """Individual のリストと CompactPopulation の1個体あたりのバイト数と、1世代の時間（out= の使い回しあり/なし）"""
+    print("== compact (省メモリの集団) ==")
+    pop = _scored_population(size)
+    # テキストの str も数えるように、Individual 側も str を作り直す
+    objects = measure_memory(lambda: [Individual(ind.id, ind.text[:1] + ind.text[1:], 3, 20) for ind in pop])
+    compact = measure_memory(lambda: CompactPopulation.from_individuals(pop))
+    print(f"  list[Individual]   {objects.summary()}")
+    print(f"  CompactPopulation  {compact.summary()}")
+
+    kwargs = dict(population_size=size, elite_size=size // 10, mutation_rate=0.3, next_generation_index=1)
+    spare = evolve_one_generation(pop, **kwargs)
+    fresh = _timeit(lambda: evolve_one_generation(pop, **kwargs), repeat=3)
+    reused = _timeit(lambda: evolve_one_generation(pop, out=spare, **kwargs), repeat=3)
+    cpop = CompactPopulation.from_individuals(pop)
+    cspare = evolve_compact_generation(cpop, **kwargs)
+    compact_time = _timeit(lambda: evolve_compact_generation(cpop, out=cspare, **kwargs), repeat=3)
+    print(f"  N={size:>7}  evolve_one_generation {fresh * 1e3:8.1f} ms / out= {reused * 1e3:8.1f} ms"
+          f"  compact {compact_time * 1e3:8.1f} ms")
+
+
+def _run_python(code: str) -> str:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+
+
+def bench_import(modules=("evolve_engine", "evolve_replay", "evolve_api"), repeat: int = 5) -> None:
+    """
+    新しいプロセスでの import 時間（-X importtime の自己申告値）と、
+    標準ライブラリ以外で読み込まれたトップレベルパッケージを表示する。
+    ワーカープロセスを大量に立ち上げるので、起動コストをここで追う。
+    """
+    print("== import time (fresh process) ==")
+    for module in modules:
+        best_us = None
+        try:
+            for _ in range(repeat):
+                log = _run_python(f"import {module}")
+                for line in log.splitlines():
+                    # import time: self [us] | cumulative | imported package
+                    parts = line.split("|")
+                    if len(parts) == 3 and parts[2].strip() == module:
+                        us = int(parts[1])
+                        best_us = us if best_us is None else min(best_us, us)
+            third_party = subprocess.run(
+                [sys.executable, "-c", _NEW_MODULES_CODE.format(module=module)],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except subprocess.CalledProcessError as e:
+            print(f"  {module:<16} import failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"  {module:<16} {best_us / 1e3:8.2f} ms   non-stdlib: {third_party or '-'}")
+
+
+BENCHMARKS: Dict[str, Callable[[], None]] = {
+    "selection": bench_selection,
+    "generation": bench_generation,
+    "lineage": bench_lineage,
+    "phases": bench_phases,
+    "import": bench_import,
+    "dictmatch": bench_dictmatch,
+    "charclass": bench_charclass,
+    "ngram": bench_ngram_index,
+    "delta": bench_delta_rescoring,
+    "batchngram": bench_batch_ngram,
+    "diversity": bench_diversity,
+    "archive": bench_archive,
+    "compact": bench_compact,
+    "json": bench_json,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="evolve_engine benchmarks")
+    parser.add_argument("names", nargs="*", help=f"実行するベンチマーク {list(BENCHMARKS)}")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+
+    random.seed(args.seed)
+    for name in args.names or list(BENCHMARKS):
+        BENCHMARKS[name]()
@@ -1,7 +1,13 @@
 import random
 import string
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional, Tuple
+
+from evolve_diversity import DiversityMonitor
+from evolve_engine import ConvergenceMonitor, GenerationLineage
+from evolve_kernels import CharClasses
+from evolve_lm import DEFAULT_CORPUS_PATH, load_or_train
+from evolve_ngram_index import IncrementalNgramScorer, NgramIndex
 
 
 # 個体
@@ -70,26 +76,34 @@ def select_parents(population: List[Individual]) -> Individual:
     return population[-1]
 
 
-def crossover(s1: str, s2: str) -> str:
-    # 2つの文字列からランダムな位置 k で交叉
+def crossover_with_point(s1: str, s2: str) -> Tuple[str, int]:
+    # 2つの文字列からランダムな位置 k で交叉（子 = s1[:k] + s2[k:]。k も返す）
     if not s1:
-        return s2
+        return s2, 0
     if not s2:
-        return s1
+        return s1, len(s1)
     k = random.randint(0, min(len(s1), len(s2)))
-    return s1[:k] + s2[k:]
+    return s1[:k] + s2[k:], k
 
 
-def mutate(text: str, mutation_rate: float = 0.1) -> str:
-    # mutation_rate の確率で、ランダム位置の1文字を別の文字に置換
+def crossover(s1: str, s2: str) -> str:
+    return crossover_with_point(s1, s2)[0]
+
+
+def mutate_with_position(text: str, mutation_rate: float = 0.1) -> Tuple[str, int]:
+    # mutation_rate の確率で、ランダム位置の1文字を別の文字に置換（置換した位置も返す。しなければ -1）
     if not text:
-        return text
+        return text, -1
     if random.random() > mutation_rate:
-        return text
+        return text, -1
 
     pos = random.randint(0, len(text) - 1)
     new_char = random.choice(CHARSET)
-    return text[:pos] + new_char + text[pos + 1 :]
+    return text[:pos] + new_char + text[pos + 1 :], pos
+
+
+def mutate(text: str, mutation_rate: float = 0.1) -> str:
+    return mutate_with_position(text, mutation_rate)[0]
 
 
 def evolve_one_generation(
@@ -98,7 +112,9 @@ def evolve_one_generation(
     elite_size: int,
     mutation_rate: float,
     next_generation_index: int,
+    lineage: Optional[GenerationLineage] = None,
 ) -> List[Individual]:
+    # lineage を渡すと、各個体の親 id・交叉位置・変異位置を記録する（n-gram スコアの差分計算用）
     # 1. フ���ットネス計算（wins/losses は事前に埋まっている前提）
     compute_fitness(population)
 
@@ -109,6 +125,8 @@ def evolve_one_generation(
     # エリートをそのままコピー
     for i in range(min(elite_size, len(population_sorted))):
         ind = population_sorted[i]
+        if lineage is not None:
+            lineage.set(len(next_pop), len(next_pop), ind.id)
         next_pop.append(
             Individual(
                 id=len(next_pop),
@@ -121,8 +139,10 @@ def evolve_one_generation(
     while len(next_pop) < population_size:
         parent1 = select_parents(population_sorted)
         parent2 = select_parents(population_sorted)
-        child_text = crossover(parent1.text, parent2.text)
-        child_text = mutate(child_text, mutation_rate=mutation_rate)
+        child_text, point = crossover_with_point(parent1.text, parent2.text)
+        child_text, pos = mutate_with_position(child_text, mutation_rate=mutation_rate)
+        if lineage is not None:
+            lineage.set(len(next_pop), len(next_pop), parent1.id, parent2.id, point, pos)
         next_pop.append(
             Individual(
                 id=len(next_pop),
@@ -134,16 +154,6 @@ def evolve_one_generation(
     return next_pop
 
 
-def extract_ngrams(text: str, min_len: int = 3) -> set[str]: # 切り出す長さの最小
-    """text から長さ min_len 以上の全ての部分文字列を集合として取り出す"""
-    ngrams: set[str] = set()
-    n = len(text)
-    for length in range(min_len, n + 1):
-        for i in range(0, n - length + 1):
-            ngrams.add(text[i : i + length])
-    return ngrams
-
-
 if __name__ == "__main__":
     # random.seed(0)  # 毎回同じ進化を再現したければコメントアウトを外す
 
@@ -153,43 +163,68 @@ if __name__ == "__main__":
         "あいうえおかきくけこさしすせそたちつてとなにぬねの"
         "はひふへほまみむめもやゆよらりるれろわをんっゃゅょ"
     )
+    char_classes = CharClasses({"hiragana": hiragana_set})
 
     # お手本文章（好きなひらがな文に変えてOK）
     TARGET_TEXT = "わたしがりょうてをひろげても、おそらはちっともとべないが、とべることりはわたしのように、じめんをはやくははしれない。わたしがからだをゆすっても、きれいなおとはでないけど、あのなるすずはわたしのように、たくさんなうたはしらないよ。すずと、ことりと、それからわたし、みんなちがって、みんないい。"
-    target_ngrams = extract_ngrams(TARGET_TEXT, min_len=3)
+    target_index = NgramIndex([TARGET_TEXT])
+
+    # 子の n-gram スコアを、親の位置ごとの部分スコアから交叉位置・変異位置のまわりだけ計算し直す
+    # （False なら毎世代全文を計算。VERIFY_NGRAM なら差分の結果を全文の計算と突き合わせる）
+    INCREMENTAL_NGRAM = True
+    VERIFY_NGRAM = False
+    ngram_scorer = IncrementalNgramScorer([target_index], min_len=3)
+    ngram_states = {ind.id: ngram_scorer.full_state(ind.text) for ind in pop} if INCREMENTAL_NGRAM else None
+
+    # 文章プール.txt で学習した文字 n-gram 言語モデル（evolve_lm.py）の「日本語らしさ」も wins に足す。
+    # スコアは1文字あたりの平均 log 確率（文章プールの文で -1〜-3、ランダムな文字列で -5〜-7 くらい）で、
+    # LM_FLOOR を超えた分に LM_WEIGHT を掛けて足す
+    LM_FITNESS = False
+    LM_WEIGHT = 1.0
+    LM_FLOOR = -6.0
+    lm = load_or_train(DEFAULT_CORPUS_PATH, order=3) if LM_FITNESS else None
 
     num_generations = 100
+    diversity = DiversityMonitor()  # 世代ごとの多様性（MinHash）
+    convergence = ConvergenceMonitor(window=30)  # 30世代伸びなくなったら止める
 
     for gen in range(num_generations):
-        for ind in pop:
+        # ひらがな数（ベーススコア。集団全体を NumPy でまとめて数える）
+        hira_counts = char_classes.count_population(pop)["hiragana"]
+        lm_scores = lm.score_population(pop).tolist() if lm is not None else [LM_FLOOR] * len(pop)
+        for ind, hira_count, lm_score in zip(pop, hira_counts.tolist(), lm_scores):
             text = ind.text
 
-            # ひらがな数（ベーススコア）
-            hira_count = sum(1 for ch in text if ch in hiragana_set)
-
-            # ngram マッチ数スコア
-            ngram_score = 0
-            n = len(text)
-            for length in range(3, n + 1):
-                for i in range(0, n - length + 1):
-                    substr = text[i : i + length]
-                    if substr in target_ngrams:
-                        # マッチ1件ごとに加点（長い一致ほどボーナス大）
-                        ngram_score += length
-
-            # 最終的な wins を、ひらがな数＋ngramスコアで決める
-            ind.wins = hira_count/10 + ngram_score
+            # ngram マッチ数スコア（長さ3以上の一致1件ごとに、その長さを加点）
+            if INCREMENTAL_NGRAM:
+                ngram_score = ngram_scorer.scores(ngram_states[ind.id])[0]
+            else:
+                ngram_score = target_index.score(text, min_len=3)
+
+            # 最終的な wins を、ひらがな数＋ngramスコア（＋言語モデルのスコア）で決める
+            ind.wins = hira_count/10 + ngram_score + LM_WEIGHT * max(0.0, lm_score - LM_FLOOR)
             ind.losses = 50  # 分母用の定数（相対比較できればOK）
 
+        # 収束したら止める（理由を表示する）
+        report = diversity.latest()
+        if convergence.observe(gen, [ind.wins for ind in pop], report.mean_similarity if report is not None else None):
+            print(convergence.stopped.summary())
+            break
+
         # 進化ステップ
+        lineage = GenerationLineage(gen + 1, 100) if INCREMENTAL_NGRAM else None
         pop = evolve_one_generation(
             pop,
             population_size=100,
             elite_size=20,
             mutation_rate=0.3,
             next_generation_index=gen + 1,
+            lineage=lineage,
         )
+        if INCREMENTAL_NGRAM:
+            ngram_states = ngram_scorer.rescore_generation(pop, ngram_states, lineage, verify=VERIFY_NGRAM)
 
         print(f"=== Generation {gen+1} ===")
+        print(diversity.observe(gen + 1, pop).summary())
         for ind in pop[:10]:
             print(ind.id, len(ind.text), ind.text[:100])
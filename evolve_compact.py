@@ -0,0 +1,308 @@
+"""
+100 万個体規模の集団を、決めたメモリ量の中で進化させるためのコンパクトな集団。
+
+Individual のリストだと、1個体あたり Individual 本体と text の str で 250 バイト前後かかる。
+CompactPopulation は個体をオブジェクトにせず、フィールドごとの型付き配列（array）と
+全テキストをつなげた1本の str で持つ（1個体あたり 100 バイト前後）。
+
+    ids / wins / losses / fitness   個体ごとの配列（8 バイトずつ）
+    text_ref                        個体ごとのテキスト番号（4 バイト）
+    text_offsets                    テキスト番号ごとの開始位置（8 バイト）。本体は1本の str
+
+同じテキスト（エリートのコピーや、交叉・変異で変わらなかった子）は1つのテキスト番号を共有する。
+evolve_compact_generation は同じ seed なら evolve_one_generation と同じ次世代を作り、
+out= で2世代分の CompactPopulation を交互に使い回す。memory_budget（バイト）を決めておくと、
+2世代分の配列とテキストがそれを超えるときは MemoryBudgetExceeded で止める
+（ソート順や選ばれた親などの作業用の一時リストは数えない）。
+親選択は evolve_engine の戦略（select_roulette など）をそのまま個体番号で使う。
+
+メモリは半分以下になるが、速くはならない。1世代あたりの時間は Individual のリストより遅く、
+N=200000 で out= を使うリストの evolve_one_generation のおよそ 1.2〜1.4 倍
+（python evolve_bench.py compact で 660 ms 対 550 ms、別の環境では 960 ms 対 700 ms）。
+テキストを1本の str から毎回切り出すのと、配列の読み書きが list より遅いため。
+メモリに収まるならリストのほうを使う。
+
+    pop = CompactPopulation.from_individuals(initialize_population(1_000_000), memory_budget=512 << 20)
+    spare = None
+    for gen in range(100):
+        ...  # pop.wins[i] / pop.losses[i] を埋める
+        pop, spare = evolve_compact_generation(pop, 1_000_000, 100, 0.3, gen + 1, out=spare), pop
+"""
+import random
+import sys
+import tracemalloc
+from array import array
+from typing import Callable, Dict, List, NamedTuple, Optional, Sized, Union
+
+from evolve_engine import (
+    Individual,
+    SelectionStrategy,
+    crossover_with_point,
+    get_selection_strategy,
+    mutate_with_position,
+)
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """集団（2世代分）が memory_budget を超える"""
+
+
+def _resize(a: array, n: int) -> None:
+    """配列の長さを n にする（増えた分は 0）"""
+    if len(a) > n:
+        del a[n:]
+    elif len(a) < n:
+        a.extend(array(a.typecode, [0]) * (n - len(a)))
+
+
+class CompactPopulation:
+    """Individual のリストの代わりに、フィールドごとの配列と1本の文字列で持つ集団"""
+
+    def __init__(self, generation: int = 0, memory_budget: Optional[int] = None):
+        self.generation = generation
+        self.memory_budget = memory_budget
+        self.ids = array("q")
+        self.wins = array("d")
+        self.losses = array("d")
+        self.fitness = array("d")
+        self.text_ref = array("i")
+        self.text_offsets = array("q", [0])
+        self._text = ""
+
+    @classmethod
+    def from_individuals(
+        cls, population: List[Individual], memory_budget: Optional[int] = None
+    ) -> "CompactPopulation":
+        """Individual のリストから作る（同じテキストは1つにまとめる）"""
+        pop = cls(population[0].generation if population else 0, memory_budget)
+        refs: Dict[str, int] = {}
+        texts: List[str] = []
+        for ind in population:
+            ref = refs.get(ind.text)
+            if ref is None:
+                ref = refs[ind.text] = len(texts)
+                texts.append(ind.text)
+            pop.ids.append(ind.id)
+            pop.wins.append(ind.wins)
+            pop.losses.append(ind.losses)
+            pop.fitness.append(ind.fitness)
+            pop.text_ref.append(ref)
+        for text in texts:
+            pop.text_offsets.append(pop.text_offsets[-1] + len(text))
+        pop._text = "".join(texts)
+        pop.check_budget()
+        return pop
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def num_texts(self) -> int:
+        """異なるテキストの数"""
+        return len(self.text_offsets) - 1
+
+    def text_of_ref(self, ref: int) -> str:
+        return self._text[self.text_offsets[ref] : self.text_offsets[ref + 1]]
+
+    def text(self, i: int) -> str:
+        """i 番目の個体のテキスト（呼ぶたびに str を作る）"""
+        return self.text_of_ref(self.text_ref[i])
+
+    def texts(self) -> List[str]:
+        """全個体のテキストのリスト（evolve_kernels などにまとめて渡す用）"""
+        unique = [self.text_of_ref(ref) for ref in range(self.num_texts)]
+        return [unique[ref] for ref in self.text_ref]
+
+    def individual(self, i: int) -> Individual:
+        return Individual(
+            id=self.ids[i],
+            text=self.text(i),
+            wins=self.wins[i],
+            losses=self.losses[i],
+            fitness=self.fitness[i],
+            generation=self.generation,
+        )
+
+    def to_individuals(self) -> List[Individual]:
+        return [self.individual(i) for i in range(len(self))]
+
+    def nbytes(self) -> int:
+        """配列とテキスト本体のバイト数"""
+        arrays = (self.ids, self.wins, self.losses, self.fitness, self.text_ref, self.text_offsets)
+        return sum(a.itemsize * len(a) for a in arrays) + sys.getsizeof(self._text)
+
+    def check_budget(self, extra: int = 0) -> None:
+        """nbytes() + extra が memory_budget を超えたら MemoryBudgetExceeded"""
+        if self.memory_budget is None:
+            return
+        needed = self.nbytes() + extra
+        if needed > self.memory_budget:
+            raise MemoryBudgetExceeded(
+                f"population needs {needed} bytes, budget is {self.memory_budget} bytes"
+            )
+
+    def compute_fitness(self, epsilon: float = 1e-6) -> None:
+        """evolve_engine.compute_fitness と同じ式で fitness を埋める"""
+        _resize(self.fitness, len(self))
+        fitness, wins, losses = self.fitness, self.wins, self.losses
+        for i in range(len(self)):
+            total = wins[i] + losses[i]
+            fitness[i] = 0.0 if total == 0 else wins[i] / (total + epsilon)
+
+
+class _TextWriter:
+    """次の世代のテキストを書きためる。前の世代のテキストをそのまま使うときは番号を共有する"""
+
+    CHUNK = 4096
+
+    def __init__(self, source: CompactPopulation, offsets: array):
+        self.source = source
+        self.remap = array("i", [-1]) * source.num_texts  # 前の世代のテキスト番号 -> 新しい番号
+        self.offsets = offsets  # 書き込み先（中身は捨てて使い回す）
+        del offsets[1:]
+        offsets[0] = 0
+        self._pending: List[str] = []
+        self._chunks: List[str] = []
+
+    def add(self, text: str) -> int:
+        self.offsets.append(self.offsets[-1] + len(text))
+        self._pending.append(text)
+        if len(self._pending) >= self.CHUNK:
+            self._chunks.append("".join(self._pending))
+            self._pending = []
+        return len(self.offsets) - 2
+
+    def copy(self, ref: int) -> int:
+        new_ref = self.remap[ref]
+        if new_ref < 0:
+            new_ref = self.remap[ref] = self.add(self.source.text_of_ref(ref))
+        return new_ref
+
+    def finish(self) -> str:
+        self._chunks.append("".join(self._pending))
+        self._pending = []
+        return "".join(self._chunks)
+
+
+def evolve_compact_generation(
+    population: CompactPopulation,
+    population_size: int,
+    elite_size: int,
+    mutation_rate: float,
+    next_generation_index: int,
+    selection: Union[str, SelectionStrategy] = "roulette",
+    rng: Optional[random.Random] = None,
+    out: Optional[CompactPopulation] = None,
+    next_id: Optional[int] = None,
+) -> CompactPopulation:
+    """
+    evolve_one_generation の CompactPopulation 版（wins / losses が埋まっている前提）。
+    同じ rng の状態からなら evolve_one_generation と同じテキストの次世代になる。
+    selection は evolve_one_generation と同じ戦略（名前か関数）で、個体番号の列と fitness= を渡して呼ぶ
+    （関数を渡すなら fitness= を受け取るもの。functools.partial(select_tournament, tournament_size=5) など）。
+    out に2世代前の CompactPopulation を渡すと、その配列を上書きして返す
+    （MemoryBudgetExceeded で止まったときの out の中身は使えない）。
+    next_id は evolve_one_generation と同じ（エリートは id を持ち越し、子どもは next_id から連番）。
+    """
+    select = get_selection_strategy(selection)
+    if out is population:
+        raise ValueError("out must not be the population being evolved")
+    if out is None:
+        out = CompactPopulation(memory_budget=population.memory_budget)
+    n = len(population)
+    # 次の世代も今の世代と同じくらいの大きさになるとして、2世代分で予算に収まるか先に確かめる
+    population.check_budget(extra=population.nbytes() * population_size // max(1, n))
+
+    population.compute_fitness()
+    fitness = population.fitness
+    order = sorted(range(n), key=fitness.__getitem__, reverse=True)
+
+    num_elites = min(elite_size, n)
+    num_children = max(0, population_size - num_elites)
+    total = num_elites + num_children
+    out.generation = next_generation_index
+    for a in (out.ids, out.wins, out.losses, out.fitness, out.text_ref):
+        _resize(a, total)
+    if next_id is None:
+        out.ids[:] = array("q", range(total))
+    else:
+        out.ids[:] = array("q", [population.ids[order[slot]] for slot in range(num_elites)])
+        out.ids.extend(array("q", range(next_id, next_id + num_children)))
+    writer = _TextWriter(population, out.text_offsets)
+
+    # エリートを wins/losses/fitness ごとコピー
+    for slot in range(num_elites):
+        src = order[slot]
+        out.wins[slot] = population.wins[src]
+        out.losses[slot] = population.losses[src]
+        out.fitness[slot] = fitness[src]
+        out.text_ref[slot] = writer.copy(population.text_ref[src])
+
+    # 残りは新しい子ども（wins/losses 0 から）
+    # 親は個体番号で選ぶ（候補は fitness 降順の個体番号、fitness= はそれと同じ順の fitness）
+    parents = select(order, num_children * 2, rng, fitness=list(map(fitness.__getitem__, order)))
+    text_ref = population.text_ref
+    for c in range(num_children):
+        ref1 = text_ref[parents[2 * c]]
+        ref2 = text_ref[parents[2 * c + 1]]
+        s1 = population.text_of_ref(ref1)
+        s2 = population.text_of_ref(ref2)
+        child_text, _ = crossover_with_point(s1, s2, rng)
+        child_text, _ = mutate_with_position(child_text, mutation_rate, rng)
+        # 交叉位置が端で変異もなければ親の str がそのまま返るので、テキスト番号を共有する
+        if child_text is s1:
+            ref = writer.copy(ref1)
+        elif child_text is s2:
+            ref = writer.copy(ref2)
+        else:
+            ref = writer.add(child_text)
+        slot = num_elites + c
+        out.wins[slot] = 0.0
+        out.losses[slot] = 0.0
+        out.fitness[slot] = 0.0
+        out.text_ref[slot] = ref
+
+    out._text = writer.finish()
+    out.memory_budget = population.memory_budget
+    out.check_budget(extra=population.nbytes())
+    return out
+
+
+# ============
+# メモリ使用量の計測
+# ============
+
+
+class MemoryReport(NamedTuple):
+    size: int  # 個体数
+    retained_bytes: int  # 作り終わったあとに残っているバイト数
+    peak_bytes: int  # 作っている途中の最大
+
+    @property
+    def bytes_per_individual(self) -> float:
+        return self.retained_bytes / max(1, self.size)
+
+    def summary(self) -> str:
+        return (
+            f"{self.size} individuals: {self.retained_bytes / 1e6:.1f} MB "
+            f"({self.bytes_per_individual:.1f} B/individual, peak {self.peak_bytes / 1e6:.1f} MB)"
+        )
+
+
+def measure_memory(build: Callable[[], Sized]) -> MemoryReport:
+    """
+    build() で作った集団（Individual のリストや CompactPopulation）が確保したメモリを tracemalloc で測る。
+    build の中で作って捨てた分は retained_bytes に入らない。
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        population = build()
+        current, peak = tracemalloc.get_traced_memory()
+        return MemoryReport(len(population), current - before, peak - before)
+    finally:
+        if started:
+            tracemalloc.stop()
@@ -0,0 +1,202 @@
+"""
+集団の多様性モニタ（MinHash）。
+
+各個体の文字 shingle（長さ k の部分文字列）の集合を MinHash 署名にして、
+  - 全ペアの平均 Jaccard 類似度の推定値（署名の列ごとに同じ値の個体数を数えるだけなので O(N K)）
+  - LSH（署名を帯に分けてバケツに入れる）で似た個体同士をつないだクラスタ数
+を求める。200×200 の編集距離を毎世代計算しなくても、集団が一つの文字列に潰れていくのを早めに見つけられる。
+
+    monitor = DiversityMonitor()
+    report = monitor.observe(generation, population)
+    print(report.summary())
+"""
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from evolve_kernels import HASH_BASE, encode_texts
+
+EMPTY_SIGNATURE = np.iinfo(np.uint64).max  # shingle が1つもない（空文字列）個体の署名
+
+
+def _hash_params(num_perm: int, seed: int):
+    """MinHash の各列で使うハッシュ (a * h + b) の a（奇数）と b"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(
+    texts: Sequence[str],
+    num_perm: int = 64,
+    shingle_len: int = 3,
+    seed: int = 0,
+    chunk_shingles: int = 1 << 18,
+) -> np.ndarray:
+    """
+    MinHash 署名 uint64 [N, num_perm]。shingle_len より短いテキストは全体を1つの shingle とみなす。
+    shingle は chunk_shingles 個ずつ処理する（[shingle 数, num_perm] の作業領域を大きくしない）。
+    """
+    n = len(texts)
+    signatures = np.full((n, num_perm), EMPTY_SIGNATURE, dtype=np.uint64)
+    if n == 0:
+        return signatures
+    codes, lengths = encode_texts(texts)
+    width = codes.shape[1]
+
+    # 各テキストの shingle のハッシュ（短いテキストは長さ分だけ）
+    k = min(shingle_len, max(width, 1))
+    num_windows = max(width - k + 1, 0)
+    h = np.zeros((n, num_windows), dtype=np.uint64)
+    for i in range(k):
+        h = h * HASH_BASE + codes[:, i : i + num_windows]
+    valid = np.arange(num_windows)[None, :] + k <= lengths[:, None]
+    rows, _ = np.nonzero(valid)
+    shingles = h[valid]
+
+    short = np.nonzero((lengths > 0) & (lengths < k))[0]
+    if short.size:
+        hs = np.zeros(short.size, dtype=np.uint64)
+        for i in range(k):
+            col = codes[short, i] if i < width else np.zeros(short.size, dtype=np.uint32)
+            hs = np.where(i < lengths[short], hs * HASH_BASE + col, hs)
+        order = np.argsort(np.concatenate([rows, short]), kind="stable")
+        rows = np.concatenate([rows, short])[order]
+        shingles = np.concatenate([shingles, hs])[order]
+
+    if rows.size == 0:
+        return signatures
+    a, b = _hash_params(num_perm, seed)
+    for lo in range(0, rows.size, chunk_shingles):
+        r = rows[lo : lo + chunk_shingles]
+        values = shingles[lo : lo + chunk_shingles, None] * a[None, :] + b[None, :]
+        # rows は昇順なので、行ごとの最小値は reduceat で取れる
+        uniq, first = np.unique(r, return_index=True)
+        signatures[uniq] = np.minimum(signatures[uniq], np.minimum.reduceat(values, first, axis=0))
+    return signatures
+
+
+def mean_pairwise_similarity(signatures: np.ndarray) -> float:
+    """
+    全ペア（i < j）の Jaccard 類似度の平均の推定値。
+    列ごとに「同じ値を持つ個体のペア数」を数えて、列数と全ペア数で割る。
+    """
+    n, num_perm = signatures.shape
+    if n < 2 or num_perm == 0:
+        return 1.0 if n == 1 else 0.0
+    same_pairs = 0
+    for k in range(num_perm):
+        _, counts = np.unique(signatures[:, k], return_counts=True)
+        same_pairs += int((counts * (counts - 1) // 2).sum())
+    return same_pairs / (num_perm * n * (n - 1) // 2)
+
+
+def lsh_clusters(signatures: np.ndarray, bands: int = 16, max_rounds: int = 50) -> np.ndarray:
+    """
+    LSH のクラスタ番号 int64 [N]（番号はクラスタ内の最小の行番号）。
+    署名を bands 本の帯に分け、どれかの帯が丸ごと一致する個体同士を同じクラスタにつなぐ
+    （つながりは推移的にたどる）。帯が細いほど、低い類似度でもつながる。
+    """
+    n, num_perm = signatures.shape
+    labels = np.arange(n)
+    if n == 0 or num_perm == 0:
+        return labels
+    rows_per_band = max(1, num_perm // bands)
+
+    # 帯ごとに「同じバケツの個体」の並び（ソート順）と、バケツの区切りを先に作っておく
+    groups = []
+    for start in range(0, rows_per_band * (num_perm // rows_per_band), rows_per_band):
+        key = np.zeros(n, dtype=np.uint64)
+        for col in range(start, start + rows_per_band):
+            key = key * HASH_BASE + signatures[:, col]
+        order = np.argsort(key, kind="stable")
+        sorted_key = key[order]
+        first = np.concatenate([[0], np.nonzero(sorted_key[1:] != sorted_key[:-1])[0] + 1])
+        groups.append((order, first))
+
+    # バケツ内の最小ラベルに合わせる、を変化がなくなるまで繰り返す
+    for _ in range(max_rounds):
+        changed = False
+        for order, first in groups:
+            group_min = np.minimum.reduceat(labels[order], first)
+            new = np.repeat(group_min, np.diff(np.append(first, n)))
+            if (new < labels[order]).any():
+                labels[order] = np.minimum(labels[order], new)
+                changed = True
+        # ラベルのラベルをたどって（ポインタジャンプ）早く収束させる
+        labels = labels[labels]
+        if not changed:
+            break
+    return labels
+
+
+class DiversityReport(NamedTuple):
+    generation: int
+    size: int
+    unique_texts: int
+    mean_similarity: float  # 全ペアの Jaccard 類似度の平均（推定）
+    num_clusters: int
+    largest_cluster: int
+    collapsed: bool  # 多様性が潰れたと判断したら True
+
+    def summary(self) -> str:
+        flag = "  ** collapsed **" if self.collapsed else ""
+        return (
+            f"diversity: sim={self.mean_similarity:.3f} clusters={self.num_clusters}"
+            f" largest={self.largest_cluster}/{self.size} unique={self.unique_texts}{flag}"
+        )
+
+
+class DiversityMonitor:
+    """
+    世代ごとの多様性を記録する。
+    平均類似度が collapse_similarity 以上、または最大クラスタが集団の collapse_cluster_ratio 以上なら collapsed。
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 64,
+        shingle_len: int = 3,
+        bands: int = 16,
+        collapse_similarity: float = 0.8,
+        collapse_cluster_ratio: float = 0.9,
+        seed: int = 0,
+    ):
+        self.num_perm = num_perm
+        self.shingle_len = shingle_len
+        self.bands = bands
+        self.collapse_similarity = collapse_similarity
+        self.collapse_cluster_ratio = collapse_cluster_ratio
+        self.seed = seed
+        self.history: List[DiversityReport] = []
+
+    def measure(self, generation: int, population: Sequence) -> DiversityReport:
+        texts = [ind.text for ind in population]
+        n = len(texts)
+        signatures = minhash_signatures(texts, self.num_perm, self.shingle_len, self.seed)
+        similarity = mean_pairwise_similarity(signatures)
+        labels = lsh_clusters(signatures, self.bands)
+        sizes = np.bincount(labels, minlength=n) if n else np.zeros(0, dtype=np.int64)
+        largest = int(sizes.max()) if n else 0
+        collapsed = n > 1 and (
+            similarity >= self.collapse_similarity or largest >= self.collapse_cluster_ratio * n
+        )
+        return DiversityReport(
+            generation=generation,
+            size=n,
+            unique_texts=len(set(texts)),
+            mean_similarity=similarity,
+            num_clusters=int(np.count_nonzero(sizes)),
+            largest_cluster=largest,
+            collapsed=bool(collapsed),
+        )
+
+    def observe(self, generation: int, population: Sequence) -> DiversityReport:
+        """measure して履歴に追加する"""
+        report = self.measure(generation, population)
+        self.history.append(report)
+        return report
+
+    def latest(self) -> Optional[DiversityReport]:
+        return self.history[-1] if self.history else None
@@ -1,11 +1,17 @@
+import json
 import random
-from dataclasses import dataclass
-from typing import List, Dict, Literal
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Callable, Iterable, Iterator, List, Dict, Literal, NamedTuple, Sequence, Tuple, TypeVar, Union
 from typing import Optional
-from pydantic import BaseModel  # か dataclass か、実際の定義に合わせて
 
-# 個体
-@dataclass
+# 個体（slots=True で __dict__ を持たせない。1個体あたり約 50 バイト小さくなる）
+@dataclass(slots=True)
 class Individual:
     id: int
     text: str
@@ -36,16 +42,33 @@ CHARSET = (
 )
 
 
-def random_string(min_len: int = 10, max_len: int = 40) -> str:
-    length = random.randint(min_len, max_len)
-    return "".join(random.choice(CHARSET) for _ in range(length))
+def random_string(
+    min_len: int = 10,
+    max_len: int = 40,
+    rng: Optional[random.Random] = None,
+    charset: str = CHARSET,
+) -> str:
+    rng = rng or random
+    length = rng.randint(min_len, max_len)
+    return "".join(rng.choice(charset) for _ in range(length))
 
 
-def initialize_population(size: int, generation: int = 0) -> List[Individual]:
+def initialize_population(
+    size: int,
+    generation: int = 0,
+    rng: Optional[random.Random] = None,
+    charset: str = CHARSET,
+) -> List[Individual]:
+    """
+    ランダムな初期集団を作る。
+    rng（random.Random）を渡すとその乱数列だけを使うので、seed から同じ集団を再現できる。
+    省略時は random モジュールの共有の乱数を使う（以下の関数も同じ）。
+    charset は文字列を作る文字集合（変異でも同じものを使う）。
+    """
     return [
         Individual(
             id=i,
-            text=random_string(),
+            text=random_string(rng=rng, charset=charset),
             generation=generation,
         )
         for i in range(size)
@@ -77,28 +100,441 @@ def select_parents(population: List[Individual]) -> Individual:
     return population[-1]
 
 
-def crossover(s1: str, s2: str) -> str:
-    """2つの文字列からランダムな位置 k で交叉"""
+# 親選択戦略: (fitness 降順ソート済みの集団, 選ぶ数, rng) -> 親のリスト
+# 組み込みの3つは、候補を Individual 以外（evolve_compact の個体番号など）にもできる。
+# そのときは候補と同じ順の fitness の列を fitness= で渡す（渡さなければ候補の .fitness を読む）
+SelectionStrategy = Callable[[List[Individual], int, Optional[random.Random]], List[Individual]]
+Candidate = TypeVar("Candidate")
+
+
+def select_roulette(
+    population_sorted: Sequence[Candidate],
+    num: int,
+    rng: Optional[random.Random] = None,
+    fitness: Optional[Sequence[float]] = None,
+) -> List[Candidate]:
+    """
+    ルーレット選択を num 回分まとめて行う。
+    累積和 + 二分探索（random.choices）なので1回あたり O(log N)。
+    """
+    rng = rng or random
+    weights = [ind.fitness for ind in population_sorted] if fitness is None else fitness
+    if sum(weights) <= 0:
+        return rng.choices(population_sorted, k=num)
+    return rng.choices(population_sorted, weights=weights, k=num)
+
+
+def select_tournament(
+    population_sorted: Sequence[Candidate],
+    num: int,
+    rng: Optional[random.Random] = None,
+    tournament_size: int = 3,
+    fitness: Optional[Sequence[float]] = None,
+) -> List[Candidate]:
+    """
+    k-トーナメント選択を num 回分まとめて行う。
+    集団は fitness 降順に並んでいるので、k 個の乱数インデックスの最小値が勝者になる。
+    fitness の値そのものは比較しないので、値がすべて小さくても偏りが崩れない（fitness= も使わない）。1回あたり O(k)。
+    """
+    rng = rng or random
+    n = len(population_sorted)
+    k = max(1, tournament_size)
+    draws = rng.choices(range(n), k=num * k)
+    return [population_sorted[min(draws[i : i + k])] for i in range(0, num * k, k)]
+
+
+def select_truncation(
+    population_sorted: Sequence[Candidate],
+    num: int,
+    rng: Optional[random.Random] = None,
+    ratio: float = 0.5,
+    fitness: Optional[Sequence[float]] = None,
+) -> List[Candidate]:
+    """上位 ratio の割合の個体から一様ランダムに num 回選ぶ（切り捨て選択。fitness= は使わない）。1回あたり O(1)。"""
+    rng = rng or random
+    cut = max(1, int(len(population_sorted) * ratio))
+    return rng.choices(population_sorted[:cut], k=num)
+
+
+SELECTION_STRATEGIES: Dict[str, SelectionStrategy] = {
+    "roulette": select_roulette,
+    "tournament": select_tournament,
+    "truncation": select_truncation,
+}
+
+
+def get_selection_strategy(selection: Union[str, SelectionStrategy]) -> SelectionStrategy:
+    """名前 or 関数から選択戦略を取り出す"""
+    if callable(selection):
+        return selection
+    try:
+        return SELECTION_STRATEGIES[selection]
+    except KeyError:
+        raise ValueError(
+            f"unknown selection strategy: {selection!r} "
+            f"(choose from {sorted(SELECTION_STRATEGIES)})"
+        ) from None
+
+
+def crossover_with_point(
+    s1: str,
+    s2: str,
+    rng: Optional[random.Random] = None,
+) -> Tuple[str, int]:
+    """crossover と同じだが、交叉位置 k も返す（子 = s1[:k] + s2[k:]）"""
     if not s1:
-        return s2
+        return s2, 0
     if not s2:
-        return s1
-    k = random.randint(0, min(len(s1), len(s2)))
-    return s1[:k] + s2[k:]
+        return s1, len(s1)
+    k = (rng or random).randint(0, min(len(s1), len(s2)))
+    return s1[:k] + s2[k:], k
+
+
+def crossover(s1: str, s2: str, rng: Optional[random.Random] = None) -> str:
+    """2つの文字列からランダムな位置 k で交叉"""
+    return crossover_with_point(s1, s2, rng)[0]
 
 
-def mutate(text: str, mutation_rate: float = 0.3) -> str:
+def mutate_with_position(
+    text: str,
+    mutation_rate: float = 0.3,
+    rng: Optional[random.Random] = None,
+    charset: str = CHARSET,
+) -> Tuple[str, int]:
+    """mutate と同じだが、置換した位置も返す（変異しなかったら -1）"""
+    if not text:
+        return text, -1
+    rng = rng or random
+    if rng.random() > mutation_rate:
+        return text, -1
+    pos = rng.randint(0, len(text) - 1)
+    new_char = rng.choice(charset)
+    return text[:pos] + new_char + text[pos + 1 :], pos
+
+
+def mutate(
+    text: str, mutation_rate: float = 0.3, rng: Optional[random.Random] = None, charset: str = CHARSET
+) -> str:
     """
-    mutation_rate の確���で、ランダム位置の1文字を置換。
+    mutation_rate の確率で、ランダム位置の1文字を charset のどれかに置換。
     例: mutation_rate=0.3 → 30%の確率で1文字だけ変異
     """
-    if not text:
-        return text
-    if random.random() > mutation_rate:
-        return text
-    pos = random.randint(0, len(text) - 1)
-    new_char = random.choice(CHARSET)
-    return text[:pos] + new_char + text[pos + 1 :]
+    return mutate_with_position(text, mutation_rate, rng, charset)[0]
+
+
+# 系譜の1レコード。parent2_id == -1 ならエリートのコピー（交叉・変異なし）
+class LineageRecord(NamedTuple):
+    generation: int
+    id: int
+    parent1_id: int
+    parent2_id: int
+    crossover_point: int
+    mutation_pos: int
+
+
+class GenerationLineage:
+    """1世代分の親ポインタ。個体ごとのフィールドではなく、世代ごとの整数配列で持つ"""
+
+    def __init__(self, generation: int, size: int):
+        self.generation = generation
+        self.size = size
+        self._ids = array("q", [-1]) * size
+        self._child_ids: Optional[Tuple[int, int]] = None  # (最初の子の slot, その id)。ids を読むまで書かない
+        self.parent1 = array("q", [-1]) * size
+        self.parent2 = array("q", [-1]) * size
+        self.crossover_point = array("i", [-1]) * size
+        self.mutation_pos = array("i", [-1]) * size
+        self._slot_of: Optional[Dict[int, int]] = None
+
+    @property
+    def ids(self) -> array:
+        """slot ごとの個体 id"""
+        if self._child_ids is not None:
+            start, first_id = self._child_ids
+            self._child_ids = None
+            _write_ints(self._ids, start, range(first_id, first_id + self.size - start))
+        return self._ids
+
+    def set_child_ids(self, start: int, first_id: int) -> None:
+        """slot start 以降の id を first_id からの連番にする（evolve_one_generation の子。実際に書くのは ids を読むとき）"""
+        self._child_ids = (start, first_id)
+
+    def set(
+        self,
+        slot: int,
+        child_id: int,
+        parent1_id: int,
+        parent2_id: int = -1,
+        crossover_point: int = -1,
+        mutation_pos: int = -1,
+    ) -> None:
+        self.ids[slot] = child_id
+        self.parent1[slot] = parent1_id
+        self.parent2[slot] = parent2_id
+        self.crossover_point[slot] = crossover_point
+        self.mutation_pos[slot] = mutation_pos
+
+    def record_at(self, slot: int) -> LineageRecord:
+        return LineageRecord(
+            self.generation,
+            self.ids[slot],
+            self.parent1[slot],
+            self.parent2[slot],
+            self.crossover_point[slot],
+            self.mutation_pos[slot],
+        )
+
+    def find(self, indiv_id: int) -> Optional[LineageRecord]:
+        """id からレコードを引く（id -> slot の対応は初回の問い合わせ時に作る）"""
+        if self._slot_of is None:
+            self._slot_of = {child_id: slot for slot, child_id in enumerate(self.ids)}
+        slot = self._slot_of.get(indiv_id)
+        return None if slot is None else self.record_at(slot)
+
+    def nbytes(self) -> int:
+        return sum(
+            a.itemsize * len(a)
+            for a in (self._ids, self.parent1, self.parent2, self.crossover_point, self.mutation_pos)
+        )
+
+
+class LineageRecorder:
+    """
+    evolve_one_generation に渡すと、子ごとの親 id・交叉位置・変異位置を記録する。
+    古い世代から捨てるので、保持するのは直近 max_generations 世代分だけ。
+    """
+
+    def __init__(self, max_generations: int = 1000):
+        self.max_generations = max_generations
+        self._generations: "OrderedDict[int, GenerationLineage]" = OrderedDict()
+
+    def begin_generation(self, generation: int, size: int) -> GenerationLineage:
+        rec = GenerationLineage(generation, size)
+        self._generations[generation] = rec
+        self._generations.move_to_end(generation)
+        while len(self._generations) > self.max_generations:
+            self._generations.popitem(last=False)
+        return rec
+
+    def generation(self, generation: int) -> Optional[GenerationLineage]:
+        return self._generations.get(generation)
+
+    def get(self, generation: int, indiv_id: int) -> Optional[LineageRecord]:
+        rec = self._generations.get(generation)
+        return None if rec is None else rec.find(indiv_id)
+
+    def trace_ancestry(
+        self,
+        generation: int,
+        indiv_id: int,
+        max_depth: Optional[int] = None,
+    ) -> List[LineageRecord]:
+        """
+        (generation, id) の個体から祖先をたどり、見つかったレコードを新しい世代順に返す。
+        両親をたどる。記録が捨てられた世代より前は打ち切り。
+        """
+        result: List[LineageRecord] = []
+        frontier = {indiv_id}
+        gen = generation
+        depth = 0
+        while frontier and (max_depth is None or depth <= max_depth):
+            rec = self._generations.get(gen)
+            if rec is None:
+                break
+            parents = set()
+            for i in sorted(frontier):
+                r = rec.find(i)
+                if r is None:
+                    continue
+                result.append(r)
+                parents.add(r.parent1_id)
+                if r.parent2_id >= 0:
+                    parents.add(r.parent2_id)
+            parents.discard(-1)
+            frontier = parents
+            gen -= 1
+            depth += 1
+        return result
+
+    def nbytes(self) -> int:
+        return sum(rec.nbytes() for rec in self._generations.values())
+
+
+# ============
+# フェーズごとの計測
+# ============
+
+
+class JsonlSink:
+    """PhaseTimer のレコードを JSON Lines で追記する sink"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __call__(self, record: dict) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class PhaseTimer:
+    """
+    evolve_one_generation に渡すと、フェーズ（fitness / sort / elites / selection / children /
+    crossover / mutation / lineage）ごとの経過時間と、確保中のメモリブロック数（sys.getallocatedblocks）の
+    増減を測る。crossover / mutation は時間だけで、その分のブロック数は children に入る。
+    世代の終わりに {"generation", "population_size", "total_seconds", "phases": {名前: {"seconds", "blocks"}}}
+    を sink（レコードを受け取る関数。JsonlSink など）に渡す。
+
+    evolve_one_generation の前に phase("scoring") などで測った分も、同じ世代のレコードに入る。
+    auto_emit=False なら evolve_one_generation はレコードを出さないので、後の処理も測ってから自分で emit する。
+    渡さなければ（timer=None）計測のコードは通らない。
+    """
+
+    def __init__(self, sink: Optional[Callable[[dict], None]] = None, auto_emit: bool = True):
+        self.sink = sink
+        self.auto_emit = auto_emit
+        self.last: Optional[dict] = None
+        self._phases: Dict[str, List[float]] = {}
+        self._mark_time = 0.0
+        self._mark_blocks = 0
+
+    def add(self, name: str, seconds: float, blocks: int = 0) -> None:
+        entry = self._phases.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += blocks
+
+    def mark(self) -> None:
+        """lap の起点を今にする"""
+        self._mark_blocks = sys.getallocatedblocks()
+        self._mark_time = time.perf_counter()
+
+    def lap(self, name: str) -> None:
+        """前の mark / lap からの分を name に加えて、起点を今にする"""
+        now = time.perf_counter()
+        blocks = sys.getallocatedblocks()
+        self.add(name, now - self._mark_time, blocks - self._mark_blocks)
+        self._mark_blocks = blocks
+        self._mark_time = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, sys.getallocatedblocks() - blocks)
+
+    def emit(self, generation: int, **extra) -> dict:
+        """ここまでの分を1世代のレコードにして sink に渡し、次の世代のために空にする"""
+        phases = {
+            name: {"seconds": seconds, "blocks": blocks} for name, (seconds, blocks) in self._phases.items()
+        }
+        record = {
+            "generation": generation,
+            **extra,
+            "total_seconds": sum(p["seconds"] for p in phases.values()),
+            "phases": phases,
+        }
+        self._phases = {}
+        self.last = record
+        if self.sink is not None:
+            self.sink(record)
+        return record
+
+
+# ============
+# 収束の判定（早期終了）
+# ============
+
+
+class StopRecord(NamedTuple):
+    reason: str  # "target" / "plateau" / "collapsed"
+    generation: int
+    best: float
+    mean: float
+    similarity: Optional[float]  # その世代の平均類似度（渡されていれば）
+    detail: str
+
+    def summary(self) -> str:
+        sim = "-" if self.similarity is None else f"{self.similarity:.3f}"
+        detail = f" ({self.detail})" if self.detail else ""
+        return (
+            f"stopped at generation {self.generation}: {self.reason}{detail}"
+            f"  best={self.best:.3f} mean={self.mean:.3f} sim={sim}"
+        )
+
+
+class ConvergenceMonitor:
+    """
+    世代ごとのスコア（wins など、大きいほど良い値）の best / mean と、集団の平均類似度を流しながら見て、
+    進化を止めてよいかを判断する。
+      target:    best が target_score 以上になった（または observe に target_reached=True が渡された）
+      plateau:   直近 window 世代で best も mean も threshold 以下しか伸びていない
+      collapsed: 直近 window 世代ずっと平均類似度が max_similarity 以上で、best も伸びていない
+    threshold = max(min_delta, min_rel_delta * |window 世代前の best|)。
+    保持するのは直近 window + 1 世代分だけ。止めた理由は stopped に残し、sink があればレコード（dict）を渡す。
+    """
+
+    def __init__(
+        self,
+        window: int = 100,
+        min_delta: float = 0.0,
+        min_rel_delta: float = 1e-3,
+        target_score: Optional[float] = None,
+        max_similarity: Optional[float] = None,
+        sink: Optional[Callable[[dict], None]] = None,
+    ):
+        if window < 1:
+            raise ValueError("window must be >= 1")
+        self.window = window
+        self.min_delta = min_delta
+        self.min_rel_delta = min_rel_delta
+        self.target_score = target_score
+        self.max_similarity = max_similarity
+        self.sink = sink
+        self.stopped: Optional[StopRecord] = None
+        # (best, mean, similarity) の直近 window + 1 世代分
+        self._history: "deque[Tuple[float, float, Optional[float]]]" = deque(maxlen=window + 1)
+
+    def observe(
+        self,
+        generation: int,
+        scores: Sequence[float],
+        similarity: Optional[float] = None,
+        target_reached: bool = False,
+        detail: str = "",
+    ) -> bool:
+        """1世代分のスコアを記録して、止めるべきなら True（理由は stopped）。一度止めたらずっと True"""
+        if self.stopped is not None:
+            return True
+        if not scores:
+            raise ValueError("scores must not be empty")
+        best = max(scores)
+        mean = sum(scores) / len(scores)
+        self._history.append((best, mean, similarity))
+
+        reason = None
+        if target_reached or (self.target_score is not None and best >= self.target_score):
+            reason = "target"
+        elif len(self._history) == self._history.maxlen:
+            old_best, old_mean, _ = self._history[0]
+            threshold = max(self.min_delta, self.min_rel_delta * abs(old_best))
+            best_flat = best - old_best <= threshold
+            if best_flat and mean - old_mean <= threshold:
+                reason = "plateau"
+                detail = detail or f"best +{best - old_best:.4g}, mean {mean - old_mean:+.4g} in {self.window} generations"
+            elif best_flat and self.max_similarity is not None and all(
+                sim is not None and sim >= self.max_similarity for _, _, sim in self._history
+            ):
+                reason = "collapsed"
+                detail = detail or f"similarity >= {self.max_similarity} for {self.window} generations"
+        if reason is None:
+            return False
+
+        self.stopped = StopRecord(reason, generation, best, mean, similarity, detail)
+        if self.sink is not None:
+            self.sink(self.stopped._asdict())
+        return True
 
 
 def evolve_one_generation(
@@ -107,50 +543,210 @@ def evolve_one_generation(
     elite_size: int,
     mutation_rate: float,
     next_generation_index: int,
+    selection: Union[str, SelectionStrategy] = "roulette",
+    lineage: Optional[LineageRecorder] = None,
+    rng: Optional[random.Random] = None,
+    timer: Optional[PhaseTimer] = None,
+    out: Optional[List[Individual]] = None,
+    next_id: Optional[int] = None,
+    charset: str = CHARSET,
 ) -> List[Individual]:
     """
     wins / losses がすでに埋まっている前提で、
     fitness を計算し、1世代進化させる。
+
+    selection には "roulette" / "tournament" / "truncation" か、
+    (ソート済み集団, 選ぶ数, rng) -> 親リスト の関数を渡せる。
+    親は1世代分まとめて一括で選ぶ。
+
+    lineage を渡すと、各個体の親 id・交叉位置・変異位置を記録する。
+    rng を渡すと乱数はすべてそこから取るので、同じ seed なら同じ次世代になる。
+    timer を渡すと、フェーズごとの時間とメモリブロック数を測って世代の終わりに記録する。
+    out に2世代前の集団（もう使わないリスト）を渡すと、その Individual を上書きして使い回し、
+    out 自体を返す（新しい世代のリストとオブジェクトを毎回作らない。ダブルバッファ）。
+
+        pop, spare = evolve_one_generation(pop, ..., out=spare), pop
+
+    next_id を渡すと、エリートは id をそのまま持ち越し、子どもには next_id から連番の id を振る
+    （世代をまたいで一意にするには、これまでに払い出したどの id よりも大きい番号を渡す。
+    子どもは next_id から population_size - エリート数 個の id を使う）。
+    省略時は従来どおり、世代ごとに 0 から振り直す。
+    charset は変異で入れる文字の集合（initialize_population に渡したものと同じにする）。
     """
+    select = get_selection_strategy(selection)
+    if out is not None and out is population:
+        raise ValueError("out must not be the population being evolved")
+    if timer is not None:
+        timer.mark()
     compute_fitness(population)
+    if timer is not None:
+        timer.lap("fitness")
 
     population_sorted = sorted(population, key=lambda ind: ind.fitness, reverse=True)
-    next_pop: List[Individual] = []
+    if timer is not None:
+        timer.lap("sort")
+    # 使い回す Individual（out の先頭から順に使う）
+    pool: List[Individual] = []
+    if out is None:
+        next_pop: List[Individual] = []
+    else:
+        pool = out[::-1]
+        out.clear()
+        next_pop = out
+    num_elites = min(elite_size, len(population_sorted))
+    rec = None
+    if lineage is not None:
+        rec = lineage.begin_generation(next_generation_index, max(num_elites, population_size))
 
     # エリートを wins/losses/fitness ごとコピー
-    for i in range(min(elite_size, len(population_sorted))):
+    for i in range(num_elites):
         src = population_sorted[i]
         next_pop.append(
-            Individual(
-                id=len(next_pop),
-                text=src.text,
-                wins=src.wins,
-                losses=src.losses,
-                fitness=src.fitness,
-                generation=next_generation_index,
+            _reuse_individual(
+                pool,
+                len(next_pop) if next_id is None else src.id,
+                src.text,
+                next_generation_index,
+                src.wins,
+                src.losses,
+                src.fitness,
             )
         )
+    # 子どもの id は first_child_id + (子の番号)
+    first_child_id = len(next_pop) if next_id is None else next_id
 
-    # 残りは新しい子ども（wins/losses 0 から）
-    while len(next_pop) < population_size:
-        parent1 = select_parents(population_sorted)
-        parent2 = select_parents(population_sorted)
-        child_text = crossover(parent1.text, parent2.text)
-        child_text = mutate(child_text, mutation_rate=mutation_rate)
-        next_pop.append(
-            Individual(
-                id=len(next_pop),
-                text=child_text,
-                wins=0,
-                losses=0,
-                fitness=0.0,
-                generation=next_generation_index,
-            )
-        )
+    if timer is not None:
+        timer.lap("elites")
 
+    # 残りは新しい子ども（wins/losses 0 から）
+    num_children = max(0, population_size - len(next_pop))
+    parents = select(population_sorted, num_children * 2, rng)
+    if timer is not None:
+        timer.lap("selection")
+    # 親 id・交叉位置・変異位置は系譜を記録するときだけ集める（記録しないときは子ごとの処理を増やさない）。
+    # 確保済みのリストに添字で入れる（append の呼び出しより速く、親はループの中でキャッシュに載っている）。
+    # array への1個ずつの代入は list より遅いので、最後にまとめて写す
+    start = len(next_pop)
+    parent1_ids = parent2_ids = points = positions = [-1]
+    if rec is not None:
+        parent1_ids = [-1] * num_children
+        parent2_ids = [-1] * num_children
+        points = [-1] * num_children
+        positions = [-1] * num_children
+    # 交叉と変異は子ごとに交互に乱数を使うので（seed の再現性のため）ループは分けず、計測時だけ1回ずつ測る。
+    # sys.getallocatedblocks は1回 0.5µs ほどかかるので、ブロック数は子のループ全体（"children"）でだけ数える
+    crossover_time = mutation_time = 0.0
+    if timer is None and rec is None:
+        for c in range(num_children):
+            parent1 = parents[2 * c]
+            parent2 = parents[2 * c + 1]
+            child_text = crossover_with_point(parent1.text, parent2.text, rng)[0]
+            child_text = mutate_with_position(child_text, mutation_rate, rng, charset)[0]
+            next_pop.append(_reuse_individual(pool, first_child_id + c, child_text, next_generation_index))
+    elif timer is None:
+        # 系譜だけ記録する。子ごとに増えるのはリストへの代入 4回だけ
+        for c in range(num_children):
+            parent1 = parents[2 * c]
+            parent2 = parents[2 * c + 1]
+            parent1_ids[c] = parent1.id
+            parent2_ids[c] = parent2.id
+            child_text, points[c] = crossover_with_point(parent1.text, parent2.text, rng)
+            child_text, positions[c] = mutate_with_position(child_text, mutation_rate, rng, charset)
+            next_pop.append(_reuse_individual(pool, first_child_id + c, child_text, next_generation_index))
+    else:
+        for c in range(num_children):
+            parent1 = parents[2 * c]
+            parent2 = parents[2 * c + 1]
+            t0 = time.perf_counter()
+            child_text, point = crossover_with_point(parent1.text, parent2.text, rng)
+            t1 = time.perf_counter()
+            child_text, pos = mutate_with_position(child_text, mutation_rate, rng, charset)
+            t2 = time.perf_counter()
+            crossover_time += t1 - t0
+            mutation_time += t2 - t1
+            if rec is not None:
+                parent1_ids[c] = parent1.id
+                parent2_ids[c] = parent2.id
+                points[c] = point
+                positions[c] = pos
+            next_pop.append(_reuse_individual(pool, first_child_id + c, child_text, next_generation_index))
+
+    if timer is not None:
+        # ループ全体から交叉・変異の時間を引いた残り（Individual の生成など）は "children" に入れる
+        timer.lap("children")
+        timer.add("children", -(crossover_time + mutation_time))
+        timer.add("crossover", crossover_time)
+        timer.add("mutation", mutation_time)
+
+    if rec is not None:
+        # 最後に列ごとにまとめて書き込む。エリートの親は自分自身、子の id は連番
+        elite_ids = [src.id for src in population_sorted[:start]]
+        _write_ints(rec.ids, 0, elite_ids if next_id is not None else range(start))
+        _write_ints(rec.parent1, 0, elite_ids)
+        rec.set_child_ids(start, first_child_id)
+        _write_ints(rec.parent1, start, parent1_ids)
+        _write_ints(rec.parent2, start, parent2_ids)
+        _write_ints(rec.crossover_point, start, points)
+        _write_ints(rec.mutation_pos, start, positions)
+        if timer is not None:
+            timer.lap("lineage")
+
+    if timer is not None and timer.auto_emit:
+        timer.emit(next_generation_index, population_size=len(next_pop))
     return next_pop
 
 
+def _write_ints(column: array, start: int, values: Sequence[int]) -> None:
+    """
+    column[start:start + len(values)] = values。struct で array のバッファに直接書くので、
+    array(typecode, values) を作って代入するより 3 倍ほど速い（系譜の記録で世代ごとに数千個書く）
+    """
+    if values:
+        struct.pack_into(f"{len(values)}{column.typecode}", column, start * column.itemsize, *values)
+
+
+def _reuse_individual(
+    pool: List[Individual],
+    ind_id: int,
+    text: str,
+    generation: int,
+    wins: int = 0,
+    losses: int = 0,
+    fitness: float = 0.0,
+) -> Individual:
+    """pool に残っていれば最後の1つを上書きして返し、空なら新しく作る"""
+    if not pool:
+        return Individual(ind_id, text, wins, losses, fitness, generation)
+    ind = pool.pop()
+    ind.id = ind_id
+    ind.text = text
+    ind.wins = wins
+    ind.losses = losses
+    ind.fitness = fitness
+    ind.generation = generation
+    return ind
+
+
+def renumber_population(population: List[Individual], order: Sequence[int]) -> List[Individual]:
+    """population から order の順に個体を取り出し、id を 0 から振り直したコピーを返す"""
+    return [replace(population[i], id=new_id) for new_id, i in enumerate(order)]
+
+
+def select_population(population: List[Individual], order: Sequence[int]) -> List[Individual]:
+    """population から order の順に個体を取り出す（id は変えない。世代をまたいで一意な id のとき用）"""
+    return [population[i] for i in order]
+
+
+def next_individual_id(population: List[Individual]) -> int:
+    """
+    次の子どもに振る最初の id（集団の最大の id + 1）。
+    集団にいる個体の id とは重ならないが、死んだ個体や選別で捨てた子どもの id を使い直すことがある。
+    世代をまたいで一意にするには、払い出した id の次の番号を別に持っておき（API の next_indiv_id）、
+    これはそれがないとき（以前のログ・スナップショット）の代わりに使う。
+    """
+    return max((ind.id for ind in population), default=-1) + 1
+
+
 def reset_scores(population: List[Individual]) -> None:
     """Individual の wins / losses を 0 にリセット"""
     for ind in population:
@@ -165,7 +761,7 @@ def build_id_map(population: List[Individual]) -> Dict[int, Individual]:
 
 def aggregate_results_from_logs(
     population: List[Individual],
-    logs: List[PairLog],
+    logs: Iterable[PairLog],
 ) -> None:
     """
     PairLog のリストから、各 Individual の wins / losses を更新する。
@@ -185,3 +781,85 @@ def aggregate_results_from_logs(
         elif log.chosen == "B":
             b.wins += 1
             a.losses += 1
+
+
+# ============
+# 世代をまたいだ個体の索引（id が世代をまたいで一意なとき）
+# ============
+
+
+@dataclass(slots=True)
+class IndividualRecord:
+    id: int
+    text: str
+    born: int  # 初めて集団に現れた世代
+    last_seen: int  # 最後に集団にいた世代
+    wins: int = 0  # これまでのすべての世代の投票の合計
+    losses: int = 0
+
+
+class IndividualIndex:
+    """
+    id -> IndividualRecord の索引。evolve_one_generation(next_id=...) で id が世代をまたいで一意なら、
+    投票ログを世代で区切らずに先頭から1回流すだけで、生き残っている個体の累積の wins / losses が求まる。
+
+        index.observe(population, generation)   # 新しい個体を登録（持ち越した wins / losses から始める）
+        index.add_votes(logs)                    # 投票を足し込む（1件につき辞書を2回引くだけ）
+        index.apply(population)                  # 累積の wins / losses を個体に書き戻す
+        index.prune(generation - keep)           # しばらく集団にいない個体を忘れる
+    """
+
+    def __init__(self):
+        self._records: Dict[int, IndividualRecord] = {}
+
+    def observe(self, population: Iterable[Individual], generation: int) -> None:
+        """集団にいる個体を登録する。初めての id は、その個体が持っている wins / losses から数え始める"""
+        records = self._records
+        for ind in population:
+            record = records.get(ind.id)
+            if record is None:
+                records[ind.id] = IndividualRecord(ind.id, ind.text, generation, generation, ind.wins, ind.losses)
+            else:
+                record.last_seen = generation
+
+    def add_votes(self, logs: Iterable[PairLog]) -> int:
+        """投票を累積に足す。索引にない id を含む票は数えない（数えなかった票の数を返す）"""
+        records = self._records
+        skipped = 0
+        for log in logs:
+            a = records.get(log.indiv_a_id)
+            b = records.get(log.indiv_b_id)
+            if a is None or b is None:
+                skipped += 1
+                continue
+            if log.chosen == "A":
+                a.wins += 1
+                b.losses += 1
+            elif log.chosen == "B":
+                b.wins += 1
+                a.losses += 1
+        return skipped
+
+    def apply(self, population: Iterable[Individual]) -> None:
+        """population の wins / losses を累積の値にする（索引にない個体は 0）"""
+        records = self._records
+        for ind in population:
+            record = records.get(ind.id)
+            ind.wins = record.wins if record is not None else 0
+            ind.losses = record.losses if record is not None else 0
+
+    def prune(self, before_generation: int) -> int:
+        """last_seen が before_generation より前の個体を忘れる（忘れた数を返す）"""
+        stale = [i for i, record in self._records.items() if record.last_seen < before_generation]
+        for i in stale:
+            del self._records[i]
+        return len(stale)
+
+    def get(self, indiv_id: int) -> Optional[IndividualRecord]:
+        return self._records.get(indiv_id)
+
+    def __contains__(self, indiv_id: int) -> bool:
+        return indiv_id in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
@@ -3,6 +3,10 @@ import string
 from dataclasses import dataclass
 from typing import List, Dict
 
+from evolve_diversity import DiversityMonitor
+from evolve_engine import ConvergenceMonitor
+from evolve_kernels import CharClasses
+
 
 # 個体
 @dataclass
@@ -128,16 +132,26 @@ if __name__ == "__main__":
 
     hiragana_set = set("あいうえおかきくけこさしすせそたちつてとなにぬねの"
                        "はひふへほまみむめもやゆよらりるれろわをん")
+    char_classes = CharClasses({"hiragana": hiragana_set})
 
     num_generations = 100
+    diversity = DiversityMonitor()  # 世代ごとの多様性（MinHash）
+    convergence = ConvergenceMonitor(window=30, target_score=40)  # 30世代伸びないか、40文字すべてひらがなになったら止める
 
     for gen in range(num_generations):
         # ダミー評価：ひらがな数で wins/losses を更新
-        for ind in pop:
-            hira_count = sum(1 for ch in ind.text if ch in hiragana_set)
+        # （集団全体のひらがな数を NumPy でまとめて数える）
+        hira_counts = char_classes.count_population(pop)["hiragana"]
+        for ind, hira_count in zip(pop, hira_counts.tolist()):
             ind.wins = hira_count
             ind.losses = 20
 
+        # 収束したら止める（理由を表示する）
+        report = diversity.latest()
+        if convergence.observe(gen, [ind.wins for ind in pop], report.mean_similarity if report is not None else None):
+            print(convergence.stopped.summary())
+            break
+
         # 進化ステップ
         pop = evolve_one_generation(
             pop,
@@ -148,5 +162,6 @@ if __name__ == "__main__":
         )
 
         print(f"=== Generation {gen+1} ===")
+        print(diversity.observe(gen + 1, pop).summary())
         for ind in pop[:5]:  # 上位5個体だけ表示など
             print(ind.id, len(ind.text), ind.text[:50])
@@ -3,6 +3,11 @@ import string
 from dataclasses import dataclass
 from typing import List, Dict
 
+from evolve_dictmatch import DictionaryMatcher
+from evolve_diversity import DiversityMonitor
+from evolve_engine import ConvergenceMonitor
+from evolve_kernels import CharClasses
+
 
 # 個体
 @dataclass
@@ -128,6 +133,7 @@ if __name__ == "__main__":
 
     hiragana_set = set("あいうえおかきくけこさしすせそたちつてとなにぬねの"
                        "はひふへほまみむめもやゆよらりるれろわをんっゃゅょ")
+    char_classes = CharClasses({"hiragana": hiragana_set})
 
     # 特定単語のボーナス設定
     bonus_words = {
@@ -135,7 +141,6 @@ if __name__ == "__main__":
         "いぬ": 75,
         "ねずみ":75,
         "こんにちは": 110,
-        "さようなら": 110,
         "ありがとう": 75,
         "おはよう": 75,
         "こんばんは": 110,
@@ -156,7 +161,6 @@ if __name__ == "__main__":
         "くだもの": 75,
         "やさい": 75,
         "にほん": 75,
-        "にほん": 75,
         "とうきょう": 75,
         "おおさか": 75,
         "その": 75,
@@ -203,25 +207,36 @@ if __name__ == "__main__":
         # 必要ならここに追加: "ねずみ": 100 など
     }
 
+    # 大きな語彙リストを使うときはファイルから読む（1行1語、「単語<TAB>点数」も可）
+    BONUS_WORDS_FILE = None  # 例: "bonus_words.txt"
+    if BONUS_WORDS_FILE:
+        bonus_matcher = DictionaryMatcher.from_file(BONUS_WORDS_FILE, default_score=75)
+    else:
+        bonus_matcher = DictionaryMatcher(bonus_words)
+
     num_generations = 500
+    diversity = DiversityMonitor()  # 世代ごとの多様性（MinHash）
+    convergence = ConvergenceMonitor(window=100)  # 100世代伸びなくなったら止める
 
     for gen in range(num_generations):
         # ダミー評価：ひらがな数＋単語ボーナスで wins/losses を更新
-        for ind in pop:
+        # ひらがな数（集団全体を NumPy でまとめて数える）
+        hira_counts = char_classes.count_population(pop)["hiragana"]
+        for ind, hira_count in zip(pop, hira_counts.tolist()):
             text = ind.text
 
-            # ひらがな数
-            hira_count = sum(1 for ch in text if ch in hiragana_set)
-
-            # 単語ボーナス
-            word_bonus = 0
-            for w, b in bonus_words.items():
-                if w in text:
-                    word_bonus += b
+            # 単語ボーナス（辞書の単語を1回の走査でまとめて探す。1語につき1回加点）
+            word_bonus = bonus_matcher.score(text)
 
             ind.wins = hira_count + word_bonus
             ind.losses = 20  # 分母用の定数（適当でOK）
 
+        # 収束したら止める（理由を表示する）
+        report = diversity.latest()
+        if convergence.observe(gen, [ind.wins for ind in pop], report.mean_similarity if report is not None else None):
+            print(convergence.stopped.summary())
+            break
+
         # 進化ステップ
         pop = evolve_one_generation(
             pop,
@@ -232,5 +247,6 @@ if __name__ == "__main__":
         )
 
         print(f"=== Generation {gen+1} ===")
+        print(diversity.observe(gen + 1, pop).summary())
         for ind in pop[:10]:
             print(ind.id, len(ind.text), ind.text[:100])
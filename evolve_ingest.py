@@ -0,0 +1,248 @@
+"""
+/choice の受け付けを、あふれさせずに1か所で書き込むための部品。
+
+  TokenBucketLimiter  クライアントごとのトークンバケット（rate 票/秒、burst 票まで連続で可）。バケットはプロセスごと
+  RateLimitMiddleware 本文を読む前に TokenBucketLimiter で断る ASGI ミドルウェア
+  BatchWriter         上限つきの待ち行列と、それを1つずつ取り出して書き込む1本のライター
+  PairRegistry        払い出したペアの台帳（期限と件数の上限つき）。票を受け付けたら消すので二重投票も断れる
+
+ミドルウェアが制限を超えたクライアントを断り、エンドポイントは writer.submit() で行列に積んで書き込みの完了を待つ。
+行列が埋まっていれば QueueFull をすぐに投げるので、書き込みが詰まっても待たされるリクエストは増えない。
+ライターはたまった分をまとめて write_batch に渡す（ファイルを開くのもロックを取るのも1回で済む）。
+どちらも「あと何秒待てばよいか」を返すので、429 / 503 の Retry-After に使える。
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Iterable, List, NamedTuple, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class TokenBucketLimiter:
+    """
+    キー（クライアントの IP など）ごとのトークンバケット。
+    覚えておくのは最近使った max_clients 個まで（忘れたキーは満タンのバケットから始まる）。
+    バケットはこのプロセスのメモリにあるので、uvicorn --workers N ではクライアントごとの上限が
+    最大 N 倍になる（複数ワーカーなら evolve_shared.SharedTokenBucketLimiter を使う）。
+    """
+
+    blocking = False  # take はすぐ返るので、イベントループの上で呼んでよい
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 100000):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (トークン, 時刻)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, now: Optional[float] = None) -> float:
+        """トークンを1つ使う。使えたら 0、足りなければ次の1つがたまるまでの秒数"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RateLimitMiddleware:
+    """
+    ASGI ミドルウェア。paths への methods のリクエストを、本文を読んだり検証したりする前に
+    limiter で断る（429 + Retry-After）。キーは scope の client の IP。
+    limiter は take(key) -> 待つ秒数 を持つもの（TokenBucketLimiter など）か、起動時に差し替えるなら
+    それを返す引数なしの関数。limiter.blocking が True なら take はスレッドで呼ぶ。
+    """
+
+    def __init__(self, app, limiter, paths: Iterable[str], methods: Iterable[str] = ("POST",)):
+        self.app = app
+        self.limiter = limiter
+        self.paths = frozenset(paths)
+        self.methods = frozenset(methods)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http" and scope["method"] in self.methods and scope["path"] in self.paths:
+            client = scope.get("client")
+            key = client[0] if client else "-"
+            limiter = self.limiter() if callable(self.limiter) else self.limiter
+            if getattr(limiter, "blocking", False):
+                wait = await asyncio.to_thread(limiter.take, key)
+            else:
+                wait = limiter.take(key)
+            if wait > 0:
+                body = b'{"detail":"too many requests"}'
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": 429,
+                        "headers": [
+                            (b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode()),
+                            (b"retry-after", retry_after_header(wait).encode()),
+                        ],
+                    }
+                )
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+
+class QueueFull(Exception):
+    """BatchWriter の待ち行列が埋まっている"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"ingest queue is full, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-After ヘッダの値（整数の秒、最低 1）"""
+    return str(max(1, math.ceil(seconds)))
+
+
+class BatchWriter(Generic[T, R]):
+    """
+    上限 maxsize の待ち行列を、1本のタスクが batch_max 件ずつ write_batch に渡して書き込む。
+    write_batch(items) は items と同じ順で結果のリストを返す（イベントループの外のスレッドで動かしてよい）。
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[T]], Awaitable[List[R]]],
+        maxsize: int = 1000,
+        batch_max: int = 256,
+    ):
+        self.write_batch = write_batch
+        self.maxsize = maxsize
+        self.batch_max = batch_max
+        self.item_seconds = 0.001  # 1件の書き込みにかかる時間（指数移動平均。Retry-After の見積もり用）
+        self.rejected = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """イベントループの中で呼ぶ（lifespan）"""
+        self._queue = asyncio.Queue(self.maxsize)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """積まれている分を書き終えてから止める"""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        self._task = None
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, item: T) -> R:
+        """item を積んで書き込みの結果を待つ。行列が埋まっていればすぐに QueueFull"""
+        if self._queue is None:
+            raise RuntimeError("BatchWriter is not started")
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFull(self.maxsize * self.item_seconds)
+        return await future
+
+    async def _run(self) -> None:
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_max and not queue.empty():
+                batch.append(queue.get_nowait())
+            started = time.perf_counter()
+            try:
+                results = await self.write_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():  # 待っている側が切断されていれば cancel 済み
+                        future.set_result(result)
+            elapsed = (time.perf_counter() - started) / len(batch)
+            self.item_seconds += 0.1 * (elapsed - self.item_seconds)
+            for _ in batch:
+                queue.task_done()
+
+
+# ============
+# 払い出したペアの台帳
+# ============
+
+
+class IssuedPair(NamedTuple):
+    pair_id: int
+    generation: int
+    indiv_a_id: int
+    indiv_b_id: int
+    expires: float  # time.time() の秒
+
+
+class PairRegistry:
+    """
+    /pair で払い出したペアを pair_id で引ける台帳。登録も取り出しも O(1)。
+    払い出し順に並んでいるので、期限切れと max_size を超えた分は先頭から捨てる。
+    """
+
+    def __init__(self, ttl: float = 600.0, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._pairs: "OrderedDict[int, IssuedPair]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def issue_many(self, pairs: Iterable[Tuple[int, int, int, int]], now: Optional[float] = None) -> None:
+        """(pair_id, 世代, indiv_a_id, indiv_b_id) を登録する"""
+        now = time.time() if now is None else now
+        expires = now + self.ttl
+        with self._lock:
+            for pair_id, generation, a_id, b_id in pairs:
+                self._pairs[pair_id] = IssuedPair(pair_id, generation, a_id, b_id, expires)
+            self._evict(now)
+
+    def peek(self, pair_id: int, now: Optional[float] = None) -> Optional[IssuedPair]:
+        """consume と同じだが台帳から消さない（票を受け付けられるか先に確かめる用）"""
+        now = time.time() if now is None else now
+        issued = self._pairs.get(pair_id)
+        if issued is None or issued.expires <= now:
+            return None
+        return issued
+
+    def consume(self, pair_id: int, now: Optional[float] = None) -> Optional[IssuedPair]:
+        """pair_id のペアを台帳から取り出す。払い出していない・期限切れ・もう使われたなら None"""
+        return self.consume_many([pair_id], now)[0]
+
+    def consume_many(self, pair_ids: Iterable[int], now: Optional[float] = None) -> List[Optional[IssuedPair]]:
+        """consume を pair_ids の順にまとめて行う（同じ pair_id が2回あれば2回目は None）"""
+        now = time.time() if now is None else now
+        with self._lock:
+            found = [self._pairs.pop(pair_id, None) for pair_id in pair_ids]
+        return [issued if issued is not None and issued.expires > now else None for issued in found]
+
+    def _evict(self, now: float) -> None:
+        pairs = self._pairs
+        while pairs and (len(pairs) > self.max_size or next(iter(pairs.values())).expires <= now):
+            pairs.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._pairs)
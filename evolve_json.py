@@ -0,0 +1,76 @@
+"""
+投票ログ・イベントログ・API のレスポンスで使う JSON の読み書き。
+
+orjson があれば orjson、なければ msgspec、どちらもなければ標準ライブラリの json を使う。
+どれを使っても日本語は UTF-8 のまま、区切りに空白なしで、読み書きはバイト列。
+dataclass（PairLog など）は asdict を通さずにそのまま渡せる。
+
+読み戻した値は同じになるが、出力のバイト列まではそろわない（ログを実装をまたいで diff しないこと）。
+  - 浮動小数点数の指数の書き方: 標準の json は 1e-07 / 1e+16、orjson と msgspec は 1e-7 / 1e16
+  - NaN と無限大: 標準の json は NaN / Infinity（JSON としては不正）、orjson は null
+  - 辞書のキー: 標準の json は int なども文字列にするが、orjson は str 以外で TypeError
+
+    dumps(obj) -> bytes
+    dumps_line(obj) -> bytes    # 末尾に改行（JSON Lines に追記する用）
+    loads(bytes | str)
+
+どの実装を使っているかは BACKEND で分かる（python evolve_bench.py json で速さを比べられる）。
+"""
+import dataclasses
+import json
+from typing import Any, Callable, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _default(obj: Any) -> Any:
+    """標準の json で dataclass を書けるようにする"""
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+dumps: Callable[[Any], bytes]
+dumps_line: Callable[[Any], bytes]
+loads: Callable[[Union[bytes, str]], Any]
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def dumps_line(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+    loads = orjson.loads
+
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    _encoder = msgspec.json.Encoder()
+    dumps = _encoder.encode
+
+    def dumps_line(obj: Any) -> bytes:
+        return _encoder.encode(obj) + b"\n"
+
+    loads = msgspec.json.Decoder().decode
+
+else:
+    BACKEND = "json"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_default)
+
+    def dumps(obj: Any) -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
+
+    def dumps_line(obj: Any) -> bytes:
+        return (_encoder.encode(obj) + "\n").encode("utf-8")
+
+    loads = json.loads
@@ -0,0 +1,244 @@
+"""
+集団をまとめて NumPy で処理するための共通カーネル。
+
+テキストのリストを「文字コード（Unicode コードポイント）の行列 + 長さ」に変換して、
+1個体ずつ Python でループせずに集団全体を一度に計算する。
+
+    classes = CharClasses.default()
+    counts = classes.count_texts([ind.text for ind in population])
+    counts["hiragana"]  # -> 個体ごとのひらがなの数 int64 [N]
+"""
+from typing import Dict, Iterable, Mapping, Sequence, Tuple, Union
+
+import numpy as np
+
+
+def encode_texts(texts: Sequence[str], width: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    テキストのリストを (コードポイント行列 uint32 [N, W], 長さ int64 [N]) に変換する。
+    足りない部分は 0 で埋める。W は最長のテキスト長（width が大きければ width）。
+    """
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    n = len(texts)
+    w = max(int(lengths.max()) if n else 0, width)
+    codes = np.zeros((n, w), dtype=np.uint32)
+    if n == 0 or w == 0:
+        return codes, lengths
+
+    # 行優先で True の位置を埋めると、ちょうど連結した文字列の順になる
+    flat = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+    codes[valid_mask(lengths, w)] = flat
+    return codes, lengths
+
+
+def valid_mask(lengths: np.ndarray, width: int) -> np.ndarray:
+    """[N, width] の bool 行列。各行の長さより前が True"""
+    return np.arange(width)[None, :] < lengths[:, None]
+
+
+# ============
+# 文字クラスの一括カウント
+# ============
+
+
+def char_range(first: str, last: str) -> str:
+    """first から last まで（両端を含む）の文字をつなげた文字列"""
+    return "".join(chr(c) for c in range(ord(first), ord(last) + 1))
+
+
+SMALL_KANA = "ぁぃぅぇぉっゃゅょゎゕゖァィゥェォッャュョヮヵヶ"
+
+DEFAULT_CHAR_CLASSES: Dict[str, str] = {
+    "hiragana": char_range("ぁ", "ゖ"),
+    "small_kana": SMALL_KANA,
+    "katakana": char_range("ァ", "ヺ") + "ー",
+    "kanji": char_range("一", "鿿"),
+    "punctuation": "、。，．・「」『』（）！？～…",
+    "ascii_letter": char_range("A", "Z") + char_range("a", "z"),
+    "digit": char_range("0", "9") + char_range("０", "９"),
+    "ascii_symbol": "".join(ch for ch in char_range("!", "~") if not ch.isalnum()),
+}
+
+
+class CharClasses:
+    """
+    最大 8 個の文字クラスを、コードポイント -> ビットマスクの表（uint8）で持つ。
+    1文字が複数のクラスに入ってもよい（例: "っ" は hiragana と small_kana の両方）。
+    集団のコード行列に表を一度引いて、クラスごとの文字数を個体ごとに数える。
+    """
+
+    MAX_CLASSES = 8
+
+    def __init__(self, classes: Mapping[str, Union[str, Iterable[str]]]):
+        if len(classes) > self.MAX_CLASSES:
+            raise ValueError(f"at most {self.MAX_CLASSES} character classes, got {len(classes)}")
+        self.names = list(classes)
+        members = [[ord(ch) for ch in chars] for chars in classes.values()]
+        # BMP 全体＋「範囲外」用の 0 を1つ（コード 0 のパディングも 0 になる）
+        top = max([0xFFFF] + [max(cps) for cps in members if cps])
+        self._lut = np.zeros(top + 2, dtype=np.uint8)
+        for bit, cps in enumerate(members):
+            self._lut[np.array(cps, dtype=np.int64)] |= np.uint8(1 << bit)
+        self._lut[0] = 0
+
+    @classmethod
+    def default(cls) -> "CharClasses":
+        return cls(DEFAULT_CHAR_CLASSES)
+
+    def classify(self, codes: np.ndarray) -> np.ndarray:
+        """コード行列と同じ形のビットマスク行列（uint8）"""
+        lut = self._lut
+        return lut[np.minimum(codes, lut.size - 1)]
+
+    def count_matrix(self, codes: np.ndarray) -> np.ndarray:
+        """クラスごとの文字数 int64 [N, クラス数]（パディングの 0 はどのクラスにも入らない）"""
+        counts = np.zeros((codes.shape[0], len(self.names)), dtype=np.int64)
+        if codes.size == 0:
+            return counts
+        mask = self.classify(codes)
+        for bit in range(len(self.names)):
+            counts[:, bit] = np.count_nonzero(mask & np.uint8(1 << bit), axis=1)
+        return counts
+
+    def count_codes(self, codes: np.ndarray) -> Dict[str, np.ndarray]:
+        counts = self.count_matrix(codes)
+        return {name: counts[:, i] for i, name in enumerate(self.names)}
+
+    def count_texts(self, texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        """テキストのリストからクラス名 -> 個体ごとの文字数 int64 [N]"""
+        codes, _ = encode_texts(texts)
+        return self.count_codes(codes)
+
+    def count_population(self, population: Sequence) -> Dict[str, np.ndarray]:
+        """Individual のリストをまとめて数える"""
+        return self.count_texts([ind.text for ind in population])
+
+
+# ============
+# ローリングハッシュによる n-gram 一括スコア
+# ============
+
+# 多項式ハッシュの基数（奇数）。mod 2^64 は uint64 の桁あふれに任せる
+HASH_BASE = np.uint64(0x9E3779B97F4A7C15)
+# searchsorted の前に、ハッシュの上位ビットで引く bool 表で大半の窓をふるい落とす
+FILTER_BITS = 20
+
+
+class BatchNgramScorer:
+    """
+    ターゲットごとの n-gram スコア（NgramIndex.score と同じ値）を集団全体でまとめて計算する。
+
+    長さ min_len の全窓のハッシュを NumPy で一度に作り、ターゲットの部分文字列のハッシュ表
+    （長さごとのソート済み配列）を searchsorted で引く。見つかった窓だけを1文字ずつ伸ばす
+    （ターゲットに含まれない文字列を伸ばしてもターゲットには含まれないので、ここで枝刈りできる）。
+    64bit ハッシュなので衝突はありうるが、窓の数に比べて十分小さい確率。
+
+    部分文字列は「どのターゲットに含まれるか」の組み合わせ（クラス）ごとにまとめておき、
+    個体 × クラスの加点を bincount で数えてから、最後にクラス × ターゲットの表を掛ける。
+    """
+
+    def __init__(self, targets: Sequence[str], min_len: int = 3, max_bins: int = 1 << 22):
+        if min_len < 1:
+            raise ValueError("min_len must be >= 1")
+        self.targets = list(targets)
+        self.min_len = min_len
+        self.max_len = max((len(t) for t in self.targets), default=0)
+        num_targets = len(self.targets)
+
+        # 長さ n ごとの (上位ビットのふるい, ソート済みハッシュ [U], 各ハッシュのクラス番号 [U])
+        self._tables: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        per_length = []
+        codes, lengths = encode_texts(self.targets)
+        for n, rows, _, hashes in self._iter_windows(codes, lengths):
+            keys, inverse = np.unique(hashes, return_inverse=True)
+            member = np.zeros((keys.size, num_targets), dtype=bool)
+            member[inverse, rows] = True
+            per_length.append((n, keys, member))
+
+        all_members = [m for _, _, m in per_length]
+        if all_members:
+            classes, inverse = np.unique(np.concatenate(all_members), axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        else:
+            classes, inverse = np.zeros((0, num_targets), dtype=bool), np.zeros(0, dtype=np.int64)
+        offset = 0
+        for n, keys, _ in per_length:
+            sieve = np.zeros(1 << FILTER_BITS, dtype=bool)
+            sieve[keys >> np.uint64(64 - FILTER_BITS)] = True
+            self._tables[n] = (sieve, keys, inverse[offset : offset + keys.size])
+            offset += keys.size
+        self._classes = classes.astype(np.float64)  # [クラス数, T]
+        # 1チャンクの bincount の大きさ（行数 × クラス数）をこれ以下に抑える
+        self.chunk_rows = max(1, max_bins // max(1, len(classes)))
+
+    def _iter_windows(self, codes: np.ndarray, lengths: np.ndarray, lookup: bool = False):
+        """
+        長さ min_len から順に (n, 行, 開始位置, ハッシュ) を返す（行は昇順）。
+        lookup=True なら表にない窓はそこで捨てて次の長さでは伸ばさず、ハッシュの代わりにクラス番号を返す。
+        """
+        n = self.min_len
+        width = codes.shape[1]
+        if width < n:
+            return
+        num_windows = width - n + 1
+        h = np.zeros((codes.shape[0], num_windows), dtype=np.uint64)
+        for k in range(n):
+            h = h * HASH_BASE + codes[:, k : k + num_windows]
+        valid = np.arange(num_windows)[None, :] + n <= lengths[:, None]
+        rows, starts = np.nonzero(valid)
+        hashes = h[valid]
+
+        while rows.size:
+            if not lookup:
+                yield n, rows, starts, hashes
+            else:
+                table = self._tables.get(n)
+                if table is None:
+                    break
+                sieve, keys, key_class = table
+                maybe = sieve[hashes >> np.uint64(64 - FILTER_BITS)]
+                rows, starts, hashes = rows[maybe], starts[maybe], hashes[maybe]
+                idx = np.minimum(np.searchsorted(keys, hashes), keys.size - 1)
+                found = keys[idx] == hashes
+                rows, starts, hashes = rows[found], starts[found], hashes[found]
+                if not rows.size:
+                    break
+                yield n, rows, starts, key_class[idx[found]]
+            # 1文字伸ばす（行の長さを超える窓は終わり）
+            ends = starts + n
+            keep = ends < lengths[rows]
+            rows, starts, ends, hashes = rows[keep], starts[keep], ends[keep], hashes[keep]
+            hashes = hashes * HASH_BASE + codes[rows, ends]
+            n += 1
+
+    def score_codes(self, codes: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """ターゲットごとのスコア int64 [N, T]。コード行列は chunk_rows 行ずつ処理する"""
+        n_rows = codes.shape[0]
+        scores = np.zeros((n_rows, len(self.targets)), dtype=np.int64)
+        for lo in range(0, n_rows, self.chunk_rows):
+            hi = min(lo + self.chunk_rows, n_rows)
+            scores[lo:hi] = self._score_chunk(codes[lo:hi], lengths[lo:hi])
+        return scores
+
+    def _score_chunk(self, codes: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        num_classes = len(self._classes)
+        bins, weights = [], []
+        for n, rows, _, key_class in self._iter_windows(codes, lengths, lookup=True):
+            bins.append(rows * num_classes + key_class)
+            weights.append(np.full(rows.size, float(n)))
+        n_rows = codes.shape[0]
+        if not bins:
+            return np.zeros((n_rows, len(self.targets)), dtype=np.int64)
+        # 個体 × クラスごとの加点（一致した窓の長さの合計）
+        per_class = np.bincount(
+            np.concatenate(bins), weights=np.concatenate(weights), minlength=n_rows * num_classes
+        ).reshape(n_rows, num_classes)
+        return np.rint(per_class @ self._classes).astype(np.int64)
+
+    def score_texts(self, texts: Sequence[str]) -> np.ndarray:
+        codes, lengths = encode_texts(texts)
+        return self.score_codes(codes, lengths)
+
+    def score_population(self, population: Sequence) -> np.ndarray:
+        """Individual のリストをまとめてスコアする（行 i が population[i]、列 j が targets[j]）"""
+        return self.score_texts([ind.text for ind in population])
@@ -0,0 +1,309 @@
+"""
+コーパスから学習する文字 n-gram 言語モデル（補間 Kneser-Ney）。
+
+人間の投票の前に「日本語らしさ」を機械的にふるい分けるための fitness バックエンド。
+モデルは整数キーのソート済み配列 + 確率の配列だけで持ち、
+集団全体のスコアは searchsorted による一括検索で計算する。
+学習結果はディスクにキャッシュし、読み込み時はメモリマップする。
+
+    lm = load_or_train("文章プール.txt", order=3)
+    scores = lm.score_texts([ind.text for ind in population])  # 1文字あたりの平均 log 確率
+    kept = prescreen(children, lm, keep=100)                    # スコアの高い 100 個体の位置
+
+    python evolve_lm.py                 # 文章プール.txt で学習して簡単に試す
+"""
+import hashlib
+import json
+import os
+import random
+import shutil
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from evolve_kernels import encode_texts, valid_mask
+
+BOS, EOS, UNK = 0, 1, 2
+NUM_SPECIAL = 3
+DEFAULT_CORPUS_PATH = Path(__file__).with_name("文章プール.txt")
+DEFAULT_CACHE_DIR = Path(".lm_cache")
+
+
+def iter_corpus_lines(path: Union[str, Path]) -> Iterable[str]:
+    """コーパスファイルの空でない行"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def _discount(counts: Iterable[int]) -> float:
+    """D = n1 / (n1 + 2 n2)。数えられないときは 0.75"""
+    hist = Counter(c for c in counts if c <= 2)
+    n1, n2 = hist[1], hist[2]
+    if n1 == 0 or n2 == 0:
+        return 0.75
+    return n1 / (n1 + 2 * n2)
+
+
+class CharNgramLM:
+    """
+    次数 order ごとに
+      keys[k]     : (文脈, 文字) を V 進数で詰めた int64 キー（ソート済み）
+      term[k]     : max(c - D, 0) / c(文脈)
+      ctx_keys[k] : 文脈キー（ソート済み）
+      gamma[k]    : D * N1+(文脈 •) / c(文脈)（下位次数に回す重み）
+    を持ち、1-gram だけは全文字ぶんの確率 p1 を密な配列で持つ。
+    """
+
+    def __init__(self, order: int, vocab: np.ndarray, arrays: Dict[str, np.ndarray], meta: Optional[dict] = None):
+        self.order = order
+        self.vocab = vocab  # 文字のコードポイント（ソート済み）。id = 位置 + NUM_SPECIAL
+        self.vocab_size = len(vocab) + NUM_SPECIAL
+        self.arrays = arrays
+        self.meta = meta or {}
+
+    # ============
+    # 学習
+    # ============
+
+    @classmethod
+    def train(cls, lines: Iterable[str], order: int = 3) -> "CharNgramLM":
+        lines = list(lines)
+        chars = sorted(set("".join(lines)))
+        vocab = np.array([ord(c) for c in chars], dtype=np.uint32)
+        char_id = {c: i + NUM_SPECIAL for i, c in enumerate(chars)}
+        V = len(chars) + NUM_SPECIAL
+        if V ** order >= 2 ** 62:
+            raise ValueError(f"vocabulary too large for order {order}: V={V}")
+
+        # 最高次は生の出現回数、それより下は「左に何種類の文字が来たか」（継続回数）
+        top: Counter = Counter()
+        for line in lines:
+            seq = [BOS] * (order - 1) + [char_id[c] for c in line] + [EOS]
+            for j in range(order - 1, len(seq)):
+                top[tuple(seq[j - order + 1 : j + 1])] += 1
+
+        counts: Dict[int, Counter] = {order: top}
+        for k in range(order - 1, 0, -1):
+            cont: Counter = Counter()
+            for gram in counts[k + 1]:
+                cont[gram[1:]] += 1
+            counts[k] = cont
+
+        arrays: Dict[str, np.ndarray] = {}
+        discounts: Dict[int, float] = {}
+
+        # 1-gram: 一様分布（BOS 以外の V - 1 文字）と補間
+        c1 = counts[1]
+        D = _discount(c1.values())
+        discounts[1] = D
+        total = sum(c1.values())
+        p1 = np.full(V, D * len(c1) / total / (V - 1))
+        for (w,), c in c1.items():
+            p1[w] += max(c - D, 0.0) / total
+        p1[BOS] = 0.0  # BOS は予測しない
+        arrays["p1"] = p1
+
+        for k in range(2, order + 1):
+            ck = counts[k]
+            D = _discount(ck.values())
+            discounts[k] = D
+            ctx_total: Dict[tuple, int] = defaultdict(int)
+            ctx_types: Dict[tuple, int] = defaultdict(int)
+            for gram, c in ck.items():
+                ctx_total[gram[:-1]] += c
+                ctx_types[gram[:-1]] += 1
+
+            keys = np.fromiter((_pack(g, V) for g in ck), dtype=np.int64, count=len(ck))
+            term = np.fromiter(
+                (max(c - D, 0.0) / ctx_total[g[:-1]] for g, c in ck.items()),
+                dtype=np.float64,
+                count=len(ck),
+            )
+            ctx_keys = np.fromiter((_pack(h, V) for h in ctx_total), dtype=np.int64, count=len(ctx_total))
+            gamma = np.fromiter(
+                (D * ctx_types[h] / ctx_total[h] for h in ctx_total),
+                dtype=np.float64,
+                count=len(ctx_total),
+            )
+            order_keys = np.argsort(keys)
+            order_ctx = np.argsort(ctx_keys)
+            arrays[f"keys{k}"] = keys[order_keys]
+            arrays[f"term{k}"] = term[order_keys]
+            arrays[f"ctx_keys{k}"] = ctx_keys[order_ctx]
+            arrays[f"gamma{k}"] = gamma[order_ctx]
+
+        meta = {"order": order, "vocab_size": V, "discounts": discounts, "num_lines": len(lines)}
+        return cls(order, vocab, arrays, meta)
+
+    # ============
+    # 保存・読み込み
+    # ============
+
+    def save(self, directory: Union[str, Path]) -> None:
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / "vocab.npy", self.vocab)
+        for name, arr in self.arrays.items():
+            np.save(directory / f"{name}.npy", arr)
+        with open(directory / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], mmap: bool = True) -> "CharNgramLM":
+        """save したモデルを読む。mmap=True なら配列はメモリマップ（ページは使うときに読まれる）"""
+        directory = Path(directory)
+        mode = "r" if mmap else None
+        with open(directory / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        order = meta["order"]
+        names = ["p1"] + [f"{n}{k}" for k in range(2, order + 1) for n in ("keys", "term", "ctx_keys", "gamma")]
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode=mode) for name in names}
+        vocab = np.load(directory / "vocab.npy", mmap_mode=mode)
+        return cls(order, vocab, arrays, meta)
+
+    # ============
+    # スコア計算
+    # ============
+
+    def encode(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """テキストを文字 id の行列 int64 [N, W]（パディング部分は EOS）と長さに変換する"""
+        codes, lengths = encode_texts(texts)
+        if self.vocab.size == 0:
+            return np.full(codes.shape, UNK, dtype=np.int64), lengths
+        pos = np.searchsorted(self.vocab, codes)
+        pos_clipped = np.minimum(pos, self.vocab.size - 1)
+        known = self.vocab[pos_clipped] == codes
+        ids = np.where(known, pos_clipped + NUM_SPECIAL, UNK).astype(np.int64)
+        ids[~valid_mask(lengths, codes.shape[1])] = EOS
+        return ids, lengths
+
+    def char_logprobs(self, ids: np.ndarray) -> np.ndarray:
+        """文字 id 行列 [N, W] の各位置の log P(文字 | 直前 order-1 文字)（行頭は BOS で埋める）"""
+        n, w = ids.shape
+        V = self.vocab_size
+        seq = np.concatenate([np.full((n, self.order - 1), BOS, dtype=np.int64), ids], axis=1)
+        target = seq[:, self.order - 1 :]
+        p = np.asarray(self.arrays["p1"])[target]
+
+        for k in range(2, self.order + 1):
+            # 文脈 = 直前 k-1 文字
+            h = np.zeros((n, w), dtype=np.int64)
+            for i in range(k - 1):
+                start = self.order - k + i
+                h = h * V + seq[:, start : start + w]
+            term = _lookup(self.arrays[f"keys{k}"], self.arrays[f"term{k}"], h * V + target, 0.0)
+            gamma = _lookup(self.arrays[f"ctx_keys{k}"], self.arrays[f"gamma{k}"], h, 1.0)
+            p = term + gamma * p
+
+        with np.errstate(divide="ignore"):
+            return np.log(p)
+
+    def score_texts(self, texts: Sequence[str]) -> np.ndarray:
+        """1文字あたりの平均 log 確率（大きいほど日本語らしい）。空文字列は -inf"""
+        ids, lengths = self.encode(texts)
+        if ids.shape[1] == 0:
+            return np.full(len(texts), -np.inf)
+        logp = self.char_logprobs(ids)
+        logp[~valid_mask(lengths, ids.shape[1])] = 0.0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores = logp.sum(axis=1) / lengths
+        scores[lengths == 0] = -np.inf
+        return scores
+
+    def score_population(self, population: Sequence) -> np.ndarray:
+        """Individual のリストをまとめてスコアする"""
+        return self.score_texts([ind.text for ind in population])
+
+
+def _pack(gram: tuple, V: int) -> int:
+    key = 0
+    for x in gram:
+        key = key * V + x
+    return key
+
+
+def _lookup(keys: np.ndarray, values: np.ndarray, query: np.ndarray, default: float) -> np.ndarray:
+    """ソート済み keys から query を一括検索し、見つかれば values、なければ default"""
+    if keys.size == 0:
+        return np.full(query.shape, default)
+    idx = np.searchsorted(keys, query)
+    idx_clipped = np.minimum(idx, keys.size - 1)
+    found = keys[idx_clipped] == query
+    return np.where(found, np.asarray(values)[idx_clipped], default)
+
+
+def corpus_cache_dir(corpus_path: Union[str, Path], order: int, cache_dir: Union[str, Path] = DEFAULT_CACHE_DIR) -> Path:
+    """コーパスの中身のハッシュと次数で決まるキャッシュディレクトリ"""
+    digest = hashlib.sha256(Path(corpus_path).read_bytes()).hexdigest()[:16]
+    return Path(cache_dir) / f"{digest}_o{order}"
+
+
+def load_or_train(
+    corpus_path: Union[str, Path] = DEFAULT_CORPUS_PATH,
+    order: int = 3,
+    cache_dir: Union[str, Path] = DEFAULT_CACHE_DIR,
+) -> CharNgramLM:
+    """
+    キャッシュがあればメモリマップで読み、なければ学習して保存する。
+    別の名前のディレクトリに保存してから名前を変えるので、uvicorn --workers N で同時に学習しても、
+    ほかのプロセスがメモリマップしているファイルを書き換えることはない（先に置いたほうが使われる）
+    """
+    directory = corpus_cache_dir(corpus_path, order, cache_dir)
+    if (directory / "meta.json").exists():
+        return CharNgramLM.load(directory)
+    lm = CharNgramLM.train(iter_corpus_lines(corpus_path), order=order)
+    lm.meta["corpus"] = str(corpus_path)
+    tmp = directory.with_name(f"{directory.name}.tmp{os.getpid()}")
+    lm.save(tmp)
+    try:
+        os.rename(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # 別のプロセスが先に保存した
+    return CharNgramLM.load(directory)
+
+
+def prescreen(
+    candidates: Sequence,
+    lm: CharNgramLM,
+    keep: int,
+    rng: Optional[random.Random] = None,
+    explore: float = 0.0,
+) -> List[int]:
+    """
+    言語モデルのスコアが高い順に keep 個体を残す（人間に見せる前のふるい分け）。
+    残す位置を昇順で返す（PreferenceSurrogate.prescreen と同じ形）。
+    explore の割合だけは残りからランダムに選ぶ
+    """
+    rng = rng or random
+    n = len(candidates)
+    if keep >= n:
+        return list(range(n))
+    ranked = np.argsort(-lm.score_population(candidates), kind="stable").tolist()
+    num_random = min(int(keep * explore), n - keep)
+    kept = ranked[: keep - num_random]
+    kept += rng.sample(ranked[keep - num_random :], num_random)
+    return sorted(kept)
+
+
+if __name__ == "__main__":
+    import time
+
+    from evolve_engine import random_string
+
+    t0 = time.perf_counter()
+    lm = load_or_train(DEFAULT_CORPUS_PATH, order=3)
+    print(f"load_or_train: {(time.perf_counter() - t0) * 1e3:.1f} ms  meta={lm.meta}")
+
+    samples = list(iter_corpus_lines(DEFAULT_CORPUS_PATH))[:5] + [random_string() for _ in range(5)]
+    for text, score in zip(samples, lm.score_texts(samples)):
+        print(f"{score:8.3f}  {text[:40]}")
+
+    texts = [random_string() for _ in range(100000)]
+    t0 = time.perf_counter()
+    lm.score_texts(texts)
+    print(f"score 100000 texts: {(time.perf_counter() - t0) * 1e3:.1f} ms")
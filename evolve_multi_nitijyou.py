@@ -1,7 +1,11 @@
 import random
 import string
 from dataclasses import dataclass
-from typing import List, Dict, Set
+from typing import List, Dict
+
+from evolve_diversity import DiversityMonitor
+from evolve_engine import ConvergenceMonitor
+from evolve_kernels import BatchNgramScorer
 
 
 # 個体
@@ -132,16 +136,6 @@ def evolve_one_generation(
     return next_pop
 
 
-def extract_ngrams(text: str, min_len: int = 3) -> Set[str]:
-    """text から長さ min_len 以上の全ての部分文字列を集合として取り出す"""
-    ngrams: Set[str] = set()
-    n = len(text)
-    for length in range(min_len, n + 1):
-        for i in range(0, n - length + 1):
-            ngrams.add(text[i : i + length])
-    return ngrams
-
-
 if __name__ == "__main__":
     # random.seed(0)  # 毎回同じ進化を再現したければコメントアウトを外す
 
@@ -195,34 +189,26 @@ TARGET_TEXTS = [
     "ですね",
 ]
 
-# 各ターゲットから ngram の集合を作る（3文字以上）
+# 全ターゲットの n-gram スコアを、集団まとめて NumPy で計算する（ローリングハッシュ）
 min_ngram_len = 3
-target_ngrams_list: List[Set[str]] = [
-    extract_ngrams(t, min_len=min_ngram_len) for t in TARGET_TEXTS
-]
+target_scorer = BatchNgramScorer(TARGET_TEXTS, min_len=min_ngram_len)
 
 num_generations = 1000
+diversity = DiversityMonitor()  # 世代ごとの多様性（MinHash）
+# 100世代 best も mean も伸びないか、集団の中に丸ごと現れたターゲットが TARGET_FRACTION の割合に達したら止める
+# （wins はターゲット全体の平均なので、1つ現れただけでは止めない）
+convergence = ConvergenceMonitor(window=100)
+TARGET_FRACTION = 1.0
 
 # ターゲット数（平均用）
-num_targets = len(target_ngrams_list)
+num_targets = len(TARGET_TEXTS)
 
 for gen in range(num_generations):
-        for ind in pop:
-            text = ind.text
-
-            # ターゲットごとの ngram マッチスコア
-            # match_scores[j] が「TARGET_TEXTS[j] に対するマッチ量」
-            match_scores = [0 for _ in range(num_targets)]
-
-            n = len(text)
-            for length in range(min_ngram_len, n + 1):
-                for i in range(0, n - length + 1):
-                    substr = text[i : i + length]
-                    for j, target_ngrams in enumerate(target_ngrams_list):
-                        if substr in target_ngrams:
-                            # ターゲット j に対して length 分だけ加点
-                            match_scores[j] += length
-
+        # ターゲットごとの ngram マッチスコア（集団全体を一度に計算）
+        # match_matrix[i, j] が「pop[i] の TARGET_TEXTS[j] に対するマッチ量」
+        # （長さ min_ngram_len 以上の一致1件ごとに、その長さを加点）
+        match_matrix = target_scorer.score_population(pop)
+        for ind, match_scores in zip(pop, match_matrix.tolist()):
             # ターゲット間で平均をとることで、「最初の文」「最後の文」を一様に扱う
             if num_targets > 0:
                 avg_match_score = sum(match_scores) / num_targets
@@ -233,6 +219,20 @@ for gen in range(num_generations):
             ind.wins = avg_match_score
             ind.losses = 20  # 分母用の定数（大きめにしておけばOK）
 
+        # 収束したら止める（理由を表示する）
+        report = diversity.latest()
+        matched = [t for t in TARGET_TEXTS if any(t in ind.text for ind in pop)]
+        reached = num_targets > 0 and len(matched) >= TARGET_FRACTION * num_targets
+        if convergence.observe(
+            gen,
+            [ind.wins for ind in pop],
+            report.mean_similarity if report is not None else None,
+            target_reached=reached,
+            detail="、".join(matched) if reached else "",
+        ):
+            print(convergence.stopped.summary())
+            break
+
         # 進化ステップ
         pop = evolve_one_generation(
             pop,
@@ -243,5 +243,6 @@ for gen in range(num_generations):
         )
 
         print(f"=== Generation {gen+1} ===")
+        print(diversity.observe(gen + 1, pop).summary())
         for ind in pop[:1]:
             print(ind.id, len(ind.text), ind.text[:100])
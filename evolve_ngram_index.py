@@ -0,0 +1,267 @@
+"""
+ターゲット文章の n-gram 索引（一般化接尾辞オートマトン）。
+
+extract_ngrams のように長さ min_len 以上の部分文字列を全部集合に入れると、
+ターゲットの長さ L に対して O(L^2) 個の文字列を持つことになる。
+接尾辞オートマトンならターゲットの総文字数に比例した状態数（2L 以下）で、
+「この部分文字列はターゲットに含まれるか」「ここで終わる一番長い一致は何文字か」に答えられる。
+
+    index = NgramIndex(["わたしがりょうてをひろげても"])
+    index.contains("りょうて")       # -> True
+    index.score(text, min_len=3)     # -> 旧 ngram スコアと同じ値
+"""
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+
+def ngram_score_from_lengths(lengths: Iterable[int], min_len: int = 3) -> int:
+    """
+    各終了位置での最長一致長 l から、長さ min_len..l の一致の長さを全部足す。
+    （旧実装の「一致した部分文字列ごとに length を加点」と同じ値になる）
+    """
+    base = min_len * (min_len - 1) // 2
+    total = 0
+    for l in lengths:
+        if l >= min_len:
+            total += l * (l + 1) // 2 - base
+    return total
+
+
+class NgramIndex:
+    """複数のターゲット文字列の部分文字列すべてを受理する接尾辞オートマトン"""
+
+    def __init__(self, texts: Iterable[str]):
+        self._next: List[Dict[str, int]] = [{}]
+        self._link: List[int] = [-1]
+        self._len: List[int] = [0]
+        self.max_len = 0
+        self.total_len = 0
+        for text in texts:
+            self.add(text)
+
+    def _new_state(self, length: int, link: int, trans: Dict[str, int]) -> int:
+        self._next.append(trans)
+        self._link.append(link)
+        self._len.append(length)
+        return len(self._len) - 1
+
+    def _extend(self, last: int, ch: str) -> int:
+        nxt, link, length = self._next, self._link, self._len
+
+        # 別のターゲットで同じ遷移がすでにある場合（一般化接尾辞オートマトン）
+        q = nxt[last].get(ch)
+        if q is not None:
+            if length[last] + 1 == length[q]:
+                return q
+            clone = self._new_state(length[last] + 1, link[q], dict(nxt[q]))
+            p = last
+            while p != -1 and nxt[p].get(ch) == q:
+                nxt[p][ch] = clone
+                p = link[p]
+            link[q] = clone
+            return clone
+
+        cur = self._new_state(length[last] + 1, 0, {})
+        p = last
+        while p != -1 and ch not in nxt[p]:
+            nxt[p][ch] = cur
+            p = link[p]
+        if p != -1:
+            q = nxt[p][ch]
+            if length[p] + 1 == length[q]:
+                link[cur] = q
+            else:
+                clone = self._new_state(length[p] + 1, link[q], dict(nxt[q]))
+                while p != -1 and nxt[p].get(ch) == q:
+                    nxt[p][ch] = clone
+                    p = link[p]
+                link[q] = clone
+                link[cur] = clone
+        return cur
+
+    def add(self, text: str) -> None:
+        """ターゲットを1つ追加する"""
+        last = 0
+        for ch in text:
+            last = self._extend(last, ch)
+        self.max_len = max(self.max_len, len(text))
+        self.total_len += len(text)
+
+    def __len__(self) -> int:
+        """状態数（メモリ使用量の目安）"""
+        return len(self._len)
+
+    def contains(self, s: str) -> bool:
+        """s がどれかのターゲットの部分文字列なら True"""
+        nxt = self._next
+        state = 0
+        for ch in s:
+            state = nxt[state].get(ch, -1)
+            if state < 0:
+                return False
+        return True
+
+    def longest_match_at(self, text: str, start: int = 0) -> int:
+        """text[start:] の先頭から、ターゲットに含まれる最長の長さ"""
+        nxt = self._next
+        state = 0
+        n = 0
+        for i in range(start, len(text)):
+            state = nxt[state].get(text[i], -1)
+            if state < 0:
+                break
+            n += 1
+        return n
+
+    def matching_lengths(self, text: str) -> List[int]:
+        """
+        各位置 j について、text[:j + 1] の接尾辞のうちターゲットに含まれる最長の長さを返す。
+        部分文字列の性質上、それより短い接尾辞もすべてターゲットに含まれる。O(len(text))。
+        """
+        return self.matching_lengths_from(text, 0, len(text))
+
+    def matching_lengths_from(self, text: str, start: int, stop: int) -> List[int]:
+        """
+        text[start:stop] を start から読み直したときの最長一致長（位置 start..stop-1 の分）。
+        一致が start より前にはみ出せないので、正しい値にしたいときは start を十分手前から始める。
+        """
+        nxt, link, length = self._next, self._link, self._len
+        out: List[int] = []
+        state = 0
+        l = 0
+        for i in range(start, stop):
+            ch = text[i]
+            while state and ch not in nxt[state]:
+                state = link[state]
+                l = length[state]
+            state = nxt[state].get(ch, 0)
+            l = l + 1 if state else 0
+            out.append(l)
+        return out
+
+    def rematch(self, text: str, lengths: List[int], first: int, last: int, base: List[int]) -> Tuple[int, int]:
+        """
+        text の一部が書き換わったときに、matching_lengths の結果 lengths を必要な所だけ直す。
+        first..last が書き換わった範囲（first より前の lengths は正しい前提）、
+        base[j] は last より後ろで今の lengths[j] に入っている値（書き換え前の文字列での値）。
+        last 以降で、新しい一致も base の一致も last に届かなくなった位置で止める。
+        直した範囲 (first, stop) を返す。
+        """
+        nxt, link, length = self._next, self._link, self._len
+        # first - 1 で終わる最長一致の先頭から読み直せば、first 以降の値は正確になる
+        # （それより前の位置は途中から読んだ分だけ短く出るので書き込まない）
+        j = first - (lengths[first - 1] if first > 0 else 0)
+        state = 0
+        l = 0
+        n = len(text)
+        while j < n:
+            ch = text[j]
+            while state and ch not in nxt[state]:
+                state = link[state]
+                l = length[state]
+            state = nxt[state].get(ch, 0)
+            l = l + 1 if state else 0
+            j += 1
+            if j > first:
+                lengths[j - 1] = l
+                if j > last and l < j - last and base[j - 1] < j - last:
+                    break
+        return first, j
+
+    def score(self, text: str, min_len: int = 3) -> int:
+        """text の長さ min_len 以上の部分文字列のうち、ターゲットに含まれるものの長さの合計"""
+        return ngram_score_from_lengths(self.matching_lengths(text), min_len)
+
+
+# 1ターゲット分の部分スコア: (各位置の最長一致長, 各位置の加点)
+TargetState = Tuple[List[int], List[int]]
+
+
+class IncrementalNgramScorer:
+    """
+    複数ターゲットの n-gram スコアを、親の位置ごとの部分スコアから差分で計算する。
+
+    位置 j の値（j で終わる最長一致長）が変わりうるのは、一致が交叉位置 k や変異位置 p をまたぐ所だけ。
+    子では k（と p）の手前から読み直し、新しい一致も親の一致も書き換え位置に届かなくなった所で止める。
+    それ以外の位置は親の値をそのまま使う。
+    親子の対応と交叉位置・変異位置は evolve_one_generation の lineage（GenerationLineage）から取る。
+    """
+
+    def __init__(self, indexes: Sequence[NgramIndex], min_len: int = 3):
+        self.indexes = list(indexes)
+        self.min_len = min_len
+        longest = max((idx.max_len for idx in self.indexes), default=0)
+        base = min_len * (min_len - 1) // 2
+        self._points = [l * (l + 1) // 2 - base if l >= min_len else 0 for l in range(longest + 1)]
+
+    def full_state(self, text: str) -> List[TargetState]:
+        """差分を使わずに全位置を計算する（初期集団と検算用）"""
+        points = self._points
+        states = []
+        for idx in self.indexes:
+            lengths = idx.matching_lengths(text)
+            states.append((lengths, [points[l] for l in lengths]))
+        return states
+
+    @staticmethod
+    def scores(state: List[TargetState]) -> List[int]:
+        """ターゲットごとのスコア（旧実装の match_scores と同じ）"""
+        return [sum(contribs) for _, contribs in state]
+
+    def child_state(
+        self,
+        text: str,
+        parent1: List[TargetState],
+        parent2: List[TargetState],
+        crossover_point: int,
+        mutation_pos: int = -1,
+    ) -> List[TargetState]:
+        """text = 親1[:k] + 親2[k:]（位置 mutation_pos だけ置換済み）の部分スコアを差分で作る"""
+        points = self._points
+        k = crossover_point
+        n = len(text)
+        first = k if mutation_pos < 0 else min(k, mutation_pos)
+        last = max(k, mutation_pos)
+        states = []
+        for idx, (l1, c1), (l2, c2) in zip(self.indexes, parent1, parent2):
+            lengths = l1[:k] + l2[k:n]
+            contribs = c1[:k] + c2[k:n]
+            if first < n:
+                start, stop = idx.rematch(text, lengths, first, last, l2)
+                contribs[start:stop] = [points[l] for l in lengths[start:stop]]
+            states.append((lengths, contribs))
+        return states
+
+    def rescore_generation(
+        self,
+        population: Sequence,
+        parent_states: Dict[int, List[TargetState]],
+        lineage,
+        verify: bool = False,
+    ) -> Dict[int, List[TargetState]]:
+        """
+        evolve_one_generation で作った新しい集団の部分スコアを、親世代の部分スコア
+        parent_states（id -> 状態）と lineage（その世代の GenerationLineage）から作る。
+        verify=True なら全個体を全文再計算して一致を確かめる。
+        """
+        states: Dict[int, List[TargetState]] = {}
+        for slot, ind in enumerate(population):
+            if lineage.ids[slot] != ind.id:
+                raise ValueError(f"lineage slot {slot} is id {lineage.ids[slot]}, population has {ind.id}")
+            p1 = parent_states[lineage.parent1[slot]]
+            p2_id = lineage.parent2[slot]
+            if p2_id < 0:
+                state = p1  # エリートはそのままコピー
+            else:
+                state = self.child_state(
+                    ind.text,
+                    p1,
+                    parent_states[p2_id],
+                    lineage.crossover_point[slot],
+                    lineage.mutation_pos[slot],
+                )
+            if verify:
+                full = self.full_state(ind.text)
+                if full != state:
+                    raise AssertionError(f"incremental score mismatch for id {ind.id}: {ind.text!r}")
+            states[ind.id] = state
+        return states
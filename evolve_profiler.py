@@ -0,0 +1,312 @@
+"""
+API サーバーの実行中プロセスを、必要なときだけプロファイルする。
+
+エンドポイントを @profiler.wrap で包んでおき、管理用エンドポイントから
+「次の N リクエスト」か「これから S 秒」のあいだだけ計測を有効にする。
+  - deterministic: cProfile で関数呼び出しをすべて数える（.prof に保存。pstats / snakeviz で読める）
+  - sampling:      別スレッドが一定間隔でリクエスト処理中のスレッドのスタックを覗く（.folded に保存。
+                   flamegraph.pl などで読める）。計測中もリクエストはほとんど遅くならない
+終わったら呼び出しの多い関数の上位を JSON で返せる形にまとめる。
+
+計測していないときの wrap のコストは、属性を1つ読んで None か確かめるだけ。
+"""
+import cProfile
+import functools
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+PROFILE_DIR = Path("profiles")
+MODES = ("deterministic", "sampling")
+
+# (ファイル, 行, 関数名)
+FrameKey = Tuple[str, int, str]
+
+
+def format_frame_key(key: FrameKey) -> str:
+    filename, line, name = key
+    return f"{filename}:{line}({name})"
+
+
+class ProfileSession:
+    """1回分の計測。requests 件か seconds 秒のどちらか先に来たほうで終わる"""
+
+    def __init__(
+        self,
+        mode: str,
+        requests: Optional[int],
+        seconds: Optional[float],
+        interval: float,
+        top: int,
+        output_dir: Path,
+        on_finish: Callable[["ProfileSession"], None],
+    ):
+        if mode not in MODES:
+            raise ValueError(f"unknown mode {mode!r}, expected one of {MODES}")
+        if requests is None and seconds is None:
+            raise ValueError("either requests or seconds is required")
+        self.mode = mode
+        self.max_requests = requests
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.interval = interval
+        self.top = top
+        self.output_dir = Path(output_dir)
+        self.started_at = time.time()
+        self.requests_profiled = 0
+        self.result: Optional[dict] = None
+        self._on_finish = on_finish
+        self._lock = threading.Lock()
+        self._claimed = 0
+        self._done = threading.Event()
+
+        # deterministic: リクエストごとの cProfile をまとめた統計。
+        # cProfile は同時に1つしか有効にできない Python もあるので、計測は1リクエストずつ
+        self._stats: Optional[pstats.Stats] = None
+        self._cprofile_lock = threading.Lock()
+
+        # sampling: 計測対象のリクエストを処理中のスレッドと、集めたスタック
+        self._threads: Set[int] = set()
+        self._self_samples: Counter = Counter()
+        self._total_samples: Counter = Counter()
+        self._stacks: Counter = Counter()
+        self._num_samples = 0
+        self._sampler: Optional[threading.Thread] = None
+        if mode == "sampling":
+            self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+            self._sampler.start()
+
+    # ============
+    # リクエスト
+    # ============
+
+    def _expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _claim(self) -> bool:
+        """このリクエストを計測に数えてよければ True"""
+        with self._lock:
+            if self._done.is_set() or self._expired():
+                return False
+            if self.max_requests is not None and self._claimed >= self.max_requests:
+                return False
+            self._claimed += 1
+            return True
+
+    def _release_claim(self) -> None:
+        """計測できなかったリクエストの分を返して、次のリクエストが計測されるようにする"""
+        with self._lock:
+            self._claimed -= 1
+
+    def run(self, fn: Callable, args: tuple, kwargs: dict):
+        if not self._claim():
+            self.finish_if_due()
+            return fn(*args, **kwargs)
+        if self.mode == "deterministic" and not self._cprofile_lock.acquire(blocking=False):
+            # 別のリクエストを計測中。待たせずに計測なしで実行し、数えた分は次のリクエストに回す
+            self._release_claim()
+            return fn(*args, **kwargs)
+        try:
+            if self.mode == "deterministic":
+                return self._run_cprofile(fn, args, kwargs)
+            return self._run_sampled(fn, args, kwargs)
+        finally:
+            with self._lock:
+                self.requests_profiled += 1
+            self.finish_if_due()
+
+    def _run_cprofile(self, fn: Callable, args: tuple, kwargs: dict):
+        """_cprofile_lock を取った状態で呼ぶ（終わったら放す）"""
+        try:
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                prof.disable()
+                with self._lock:
+                    if self._stats is None:
+                        self._stats = pstats.Stats(prof)
+                    else:
+                        self._stats.add(prof)
+        finally:
+            self._cprofile_lock.release()
+
+    def _run_sampled(self, fn: Callable, args: tuple, kwargs: dict):
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads.add(ident)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._threads.discard(ident)
+
+    def _sample_loop(self) -> None:
+        me = threading.get_ident()
+        while not self._done.wait(self.interval):
+            with self._lock:
+                targets = set(self._threads)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident in targets:
+                    frame = frames.get(ident)
+                    if frame is None or ident == me:
+                        continue
+                    stack: List[FrameKey] = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                        frame = frame.f_back
+                    self._num_samples += 1
+                    self._self_samples[stack[0]] += 1
+                    for key in set(stack):
+                        self._total_samples[key] += 1
+                    self._stacks[";".join(k[2] for k in reversed(stack))] += 1
+            if self._expired():
+                self.finish()
+
+    # ============
+    # 終了
+    # ============
+
+    def finish_if_due(self) -> None:
+        with self._lock:
+            due = self._expired() or (
+                self.max_requests is not None and self.requests_profiled >= self.max_requests
+            )
+        if due:
+            self.finish()
+
+    def finish(self) -> dict:
+        """計測を止めてファイルに書き、結果を返す（2回目以降は同じ結果を返すだけ）"""
+        with self._lock:
+            if self._done.is_set():
+                return self.result
+            self._done.set()
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started_at))
+            stamp += f"_{int(self.started_at * 1000) % 1000:03d}"
+            if self.mode == "deterministic":
+                path = self.output_dir / f"profile_{stamp}.prof"
+                top = self._cprofile_top(path)
+            else:
+                path = self.output_dir / f"profile_{stamp}.folded"
+                top = self._sampling_top(path)
+            self.result = {
+                "mode": self.mode,
+                "requests_profiled": self.requests_profiled,
+                "duration_seconds": time.time() - self.started_at,
+                "file": str(path),
+                "top": top,
+            }
+            if self.mode == "sampling":
+                self.result["samples"] = self._num_samples
+        self._on_finish(self)
+        return self.result
+
+    def _cprofile_top(self, path: Path) -> List[dict]:
+        if self._stats is None:
+            path.write_bytes(b"")
+            return []
+        self._stats.dump_stats(str(path))
+        rows = sorted(self._stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+        return [
+            {
+                "function": format_frame_key(key),
+                "calls": nc,
+                "self_seconds": tt,
+                "cumulative_seconds": ct,
+            }
+            for key, (cc, nc, tt, ct, callers) in rows[: self.top]
+        ]
+
+    def _sampling_top(self, path: Path) -> List[dict]:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        total = max(self._num_samples, 1)
+        return [
+            {
+                "function": format_frame_key(key),
+                "self_samples": count,
+                "total_samples": self._total_samples[key],
+                "self_ratio": count / total,
+            }
+            for key, count in self._self_samples.most_common(self.top)
+        ]
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "requests_profiled": self.requests_profiled,
+                "max_requests": self.max_requests,
+                "seconds_left": None if self.deadline is None else max(0.0, self.deadline - time.monotonic()),
+            }
+
+
+class RequestProfiler:
+    """同時に動く計測は1つだけ。終わった計測の結果は last_result に残す"""
+
+    def __init__(self, output_dir: Path = PROFILE_DIR):
+        self.output_dir = Path(output_dir)
+        self.session: Optional[ProfileSession] = None
+        self.last_result: Optional[dict] = None
+        self._lock = threading.Lock()
+
+    def wrap(self, fn: Callable) -> Callable:
+        """エンドポイント関数を包む（計測していないときはそのまま呼ぶだけ）"""
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            session = self.session
+            if session is None:
+                return fn(*args, **kwargs)
+            return session.run(fn, args, kwargs)
+
+        return wrapper
+
+    def start(
+        self,
+        mode: str = "sampling",
+        requests: Optional[int] = None,
+        seconds: Optional[float] = None,
+        interval: float = 0.005,
+        top: int = 20,
+    ) -> ProfileSession:
+        """計測を始める。すでに計測中なら RuntimeError"""
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError("profiling is already running")
+            self.session = ProfileSession(
+                mode, requests, seconds, interval, top, self.output_dir, self._finished
+            )
+            return self.session
+
+    def _finished(self, session: ProfileSession) -> None:
+        with self._lock:
+            if self.session is session:
+                self.session = None
+            self.last_result = session.result
+
+    def stop(self) -> Optional[dict]:
+        """計測中なら止めて結果を返す。計測していなければ最後の結果"""
+        session = self.session
+        if session is not None:
+            return session.finish()
+        return self.last_result
+
+    def status(self) -> dict:
+        session = self.session
+        if session is not None:
+            session.finish_if_due()
+            session = self.session
+        return {
+            "running": session is not None,
+            "session": session.status() if session is not None else None,
+            "last_result": self.last_result,
+        }
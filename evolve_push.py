@@ -0,0 +1,167 @@
+"""
+API からブラウザへのサーバープッシュ（Server-Sent Events）。
+
+ブラウザは EventSource で /events につないでおくだけで、次のイベントを受け取れる。
+  hello       接続直後に1回。stream_id（/choice に付けると次のペアがこのストリームに届く）。
+              stream_id はプロセスごとのランダムな接頭辞つきなので、ワーカーをまたいでも重ならない
+  progress    投票数の進み具合。まとめて progress_interval 秒に1回まで送る
+  generation  世代が変わったとき（すぐに送る。古い世代のペアは捨てる）
+  pair        事前に選んだペア（/pair と同じ JSON）
+
+接続1つにつきスレッドは使わず、イベントループ上の Subscriber（最新のイベントとペアの待ち行列）を持つだけ。
+何もないときは keepalive 秒ごとにコメント行を送って、プロキシに切られないようにする。
+publish / push_pair はどのスレッドから呼んでもよい（同期のエンドポイントはスレッドプールで動く）。
+"""
+import asyncio
+import itertools
+import secrets
+import threading
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+# 上書きでまとめるイベント（送る順）
+COALESCED_EVENTS = ("generation", "progress")
+
+
+def format_sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+class Subscriber:
+    """つながっている1クライアント分の送信待ち"""
+
+    def __init__(self, stream_id: str, want_pairs: int):
+        self.stream_id = stream_id
+        self.want_pairs = want_pairs  # 世代が変わったときに何組送るか
+        self.latest: Dict[str, Tuple[int, str]] = {}  # event -> (世代, JSON)
+        self.pairs: Deque[Tuple[int, str]] = deque(maxlen=max(1, want_pairs) * 4)  # (世代, JSON)
+        self.generation = -1  # 最後に送った（送る予定の）世代
+        self.wake = asyncio.Event()
+
+
+class Broadcaster:
+    """/events につながっているクライアントへのイベントの配信"""
+
+    def __init__(self, keepalive: float = 15.0, progress_interval: float = 0.5, max_subscribers: int = 10000):
+        self.keepalive = keepalive
+        self.progress_interval = progress_interval
+        self.max_subscribers = max_subscribers
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: Dict[str, Subscriber] = {}
+        self._lock = threading.Lock()  # _subscribers はスレッドプールからも数える
+        # 別のワーカーのストリームと取り違えないように、連番にプロセスごとの接頭辞を付ける
+        self._prefix = secrets.token_hex(4)
+        self._ids = itertools.count(1)
+        self._pending: Dict[str, Tuple[int, str]] = {}  # まだ配っていない上書きイベント
+        self._flush_scheduled = False
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """配信に使うイベントループ（lifespan で呼ぶ）"""
+        self._loop = loop
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribers(self) -> List[Subscriber]:
+        with self._lock:
+            return list(self._subscribers.values())
+
+    # ============
+    # 接続（イベントループ上で呼ぶ）
+    # ============
+
+    def subscribe(self, want_pairs: int = 1) -> Subscriber:
+        """新しいクライアントを登録する。max_subscribers に達していたら RuntimeError"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise RuntimeError("too many event stream subscribers")
+            sub = Subscriber(f"{self._prefix}-{next(self._ids)}", want_pairs)
+            self._subscribers[sub.stream_id] = sub
+            return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            self._subscribers.pop(sub.stream_id, None)
+
+    async def stream(self, sub: Subscriber, first: List[str]) -> AsyncIterator[str]:
+        """sub に届いたイベントを SSE の形で返し続ける（切断されたら登録を外す）"""
+        try:
+            yield "retry: 3000\n\n"
+            for frame in first:
+                yield frame
+            while True:
+                try:
+                    await asyncio.wait_for(sub.wake.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                sub.wake.clear()
+                frames = []
+                for event in COALESCED_EVENTS:
+                    generation, data = sub.latest.pop(event, (-1, ""))
+                    if data and generation >= sub.generation:
+                        frames.append(format_sse(event, data))
+                while sub.pairs:
+                    generation, data = sub.pairs.popleft()
+                    if generation >= sub.generation:
+                        frames.append(format_sse("pair", data))
+                if frames:
+                    yield "".join(frames)
+        finally:
+            self.unsubscribe(sub)
+
+    # ============
+    # 配信（どのスレッドからでもよい）
+    # ============
+
+    def _call(self, fn, *args) -> bool:
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self._subscribers:
+            return False
+        loop.call_soon_threadsafe(fn, *args)
+        return True
+
+    def publish(self, event: str, generation: int, data: str, immediate: bool = False) -> None:
+        """
+        全員に generation の世代の event を送る。同じ event はまだ送っていない古いほうを上書きする。
+        immediate でなければ progress_interval 秒ぶんまとめてから配る。
+        """
+        self._call(self._enqueue, event, generation, data, immediate)
+
+    def _enqueue(self, event: str, generation: int, data: str, immediate: bool) -> None:
+        self._pending[event] = (generation, data)
+        if immediate:
+            self._flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_later(self.progress_interval, self._flush)
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, {}
+        for sub in self.subscribers():
+            sub.latest.update(pending)
+            sub.wake.set()
+
+    def push_generation(self, generation: int, data: str) -> None:
+        """世代が変わったことをすぐに全員へ送る（それより前の世代のペアは送らない）"""
+        self._call(self._set_generation, generation, data)
+
+    def _set_generation(self, generation: int, data: str) -> None:
+        self._pending["generation"] = (generation, data)
+        for sub in self.subscribers():
+            sub.generation = max(sub.generation, generation)
+        self._flush()
+
+    def push_pair(self, stream_id: str, generation: int, data: str) -> bool:
+        """stream_id のクライアントにペアを1組送る。このプロセスにつながっていなければ False"""
+        if stream_id not in self._subscribers:
+            return False
+        return self._call(self._add_pair, stream_id, generation, data)
+
+    def _add_pair(self, stream_id: str, generation: int, data: str) -> None:
+        sub = self._subscribers.get(stream_id)
+        if sub is None:
+            return
+        sub.pairs.append((generation, data))
+        sub.wake.set()
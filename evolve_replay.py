@@ -0,0 +1,337 @@
+"""
+API サーバーのイベントログ（追記のみ）とスナップショットから、任意の世代の集団を復元する。
+
+イベントは1行1件の JSON:
+    {"type": "init",   "run_id": ..., "generation": 0, "seed": ..., "population_size": ...}
+    {"type": "choice", "run_id": ..., "generation": g, "pair_id": ..., "indiv_a_id": ..., ...}
+    {"type": "evolve", "run_id": ..., "generation": g, "new_generation": g + 1, "seed": ..., ...}
+
+evolve に next_id があれば、その世代は id を世代をまたいで一意にして進化させている
+（エリートは id を持ち越し、wins / losses は IndividualIndex で累積する）。
+ない evolve は以前の形式（世代ごとに id を 0 から振り直し、その世代の投票だけで数える）。
+evolve の next_indiv_id はその evolve のあとに次に払い出す個体 id（選別で捨てた子どもの id も飛ばす）で、
+再起動後もこれより小さい id は使わない。
+
+evolve の直前までに記録された choice が、その evolve で集計されたログ全体になる。
+スナップショットは N 世代ごとに snapshot_<run_id>_<世代>.json として保存し、
+その時点のイベントログのバイト位置を持っているので、復元ではそこから先だけを読む。
+
+使い方:
+    python evolve_replay.py 500                  # 世代 500 を復元して上位を表示
+    python evolve_replay.py 500 --ndjson > g500.jsonl
+"""
+import argparse
+import json
+import random
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from evolve_engine import (
+    Individual,
+    IndividualIndex,
+    PairLog,
+    aggregate_results_from_logs,
+    evolve_one_generation,
+    initialize_population,
+    next_individual_id,
+    renumber_population,
+    select_population,
+)
+from evolve_json import dumps_line, loads
+
+EVENT_LOG_PATH = Path("events.jsonl")
+SNAPSHOT_DIR = Path("snapshots")
+
+
+class EventLog:
+    """追記専用のイベントログ。append はスレッドセーフで、書き込んだ行の先頭バイト位置を返す"""
+
+    def __init__(self, path: Path = EVENT_LOG_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def append(self, event: dict) -> int:
+        line = dumps_line(event)
+        with self._lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(line)
+        return offset
+
+    def extend(self, events: Iterable[dict]) -> None:
+        """複数のイベントをまとめて追記する（ファイルを開くのは1回）"""
+        data = b"".join(dumps_line(event) for event in events)
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(data)
+
+    def size(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+
+def iter_events(path: Path = EVENT_LOG_PATH, offset: int = 0) -> Iterator[Tuple[int, dict]]:
+    """offset バイト目から (行の先頭バイト位置, イベント) を順に返す"""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        pos = offset
+        for raw in f:
+            line_start = pos
+            pos += len(raw)
+            raw = raw.strip()
+            if raw:
+                yield line_start, loads(raw)
+
+
+def new_seed() -> int:
+    """記録用の seed。共有の乱数状態には触らない"""
+    return random.SystemRandom().getrandbits(63)
+
+
+# ============
+# スナップショット
+# ============
+
+
+def snapshot_path(snapshot_dir: Path, run_id: str, generation: int) -> Path:
+    return Path(snapshot_dir) / f"snapshot_{run_id}_{generation:06d}.json"
+
+
+def save_snapshot(
+    snapshot_dir: Path,
+    run_id: str,
+    generation: int,
+    population: List[Individual],
+    event_offset: int,
+    next_pair_id: int = 0,
+    next_indiv_id: int = 0,
+) -> Path:
+    """
+    集団を [id, text, wins, losses, fitness] の配列で保存する。
+    event_offset はこのスナップショットより後のイベントが始まるバイト位置。
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    path = snapshot_path(snapshot_dir, run_id, generation)
+    data = {
+        "run_id": run_id,
+        "generation": generation,
+        "event_offset": event_offset,
+        "next_pair_id": next_pair_id,
+        "next_indiv_id": next_indiv_id,
+        "population": [[ind.id, ind.text, ind.wins, ind.losses, ind.fitness] for ind in population],
+    }
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    tmp.replace(path)
+    return path
+
+
+def load_snapshot(path: Path) -> Tuple[int, int, List[Individual], int, int]:
+    """(世代, event_offset, 集団, next_pair_id, next_indiv_id) を返す（next_indiv_id のない以前の形式は 0）"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    generation = data["generation"]
+    population = [
+        Individual(id=i, text=text, wins=wins, losses=losses, fitness=fitness, generation=generation)
+        for i, text, wins, losses, fitness in data["population"]
+    ]
+    return generation, data["event_offset"], population, data.get("next_pair_id", 0), data.get("next_indiv_id", 0)
+
+
+def find_nearest_snapshot(snapshot_dir: Path, run_id: str, generation: float) -> Optional[Path]:
+    """generation 以下で一番新しいスナップショットを探す"""
+    best: Optional[Tuple[int, Path]] = None
+    for path in Path(snapshot_dir).glob(f"snapshot_{run_id}_*.json"):
+        try:
+            gen = int(path.stem.rsplit("_", 1)[1])
+        except ValueError:
+            continue
+        if gen <= generation and (best is None or gen > best[0]):
+            best = (gen, path)
+    return None if best is None else best[1]
+
+
+# ============
+# リプレイ
+# ============
+
+
+def find_run(path: Path = EVENT_LOG_PATH, run_id: Optional[str] = None) -> Tuple[str, int, dict]:
+    """
+    init イベントを探して (run_id, その行のバイト位置, init イベント) を返す。
+    run_id 省略時は最後の run。
+    """
+    found: Optional[Tuple[str, int, dict]] = None
+    for offset, event in iter_events(path):
+        if event.get("type") != "init":
+            continue
+        if run_id is None or event["run_id"] == run_id:
+            found = (event["run_id"], offset, event)
+            if run_id is not None:
+                break
+    if found is None:
+        raise ValueError(f"no init event for run {run_id!r} in {path}")
+    return found
+
+
+def apply_evolve_event(
+    population: List[Individual],
+    logs: List[PairLog],
+    event: dict,
+    out: Optional[List[Individual]] = None,
+    individuals: Optional[IndividualIndex] = None,
+) -> List[Individual]:
+    """
+    API の /evolve と同じ手順で1世代進める。
+    代理モデルで選別した世代は、generated_size 個作ってから記録された kept の位置だけ残す。
+    out は evolve_one_generation の out（使い終わった2世代前の集団を使い回す）。
+    next_id のある evolve では individuals（世代をまたいで持ち回る索引）で累積の wins / losses を数える。
+    """
+    next_id = event.get("next_id")
+    if next_id is None:
+        aggregate_results_from_logs(population, logs)
+    else:
+        if individuals is None:
+            individuals = IndividualIndex()
+        individuals.observe(population, event["generation"])
+        individuals.add_votes(logs)
+        individuals.apply(population)
+    new_population = evolve_one_generation(
+        population=population,
+        population_size=event.get("generated_size", event["population_size"]),
+        elite_size=event["elite_size"],
+        mutation_rate=event["mutation_rate"],
+        next_generation_index=event["new_generation"],
+        selection=event.get("selection", "roulette"),
+        rng=random.Random(event["seed"]),
+        out=out,
+        next_id=next_id,
+    )
+    if "kept" in event:
+        if next_id is None:
+            new_population = renumber_population(new_population, event["kept"])
+        else:
+            new_population = select_population(new_population, event["kept"])
+    if next_id is not None:
+        # 索引には生き残っている個体だけを残す
+        individuals.observe(new_population, event["new_generation"])
+        individuals.prune(event["new_generation"])
+    return new_population
+
+
+class ReplayState(NamedTuple):
+    run_id: str
+    generation: int
+    population: List[Individual]
+    pending_logs: List[PairLog]  # generation の世代で、まだ evolve に使われていない投票
+    next_pair_id: int  # 次に払い出す pair_id
+    next_indiv_id: int  # 次に払い出す個体 id（これまでに払い出したどの id よりも大きい）
+
+
+def replay_state(
+    generation: Optional[int] = None,
+    event_log_path: Path = EVENT_LOG_PATH,
+    snapshot_dir: Path = SNAPSHOT_DIR,
+    run_id: Optional[str] = None,
+) -> ReplayState:
+    """
+    世代 generation の集団（その世代の投票を集計する前の状態）を復元する。
+    一番近いスナップショットから始めて、それ以降のイベントだけを再生する。
+    generation を省略するとログの最後まで再生する（サーバー再起動時の復元用）。
+    """
+    run_id, init_offset, init_event = find_run(event_log_path, run_id)
+
+    target = generation if generation is not None else float("inf")
+    snapshot = find_nearest_snapshot(snapshot_dir, run_id, target)
+    next_pair_id = 0
+    next_indiv_id = 0
+    if snapshot is not None:
+        current, offset, population, next_pair_id, next_indiv_id = load_snapshot(snapshot)
+    else:
+        current = init_event["generation"]
+        offset = init_offset
+        population = initialize_population(
+            size=init_event["population_size"],
+            generation=current,
+            rng=random.Random(init_event["seed"]),
+        )
+
+    logs: List[PairLog] = []
+    spare: Optional[List[Individual]] = None  # 2世代前の集団（次の世代の入れ物に使い回す）
+    individuals = IndividualIndex()
+    for _, event in iter_events(event_log_path, offset):
+        if event.get("run_id") != run_id:
+            continue
+        kind = event.get("type")
+        if kind == "evolve" and current >= target:
+            break
+        if kind == "choice":
+            next_pair_id = max(next_pair_id, event["pair_id"] + 1)
+            logs.append(
+                PairLog(
+                    pair_id=event["pair_id"],
+                    indiv_a_id=event["indiv_a_id"],
+                    indiv_b_id=event["indiv_b_id"],
+                    chosen=event["chosen"],
+                    timestamp=event.get("timestamp"),
+                )
+            )
+        elif kind == "evolve" and event["generation"] == current:
+            if "next_id" not in event:
+                individuals = IndividualIndex()  # id を振り直す形式の世代。索引は次に使うときに作り直す
+            population, spare = (
+                apply_evolve_event(population, logs, event, out=spare, individuals=individuals),
+                population,
+            )
+            current = event["new_generation"]
+            next_pair_id = max(next_pair_id, event.get("next_pair_id", 0))
+            next_indiv_id = max(next_indiv_id, event.get("next_indiv_id", 0))
+            logs = []
+
+    if generation is not None and current != generation:
+        raise ValueError(f"generation {generation} not reached (log ends at generation {current})")
+    # next_indiv_id を記録していない以前のログでは、集団の最大の id + 1 から続ける
+    next_indiv_id = max(next_indiv_id, next_individual_id(population))
+    return ReplayState(run_id, current, population, logs, next_pair_id, next_indiv_id)
+
+
+def replay(
+    generation: int,
+    event_log_path: Path = EVENT_LOG_PATH,
+    snapshot_dir: Path = SNAPSHOT_DIR,
+    run_id: Optional[str] = None,
+) -> List[Individual]:
+    """世代 generation の集団を復元する（replay_state の集団だけ返す版）"""
+    return replay_state(generation, event_log_path, snapshot_dir, run_id).population
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="イベントログから世代を復元する")
+    parser.add_argument("generation", type=int)
+    parser.add_argument("--events", type=Path, default=EVENT_LOG_PATH)
+    parser.add_argument("--snapshots", type=Path, default=SNAPSHOT_DIR)
+    parser.add_argument("--run", default=None, help="run_id（省略時は最後の run）")
+    parser.add_argument("--ndjson", action="store_true", help="集団を NDJSON で標準出力に書く")
+    args = parser.parse_args()
+
+    pop = replay(args.generation, args.events, args.snapshots, args.run)
+    if args.ndjson:
+        for ind in pop:
+            print(json.dumps(
+                {"id": ind.id, "text": ind.text, "wins": ind.wins, "losses": ind.losses,
+                 "fitness": ind.fitness, "generation": ind.generation},
+                ensure_ascii=False,
+            ))
+    else:
+        print(f"=== Generation {args.generation} ({len(pop)} individuals) ===")
+        for ind in pop[:10]:
+            print(ind.id, len(ind.text), ind.text[:50], "wins=", ind.wins)
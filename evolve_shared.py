@@ -0,0 +1,310 @@
+"""
+複数のワーカープロセス（uvicorn --workers N）で API の状態を共有するための SQLite バックエンド。
+外部のサービスはいらず、SQLite のファイル1つだけを使う（標準ライブラリの sqlite3）。
+
+    state       run_id / generation / eval_count / next_pair_id / next_indiv_id（1行だけ）
+    population  現世代の集団（スナップショットと同じ [id, text, wins, losses, fitness] の配列の JSON）
+    surrogate   代理モデル（pickle）。/evolve したワーカーが学習して書き戻す
+    pairs       払い出したペアの台帳（SharedPairRegistry。どのワーカーに届いた票でも確かめられる）
+    buckets     /choice のクライアントごとのトークンバケット（SharedTokenBucketLimiter。ワーカーの数によらず同じ上限）
+
+各ワーカーは現世代の集団をメモリに持ち、リクエストのたびに state の1行だけを読んで、
+世代が変わっていれば集団を読み直す。投票の追記と /evolve は lock()（BEGIN IMMEDIATE）で
+プロセスをまたいで1つずつ行うので、/evolve を実行するのは常に1つのワーカーだけになる。
+pair_id は take_pair_id() で1つずつ払い出すので、ワーカー間で重ならない。
+"""
+import json
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import time
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from evolve_engine import Individual
+from evolve_ingest import IssuedPair
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key INTEGER PRIMARY KEY CHECK (key = 0),
+    run_id TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    eval_count INTEGER NOT NULL,
+    next_pair_id INTEGER NOT NULL,
+    next_indiv_id INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS population (
+    key INTEGER PRIMARY KEY CHECK (key = 0),
+    generation INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS surrogate (
+    key INTEGER PRIMARY KEY CHECK (key = 0),
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    pair_id INTEGER PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    indiv_a_id INTEGER NOT NULL,
+    indiv_b_id INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pairs_expires ON pairs (expires);
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated);
+"""
+
+
+class SharedCounters(NamedTuple):
+    run_id: str
+    generation: int
+    eval_count: int
+    next_pair_id: int
+    next_indiv_id: int = 0
+
+
+def encode_population(population: List[Individual]) -> str:
+    return json.dumps(
+        [[ind.id, ind.text, ind.wins, ind.losses, ind.fitness] for ind in population], ensure_ascii=False
+    )
+
+
+def decode_population(data: str, generation: int) -> List[Individual]:
+    return [
+        Individual(id=i, text=text, wins=wins, losses=losses, fitness=fitness, generation=generation)
+        for i, text, wins, losses, fitness in json.loads(data)
+    ]
+
+
+class SharedState:
+    """SQLite ファイル1つに置いた、ワーカープロセス間で共有する API の状態"""
+
+    def __init__(self, path: Union[str, Path], timeout: float = 60.0):
+        self.path = Path(path)
+        self.timeout = timeout
+        self._local = threading.local()
+        conn = self._conn()
+        # WAL なら書き込み中も読み込みが止まらない
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection) -> None:
+        """以前のファイルの state に next_indiv_id の列を足す（0 なら /evolve は集団の最大の id + 1 から続ける）"""
+        conn.execute("BEGIN IMMEDIATE")  # 同時に起動したワーカーが二重に足さないように
+        try:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(state)")}
+            if "next_indiv_id" not in columns:
+                conn.execute("ALTER TABLE state ADD COLUMN next_indiv_id INTEGER NOT NULL DEFAULT 0")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _conn(self) -> sqlite3.Connection:
+        """スレッドごとの接続（autocommit。トランザクションは lock() などで明示する）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        """
+        プロセスをまたいだ排他（書き込みトランザクション）。中で呼んだ read / publish も同じトランザクションに入る。
+        同じスレッドで入れ子にはできない。
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def read(self) -> Optional[SharedCounters]:
+        """共有の run がまだなければ None"""
+        row = self._conn().execute(
+            "SELECT run_id, generation, eval_count, next_pair_id, next_indiv_id FROM state WHERE key = 0"
+        ).fetchone()
+        return None if row is None else SharedCounters(*row)
+
+    def read_population(self) -> Tuple[Optional[SharedCounters], List[Individual]]:
+        """state と集団を食い違いなく読む（lock() の中でも外でもよい）"""
+        conn = self._conn()
+        own = not conn.in_transaction
+        if own:
+            conn.execute("BEGIN")
+        try:
+            counters = self.read()
+            row = conn.execute("SELECT generation, data FROM population WHERE key = 0").fetchone()
+        finally:
+            if own:
+                conn.execute("COMMIT")
+        if counters is None or row is None:
+            return counters, []
+        return counters, decode_population(row[1], row[0])
+
+    def take_pair_id(self, count: int = 1) -> int:
+        """pair_id を count 個続けて払い出し、最初の番号を返す"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE state SET next_pair_id = next_pair_id + ? WHERE key = 0", (count,))
+            row = conn.execute("SELECT next_pair_id - ? FROM state WHERE key = 0", (count,)).fetchone()
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        if row is None:
+            raise RuntimeError("shared state has no run yet")
+        return row[0]
+
+    def publish(
+        self,
+        counters: SharedCounters,
+        population: Optional[List[Individual]] = None,
+        surrogate: Any = None,
+    ) -> None:
+        """state を書き換える。population / surrogate を渡せばそれも差し替える（lock() の中で呼ぶ）"""
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO state (key, run_id, generation, eval_count, next_pair_id, next_indiv_id) "
+            "VALUES (0, ?, ?, ?, ?, ?)",
+            tuple(counters),
+        )
+        if population is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO population (key, generation, data) VALUES (0, ?, ?)",
+                (counters.generation, encode_population(population)),
+            )
+        if surrogate is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO surrogate (key, data) VALUES (0, ?)",
+                (pickle.dumps(surrogate, protocol=pickle.HIGHEST_PROTOCOL),),
+            )
+
+    def load_surrogate(self) -> Any:
+        """保存された代理モデル（なければ None）"""
+        row = self._conn().execute("SELECT data FROM surrogate WHERE key = 0").fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+
+class SharedPairRegistry:
+    """evolve_ingest.PairRegistry と同じ使い方で、台帳を SharedState の pairs テーブルに置く"""
+
+    def __init__(self, state: SharedState, ttl: float = 600.0, max_size: int = 100000):
+        self.state = state
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def issue_many(self, pairs: Iterable[Tuple[int, int, int, int]], now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        rows = [(*pair, now + self.ttl) for pair in pairs]
+        if not rows:
+            return
+        conn = self.state._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO pairs (pair_id, generation, indiv_a_id, indiv_b_id, expires) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute("DELETE FROM pairs WHERE expires <= ?", (now,))
+            # pair_id は連番なので、新しいほうから max_size 件だけ残す
+            conn.execute("DELETE FROM pairs WHERE pair_id <= ?", (max(r[0] for r in rows) - self.max_size,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def peek(self, pair_id: int, now: Optional[float] = None) -> Optional[IssuedPair]:
+        now = time.time() if now is None else now
+        row = self.state._conn().execute(
+            "SELECT pair_id, generation, indiv_a_id, indiv_b_id, expires FROM pairs WHERE pair_id = ?", (pair_id,)
+        ).fetchone()
+        if row is None or row[4] <= now:
+            return None
+        return IssuedPair(*row)
+
+    def consume(self, pair_id: int, now: Optional[float] = None) -> Optional[IssuedPair]:
+        return self.consume_many([pair_id], now)[0]
+
+    def consume_many(self, pair_ids: Iterable[int], now: Optional[float] = None) -> List[Optional[IssuedPair]]:
+        """lock() の中では呼べない（自分でトランザクションを張る）"""
+        now = time.time() if now is None else now
+        conn = self.state._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = [
+                conn.execute(
+                    "DELETE FROM pairs WHERE pair_id = ? RETURNING pair_id, generation, indiv_a_id, indiv_b_id, expires",
+                    (pair_id,),
+                ).fetchall()  # 読み切ってから次へ進む
+                for pair_id in pair_ids
+            ]
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return [IssuedPair(*row[0]) if row and row[0][4] > now else None for row in rows]
+
+
+class SharedTokenBucketLimiter:
+    """
+    evolve_ingest.TokenBucketLimiter と同じ使い方で、バケットを SharedState の buckets テーブルに置く。
+    ワーカーごとにバケットを持つと、クライアントは実質ワーカー数倍の票を入れられるため。
+    1回の take がプロセスをまたいだ書き込みトランザクションになるので、イベントループの外で呼ぶ（blocking）。
+    """
+
+    blocking = True
+
+    def __init__(self, state: SharedState, rate: float, burst: float, prune_every: int = 1000):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.state = state
+        self.rate = rate
+        self.burst = burst
+        self.prune_every = prune_every
+        self._takes = 0
+
+    def take(self, key: str, now: Optional[float] = None) -> float:
+        """トークンを1つ使う。使えたら 0、足りなければ次の1つがたまるまでの秒数"""
+        # ワーカーをまたいで比べるので time.monotonic ではなく time.time
+        now = time.time() if now is None else now
+        conn = self.state._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, last = row if row is not None else (self.burst, now)
+            # 時計がワーカー間で少しずれていても、トークンが減る向きには動かさない
+            tokens = min(self.burst, tokens + max(0.0, now - last) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now)
+            )
+            self._takes += 1
+            if self._takes % self.prune_every == 0:
+                # burst / rate 秒使われていないバケットは満タンに戻っているので、消しても同じ
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self.burst / self.rate,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return wait
+
+    def __len__(self) -> int:
+        return self.state._conn().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
@@ -0,0 +1,194 @@
+"""
+投票ログ（PairLog）から学習する、人間の好みの代理モデル（surrogate）。
+
+文字 1〜3-gram をハッシュした特徴 x(text) の線形モデル u(text) = w・x(text) を持ち、
+「A が B に選ばれる確率」を sigmoid(u(A) - u(B)) とする（Bradley-Terry 型のロジスティック回帰）。
+世代ごとの投票で少しずつ学習し（AdaGrad）、子どもを多めに作ったときに
+u が低い（負けそうな）子を人間に見せる前に落とすのに使う。
+
+精度は「学習する前にその世代の投票を予測させる」方式で測る。
+まだ学習に使っていない投票なので、そのまま held-out の正解率になる。
+
+    surrogate = PreferenceSurrogate()
+    stats = surrogate.update_from_logs(population, logs)  # 予測→採点→学習
+    keep = surrogate.prescreen(children, keep=180, rng=rng)
+"""
+import random
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from evolve_engine import Individual, PairLog
+from evolve_kernels import HASH_BASE, encode_texts
+
+# 疎な特徴行列（行, 列, 値）
+SparseFeatures = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class PreferenceSurrogate:
+    """ハッシュした文字 n-gram 特徴の Bradley-Terry ロジスティック回帰"""
+
+    def __init__(
+        self,
+        feature_bits: int = 16,
+        orders: Sequence[int] = (1, 2, 3),
+        learning_rate: float = 0.5,
+        l2: float = 1e-4,
+        epochs: int = 5,
+    ):
+        self.feature_bits = feature_bits
+        self.num_features = 1 << feature_bits
+        self.orders = tuple(orders)
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.epochs = epochs
+        self.weights = np.zeros(self.num_features)
+        self._grad_sq = np.zeros(self.num_features)  # AdaGrad の勾配二乗和
+
+        self.trained_votes = 0
+        self.evaluated_votes = 0
+        self.correct_votes = 0
+        self.last_accuracy: Optional[float] = None
+
+    # ============
+    # 特徴量
+    # ============
+
+    def features(self, texts: Sequence[str]) -> SparseFeatures:
+        """各テキストの n-gram をハッシュして、(行, 特徴番号, 値) の疎行列にする。行ごとに L2 正規化"""
+        codes, lengths = encode_texts(texts)
+        shift = np.uint64(64 - self.feature_bits)
+        width = codes.shape[1]
+        rows_list, cols_list = [], []
+        for n in self.orders:
+            if width < n:
+                continue
+            num_windows = width - n + 1
+            # 次数ごとに初期値を変えて、"あ" の 1-gram と 2-gram などが同じハッシュにならないようにする
+            h = np.full((codes.shape[0], num_windows), n, dtype=np.uint64)
+            for k in range(n):
+                h = h * HASH_BASE + codes[:, k : k + num_windows]
+            valid = np.arange(num_windows)[None, :] + n <= lengths[:, None]
+            rows_list.append(np.nonzero(valid)[0])
+            cols_list.append(((h[valid] * HASH_BASE) >> shift).astype(np.int64))
+        if not rows_list:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+        rows = np.concatenate(rows_list)
+        cols = np.concatenate(cols_list)
+        counts = np.bincount(rows, minlength=len(texts)).astype(np.float64)
+        vals = 1.0 / np.sqrt(counts[rows])
+        return rows, cols, vals
+
+    def _utilities(self, feats: SparseFeatures, num_rows: int) -> np.ndarray:
+        rows, cols, vals = feats
+        return np.bincount(rows, weights=self.weights[cols] * vals, minlength=num_rows)
+
+    def utilities(self, texts: Sequence[str]) -> np.ndarray:
+        """u(text)。大きいほど人間に選ばれやすいと予測している"""
+        return self._utilities(self.features(texts), len(texts))
+
+    # ============
+    # 学習・評価
+    # ============
+
+    def _pairs_from_logs(
+        self, population: Sequence[Individual], logs: Sequence[PairLog]
+    ) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        """(テキスト, A の行, B の行, A が選ばれたら 1) に変換する。集団にない id の投票は捨てる"""
+        slot = {ind.id: i for i, ind in enumerate(population)}
+        a_rows, b_rows, a_won = [], [], []
+        for log in logs:
+            a = slot.get(log.indiv_a_id)
+            b = slot.get(log.indiv_b_id)
+            if a is None or b is None or log.chosen not in ("A", "B"):
+                continue
+            a_rows.append(a)
+            b_rows.append(b)
+            a_won.append(1.0 if log.chosen == "A" else 0.0)
+        texts = [ind.text for ind in population]
+        return (
+            texts,
+            np.array(a_rows, dtype=np.int64),
+            np.array(b_rows, dtype=np.int64),
+            np.array(a_won, dtype=np.float64),
+        )
+
+    def update_from_logs(self, population: Sequence[Individual], logs: Sequence[PairLog]) -> Dict[str, object]:
+        """
+        その世代の投票を、まず今のモデルで予測して正解率を記録し（held-out 評価）、そのあと学習する。
+        """
+        texts, a_rows, b_rows, a_won = self._pairs_from_logs(population, logs)
+        if a_won.size == 0:
+            return self.stats()
+        feats = self.features(texts)
+
+        if self.trained_votes > 0:
+            u = self._utilities(feats, len(texts))
+            # 引き分け（u が同じ）は外れとして数える
+            predicted_a = u[a_rows] > u[b_rows]
+            predicted_b = u[a_rows] < u[b_rows]
+            correct = int(np.count_nonzero(np.where(a_won == 1.0, predicted_a, predicted_b)))
+            self.correct_votes += correct
+            self.evaluated_votes += a_won.size
+            self.last_accuracy = correct / a_won.size
+
+        self._fit(feats, len(texts), a_rows, b_rows, a_won)
+        self.trained_votes += a_won.size
+        return self.stats()
+
+    def _fit(
+        self, feats: SparseFeatures, num_rows: int, a_rows: np.ndarray, b_rows: np.ndarray, a_won: np.ndarray
+    ) -> None:
+        rows, cols, vals = feats
+        for _ in range(self.epochs):
+            u = self._utilities(feats, num_rows)
+            p = 1.0 / (1.0 + np.exp(-(u[a_rows] - u[b_rows])))
+            g = (a_won - p) / a_won.size
+            # 対数尤度の勾配: 各テキストに (勝った分 - 予測) の係数を集めてから特徴に配る
+            coef = np.bincount(a_rows, weights=g, minlength=num_rows) - np.bincount(b_rows, weights=g, minlength=num_rows)
+            grad = np.bincount(cols, weights=coef[rows] * vals, minlength=self.num_features)
+            grad -= self.l2 * self.weights
+            self._grad_sq += grad * grad
+            self.weights += self.learning_rate * grad / (np.sqrt(self._grad_sq) + 1e-8)
+
+    def accuracy(self) -> Optional[float]:
+        """これまでの held-out 正解率（まだ評価していなければ None）"""
+        if self.evaluated_votes == 0:
+            return None
+        return self.correct_votes / self.evaluated_votes
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "trained_votes": self.trained_votes,
+            "evaluated_votes": self.evaluated_votes,
+            "holdout_accuracy": self.accuracy(),
+            "last_generation_accuracy": self.last_accuracy,
+        }
+
+    # ============
+    # 事前選別
+    # ============
+
+    def prescreen(
+        self,
+        candidates: Sequence[Individual],
+        keep: int,
+        rng: Optional[random.Random] = None,
+        explore: float = 0.1,
+    ) -> List[int]:
+        """
+        candidates のうち残す keep 個の位置（昇順）を返す。
+        u が高い順に残すが、explore の割合だけは残りからランダムに選ぶ
+        （モデルの思い込みだけで集団が固まらないように）。
+        """
+        rng = rng or random
+        n = len(candidates)
+        if keep >= n:
+            return list(range(n))
+        u = self.utilities([ind.text for ind in candidates])
+        ranked = np.argsort(-u, kind="stable").tolist()
+        num_random = min(int(keep * explore), n - keep)
+        kept = ranked[: keep - num_random]
+        kept += rng.sample(ranked[keep - num_random :], num_random)
+        return sorted(kept)
@@ -0,0 +1,453 @@
+"""
+ハイパーパラメータ（mutation_rate / elite_size / population_size など）のスイープ。
+
+設定の組み合わせをグリッドかランダムサンプリングで作り、試行（設定 × seed）をプロセスプールで並列に回す。
+結果は「実験名・設定・seed」のハッシュをキーに .sweep_cache/ へ保存するので、
+同じスイープを流し直すと終わった試行は飛ばす。最後に設定ごとの平均で順位表を出す。
+
+    python evolve_sweep.py hiragana --grid mutation_rate=0.1,0.3,0.5 elite_size=5,10,20 --repeats 3
+    python evolve_sweep.py hiragana --grid selection=roulette,tournament,truncation --set generations=100
+    python evolve_sweep.py ngram --random 20 --param mutation_rate=0.01..0.5 population_size=50..400
+    python evolve_sweep.py mymodule:run --grid ...   # (config, seed) -> 指標の dict を返す関数なら何でもよい
+
+実験関数は (config: dict, seed: int) -> dict（数値の指標）で、プロセスをまたぐのでモジュールの
+トップレベルに置く。組み込みの hiragana / ngram は evolve_engine で進化させ、
+ConvergenceMonitor で伸びなくなったら generations より前に止める。
+設定の "charset" は初期集団と変異に使う文字集合（省略時、hiragana は evolve_hiragana.py と同じ
+英数字・記号まじりの CHARSET、ngram は evolve_engine.CHARSET）。
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Union
+
+from evolve_engine import (
+    CHARSET,
+    SELECTION_STRATEGIES,
+    ConvergenceMonitor,
+    evolve_one_generation,
+    initialize_population,
+)
+
+DEFAULT_CACHE_DIR = Path(".sweep_cache")
+# 結果の形や実験の中身が変わったら上げる（古いキャッシュを使わないように）
+CACHE_VERSION = 2
+
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "population_size": 200,
+    "elite_size": 10,
+    "mutation_rate": 0.3,
+    "selection": "roulette",
+    "generations": 300,
+    "window": 50,  # ConvergenceMonitor の window
+    "losses": 20,  # スクリプトと同じく、スコアを wins、定数を losses にして fitness を作る
+}
+
+HIRAGANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+
+DEFAULT_TARGETS = [
+    "わたしがりょうてをひろげても",
+    "おそらはちっともとべないが",
+    "とべることりはわたしのように",
+    "じめんをはやくはしれない",
+    "みんなちがってみんないい",
+]
+
+Experiment = Callable[[Dict[str, Any], int], Dict[str, Any]]
+
+
+# ============
+# 設定
+# ============
+
+
+def validate_config(config: Dict[str, Any]) -> List[str]:
+    """進化の設定としておかしい所を返す（空なら OK）"""
+    problems = []
+    size = config.get("population_size")
+    elite = config.get("elite_size")
+    rate = config.get("mutation_rate")
+    if not isinstance(size, int) or size < 2:
+        problems.append(f"population_size must be an int >= 2, got {size!r}")
+    if not isinstance(elite, int) or elite < 0:
+        problems.append(f"elite_size must be an int >= 0, got {elite!r}")
+    elif isinstance(size, int) and elite >= size:
+        # エリートで集団が埋まると子どもが作られず、進化しない
+        problems.append(f"elite_size ({elite}) must be smaller than population_size ({size})")
+    if not isinstance(rate, (int, float)) or not 0 <= rate <= 1:
+        problems.append(f"mutation_rate is a probability in [0, 1], got {rate!r}")
+    if config.get("selection") not in SELECTION_STRATEGIES:
+        problems.append(f"selection must be one of {sorted(SELECTION_STRATEGIES)}, got {config.get('selection')!r}")
+    generations = config.get("generations")
+    if not isinstance(generations, int) or generations < 1:
+        problems.append(f"generations must be an int >= 1, got {generations!r}")
+    return problems
+
+
+def grid_configs(base: Dict[str, Any], grid: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    """base に grid の全組み合わせを上書きした設定のリスト"""
+    configs = [dict(base)]
+    for name, values in grid.items():
+        configs = [dict(config, **{name: value}) for config in configs for value in values]
+    return configs
+
+
+# ランダムサーチの範囲: 値のリスト（そこから選ぶ）か (下限, 上限)（両方 int なら整数）
+ParamSpace = Union[Sequence[Any], tuple]
+
+
+def random_configs(
+    base: Dict[str, Any], space: Dict[str, ParamSpace], num: int, rng: random.Random
+) -> List[Dict[str, Any]]:
+    """space から num 個の設定をサンプリングする（同じ設定が出たら1つにまとめる）"""
+    configs: Dict[str, Dict[str, Any]] = {}
+    for _ in range(num):
+        config = dict(base)
+        for name, spec in space.items():
+            if isinstance(spec, tuple):
+                lo, hi = spec
+                if isinstance(lo, int) and isinstance(hi, int):
+                    config[name] = rng.randint(lo, hi)
+                else:
+                    config[name] = rng.uniform(lo, hi)
+            else:
+                config[name] = rng.choice(list(spec))
+        configs.setdefault(canonical_json(config), config)
+    return list(configs.values())
+
+
+def canonical_json(obj: Any) -> str:
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def trial_key(experiment: str, config: Dict[str, Any], seed: int) -> str:
+    """キャッシュのキー（実験名・設定・seed のハッシュ）"""
+    payload = canonical_json({"v": CACHE_VERSION, "experiment": experiment, "config": config, "seed": seed})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+
+# ============
+# 組み込みの実験
+# ============
+
+
+def _run_evolution(config: Dict[str, Any], seed: int, score: Callable[[List], List[float]]) -> Dict[str, Any]:
+    """score(集団) -> 個体ごとのスコア で評価しながら進化させ、最後の世代の指標を返す"""
+    rng = random.Random(seed)
+    t0 = time.perf_counter()
+    charset = config.get("charset", CHARSET)
+    pop = initialize_population(config["population_size"], rng=rng, charset=charset)
+    monitor = ConvergenceMonitor(window=config["window"])
+    scores: List[float] = []
+    for gen in range(config["generations"]):
+        scores = score(pop)
+        for ind, s in zip(pop, scores):
+            ind.wins = s
+            ind.losses = config["losses"]
+        if monitor.observe(gen, scores):
+            break
+        pop = evolve_one_generation(
+            pop,
+            population_size=config["population_size"],
+            elite_size=config["elite_size"],
+            mutation_rate=config["mutation_rate"],
+            next_generation_index=gen + 1,
+            selection=config["selection"],
+            rng=rng,
+            charset=charset,
+        )
+    else:
+        scores = score(pop)
+    stopped = monitor.stopped
+    return {
+        "best": max(scores),
+        "mean": sum(scores) / len(scores),
+        "generations": stopped.generation if stopped is not None else config["generations"],
+        "stop_reason": stopped.reason if stopped is not None else "generations",
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+def hiragana_experiment(config: Dict[str, Any], seed: int) -> Dict[str, Any]:
+    """
+    evolve_hiragana.py と同じく、英数字・記号まじりの文字集合から作った文字列のひらがなの数をスコアにする
+    （ひらがなだけの文字集合で進化させると、どの設定でもスコアが文字数になって比べられない）
+    """
+    from evolve_hiragana import CHARSET as HIRAGANA_SCRIPT_CHARSET
+    from evolve_kernels import CharClasses
+
+    classes = CharClasses({"hiragana": HIRAGANA})
+    config = dict({"charset": HIRAGANA_SCRIPT_CHARSET}, **config)
+    return _run_evolution(config, seed, lambda pop: classes.count_population(pop)["hiragana"].tolist())
+
+
+def ngram_experiment(config: Dict[str, Any], seed: int) -> Dict[str, Any]:
+    """evolve_multi_*.py と同じく、ターゲットごとの n-gram スコアの平均をスコアにする"""
+    from evolve_kernels import BatchNgramScorer
+
+    targets = config.get("targets", DEFAULT_TARGETS)
+    scorer = BatchNgramScorer(targets, min_len=config.get("min_ngram_len", 3))
+    return _run_evolution(config, seed, lambda pop: (scorer.score_population(pop).sum(axis=1) / len(targets)).tolist())
+
+
+EXPERIMENTS: Dict[str, Experiment] = {
+    "hiragana": hiragana_experiment,
+    "ngram": ngram_experiment,
+}
+
+
+def resolve_experiment(name: str) -> Experiment:
+    """組み込みの名前か "モジュール:関数" から実験関数を取り出す"""
+    if name in EXPERIMENTS:
+        return EXPERIMENTS[name]
+    module, sep, attr = name.partition(":")
+    if not sep:
+        raise ValueError(f"unknown experiment {name!r} (choose from {sorted(EXPERIMENTS)} or use module:function)")
+    return getattr(importlib.import_module(module), attr)
+
+
+# ============
+# 実行
+# ============
+
+
+class TrialResult(NamedTuple):
+    config: Dict[str, Any]
+    seed: int
+    metrics: Dict[str, Any]
+    cached: bool
+
+
+def _run_trial(experiment: str, config: Dict[str, Any], seed: int) -> Dict[str, Any]:
+    """ワーカープロセスで1試行を実行する"""
+    return resolve_experiment(experiment)(config, seed)
+
+
+def _cache_path(cache_dir: Path, experiment: str, key: str) -> Path:
+    return cache_dir / experiment.replace(":", "_") / f"{key}.json"
+
+
+def _load_cached(path: Path) -> Optional[Dict[str, Any]]:
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["metrics"]
+    except (ValueError, KeyError):
+        return None  # 書きかけなどで読めないものはやり直す
+
+
+def _store(path: Path, experiment: str, config: Dict[str, Any], seed: int, metrics: Dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"experiment": experiment, "config": config, "seed": seed, "metrics": metrics}, f, ensure_ascii=False)
+    tmp.replace(path)
+
+
+def run_sweep(
+    experiment: str,
+    configs: Iterable[Dict[str, Any]],
+    repeats: int = 1,
+    seed: int = 0,
+    workers: Optional[int] = None,
+    cache_dir: Path = DEFAULT_CACHE_DIR,
+    validate: bool = True,
+    progress: Optional[Callable[[TrialResult, int, int], None]] = None,
+) -> List[TrialResult]:
+    """
+    configs × repeats の試行を回す。r 回目の試行の seed は seed + r（設定をまたいで同じ seed で比べる）。
+    キャッシュにある試行は実行しない。validate=True なら、おかしな設定が1つでもあれば何も実行せず ValueError。
+    workers=1 ならプロセスプールを使わずにこのプロセスで順に実行する。
+    """
+    resolve_experiment(experiment)  # 名前の間違いは先に知らせる
+    configs = list(configs)
+    if validate:
+        problems = [
+            f"{canonical_json(config)}: {problem}" for config in configs for problem in validate_config(config)
+        ]
+        if problems:
+            raise ValueError("invalid configs:\n  " + "\n  ".join(problems))
+
+    cache_dir = Path(cache_dir)
+    results: List[TrialResult] = []
+    pending = []
+    for config in configs:
+        for r in range(repeats):
+            trial_seed = seed + r
+            path = _cache_path(cache_dir, experiment, trial_key(experiment, config, trial_seed))
+            metrics = _load_cached(path)
+            if metrics is not None:
+                results.append(TrialResult(config, trial_seed, metrics, cached=True))
+            else:
+                pending.append((config, trial_seed, path))
+
+    total = len(results) + len(pending)
+    if progress is not None:
+        for done, result in enumerate(results, 1):
+            progress(result, done, total)
+
+    def finish(config, trial_seed, path, metrics) -> None:
+        _store(path, experiment, config, trial_seed, metrics)
+        result = TrialResult(config, trial_seed, metrics, cached=False)
+        results.append(result)
+        if progress is not None:
+            progress(result, len(results), total)
+
+    if workers == 1:
+        for config, trial_seed, path in pending:
+            finish(config, trial_seed, path, _run_trial(experiment, config, trial_seed))
+    elif pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_run_trial, experiment, config, trial_seed): (config, trial_seed, path)
+                for config, trial_seed, path in pending
+            }
+            for future in as_completed(futures):
+                finish(*futures[future], future.result())
+    return results
+
+
+# ============
+# 集計
+# ============
+
+
+def summarize(results: Sequence[TrialResult], objective: str = "best") -> List[Dict[str, Any]]:
+    """設定ごとに数値の指標を平均し、objective の平均が大きい順に並べる（objective_std は標準偏差）"""
+    groups: Dict[str, List[TrialResult]] = {}
+    for result in results:
+        groups.setdefault(canonical_json(result.config), []).append(result)
+    rows = []
+    for trials in groups.values():
+        row: Dict[str, Any] = {"config": trials[0].config, "trials": len(trials)}
+        names = [k for k, v in trials[0].metrics.items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+        for name in names:
+            values = [t.metrics[name] for t in trials]
+            row[name] = sum(values) / len(values)
+        values = [t.metrics[objective] for t in trials]
+        mean = sum(values) / len(values)
+        row[f"{objective}_std"] = math.sqrt(sum((v - mean) ** 2 for v in values) / len(values))
+        reasons = sorted({str(t.metrics.get("stop_reason")) for t in trials if "stop_reason" in t.metrics})
+        if reasons:
+            row["stop_reason"] = "/".join(reasons)
+        rows.append(row)
+    rows.sort(key=lambda row: row[objective], reverse=True)
+    return rows
+
+
+def format_table(rows: Sequence[Dict[str, Any]], params: Sequence[str], objective: str = "best") -> str:
+    """summarize の結果を、動かしたパラメータと主な指標の表にする"""
+    metric_names = [objective, f"{objective}_std"] + [
+        name for name in ("mean", "generations", "seconds") if name != objective and rows and name in rows[0]
+    ]
+    header = ["rank"] + list(params) + metric_names + ["trials", "stop"]
+    lines = [header]
+    for rank, row in enumerate(rows, 1):
+        cells = [str(rank)] + [_fmt(row["config"].get(p)) for p in params]
+        cells += [_fmt(row.get(name)) for name in metric_names]
+        cells += [str(row["trials"]), row.get("stop_reason", "")]
+        lines.append(cells)
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    return "\n".join("  ".join(cell.rjust(w) for cell, w in zip(line, widths)) for line in lines)
+
+
+def _fmt(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return "" if value is None else str(value)
+
+
+# ============
+# コマンドライン
+# ============
+
+
+def _parse_value(text: str) -> Any:
+    """"10" -> 10, "0.3" -> 0.3, それ以外は文字列のまま"""
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_grid(items: Sequence[str]) -> Dict[str, List[Any]]:
+    """["mutation_rate=0.1,0.3", ...] -> {"mutation_rate": [0.1, 0.3], ...}"""
+    grid = {}
+    for item in items:
+        name, sep, values = item.partition("=")
+        if not sep or not values:
+            raise ValueError(f"expected name=v1,v2,... but got {item!r}")
+        grid[name] = [_parse_value(v) for v in values.split(",")]
+    return grid
+
+
+def parse_space(items: Sequence[str]) -> Dict[str, ParamSpace]:
+    """["mutation_rate=0.01..0.5", "selection=roulette,tournament"] -> 範囲かリスト"""
+    space: Dict[str, ParamSpace] = {}
+    for item in items:
+        name, sep, spec = item.partition("=")
+        if not sep or not spec:
+            raise ValueError(f"expected name=lo..hi or name=v1,v2,... but got {item!r}")
+        if ".." in spec:
+            lo, hi = spec.split("..", 1)
+            space[name] = (_parse_value(lo), _parse_value(hi))
+        else:
+            space[name] = [_parse_value(v) for v in spec.split(",")]
+    return space
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ハイパーパラメータのスイープ")
+    parser.add_argument("experiment", help=f"実験 {sorted(EXPERIMENTS)} か module:function")
+    parser.add_argument("--grid", nargs="*", default=[], help="name=v1,v2,... の全組み合わせ")
+    parser.add_argument("--random", type=int, default=0, help="--param の範囲からこの数だけ設定をサンプリング")
+    parser.add_argument("--param", nargs="*", default=[], help="name=lo..hi か name=v1,v2,...（--random 用）")
+    parser.add_argument("--set", nargs="*", default=[], help="全試行で共通の name=value（generations=500 など）")
+    parser.add_argument("--repeats", type=int, default=3, help="設定ごとの試行回数（seed を変える）")
+    parser.add_argument("--seed", type=int, default=0, help="最初の試行の seed")
+    parser.add_argument("--workers", type=int, default=None, help=f"並列数（省略時 {os.cpu_count()}）")
+    parser.add_argument("--objective", default="best", help="順位に使う指標")
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--top", type=int, default=20, help="表に出す設定の数")
+    args = parser.parse_args()
+
+    base = dict(DEFAULT_CONFIG)
+    for item in args.set:
+        name, _, value = item.partition("=")
+        base[name] = _parse_value(value)
+    if args.random:
+        space = parse_space(args.param)
+        configs = random_configs(base, space, args.random, random.Random(args.seed))
+        params = list(space)
+    else:
+        grid = parse_grid(args.grid)
+        configs = grid_configs(base, grid)
+        params = list(grid)
+
+    def show_progress(result: TrialResult, done: int, total: int) -> None:
+        tag = "cached" if result.cached else f"{result.metrics.get('seconds', 0):.1f}s"
+        print(f"[{done}/{total}] seed={result.seed} {tag} {args.objective}={result.metrics.get(args.objective)}")
+
+    t0 = time.perf_counter()
+    try:
+        results = run_sweep(
+            args.experiment, configs, args.repeats, args.seed, args.workers, args.cache_dir, progress=show_progress
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{len(results)} trials ({sum(not r.cached for r in results)} run) in {time.perf_counter() - t0:.1f}s\n")
+    rows = summarize(results, args.objective)
+    print(format_table(rows[: args.top], params, args.objective))
+    if len(rows) > 1 and len({(row[args.objective], row[f"{args.objective}_std"]) for row in rows}) == 1:
+        # どの設定でも同じ値なら、順位は意味を持たない（スコアが上限に張りついているなど）
+        print(f"\nwarning: every config scored {args.objective}={rows[0][args.objective]}; the experiment cannot tell them apart")